@@ -1,2 +1,5 @@
 from .device_factory import DeviceFactory
 from .arduino import Arduino
+from .async_arduino import AsyncArduino, AsyncDeviceFactory
+from .recorder import PacketRecorder, Recording
+from .replay_arduino import ReplayArduino
@@ -1,51 +1,189 @@
 import os
 import time
+import heapq
+import itertools
+import collections
 import queue
+import select
+import selectors
 import threading
 import multiprocessing
+from concurrent.futures import Future
 
 from .packet import Packet
 from .default_params import *
 from .device_port import DevicePort
+from .shared_ring import SharedRingBuffer
+from .recorder import PacketRecorder
+from .format_cache import FormatCache
+from .overload_buffer import OverloadBuffer
+from .device_stats import DeviceStats, PACKETS_READ, PARSE_ERRORS, COMMANDS_SENT, COMMANDS_DROPPED, PACKETS_DROPPED, \
+    LOOP_ITERATIONS, CLOCK_OFFSET, CLOCK_DRIFT, CLOCK_SAMPLES, CALLS_TIMED_OUT, OUTAGE_START_TIME
+from .clock_sync import ClockSync
+from .binary_protocol import FRAME_DATA, FRAME_TIME
 
 
 class Arduino:
-    def __init__(self, whoiam, factory, baud=115200, use_multiprocessing=True):
+    supports_reconnect = True  # whether the factory's supervisor can hand this Arduino a new port
+    is_async = False  # started and stopped from an asyncio event loop instead of a device loop
+
+    def __init__(self, whoiam, factory, baud=115200, use_multiprocessing=True, use_selector=True,
+                 use_shared_memory=False, shared_memory_capacity=SHARED_MEMORY_CAPACITY, use_binary_protocol=False,
+                 use_hub=False, record_path=None, write_batch_size=WRITE_BATCH_SIZE,
+                 write_flush_deadline=WRITE_FLUSH_DEADLINE, read_queue_capacity=None,
+                 overload_policy=OVERLOAD_BLOCK, reconnect=False):
+        """
+        :param whoiam: whoiam ID of the board to connect to
+        :param factory: DeviceFactory instance shared by all Arduinos
+        :param baud: baud rate to switch to after starting. BAUD_AUTO negotiates the fastest of BAUD_CANDIDATES
+            the link carries without errors (see DevicePort.negotiate_baud). baud is set to the chosen rate
+        :param use_multiprocessing: run the device loop in its own process instead of a thread
+        :param use_selector: block on the serial port and write queue instead of polling at
+            PORT_UPDATES_PER_SECOND. Polling is always used on Windows.
+        :param use_shared_memory: send packets from the device process through a shared memory ring buffer
+            instead of pickling them through the read queue. Batches with strings, ints past 64 bits or more
+            than SHARED_MEMORY_MAX_FIELDS values still use the read queue, merged back in order by the
+            consumer. Only applies with multiprocessing.
+        :param shared_memory_capacity: number of packets the ring buffer holds
+        :param use_binary_protocol: have the board send COBS framed binary packets instead of text.
+            Falls back to text if the firmware doesn't support it.
+        :param use_hub: don't run a device loop for this Arduino. Instead one of the factory's hubs
+            (see DeviceHub) serves it along with the other hub Arduinos. Not available on Windows.
+        :param record_path: record every packet to this file (see PacketRecorder). Read it back with Recording
+        :param write_batch_size: most queued commands to send in one serial write
+        :param write_flush_deadline: seconds after taking a command off the write queue to send it, even if
+            more commands are still coming in
+        :param read_queue_capacity: most packets waiting to be read. None doesn't limit the read queue.
+            With shared memory this only bounds packets that don't go in the ring. When the ring is full,
+            OVERLOAD_BLOCK waits for room and the other policies send new packets to the read queue
+        :param overload_policy: what the device loop does with new packets when the read queue is full.
+            One of OVERLOAD_POLICIES (see default_params). OVERLOAD_BLOCK stops reading the serial port, so
+            the board's data piles up in the OS's buffer instead. With use_hub, it stalls the whole hub.
+            The others hold packets back in the device loop and drop what doesn't fit, so the read queue
+            and the held packets stay within read_queue_capacity. OVERLOAD_DROP_OLDEST and
+            OVERLOAD_KEEP_LATEST also take stale packets back off the read queue, so the consumer catches up
+            to fresh data. Without shared memory, drop-oldest can go over capacity by one batch.
+            OVERLOAD_KEEP_LATEST holds new packets until the consumer took everything queued, so the read
+            queue has at most one packet of each name. It keeps at most read_queue_capacity names
+        :param reconnect: when the serial port goes away, keep the device loop, queues and callbacks and wait
+            for the factory's supervisor (see DeviceFactory.supervise) to find the board again instead of
+            stopping. Commands written in the meantime are sent once it's back. Outages are in stats
+        """
+        if overload_policy not in OVERLOAD_POLICIES:
+            raise ValueError("Unknown overload policy '%s'. Choose one of %s" % (overload_policy, OVERLOAD_POLICIES))
         if os.name == "nt":
             use_multiprocessing = False
+            use_selector = False
+            use_hub = False
+        if not use_multiprocessing:
+            use_shared_memory = False
+        if use_hub:
+            use_selector = True  # the hub waits on the write notifier
+
+        self.use_multiprocessing = use_multiprocessing
+        self.use_hub = use_hub
+        self.write_batch_size = write_batch_size
+        self.write_flush_deadline = write_flush_deadline
+        self.read_queue_capacity = read_queue_capacity
+        self.overload_policy = overload_policy
+        self.reconnect = reconnect
+
+        # packets taken off the read queue. The device loop compares it to the packets it put on the
+        # queue to know how full the queue is
+        self._packets_consumed = multiprocessing.Value("Q", 0, lock=False)
+        self._packets_queued = 0  # only used in the device loop
+        if read_queue_capacity is not None and overload_policy != OVERLOAD_BLOCK:
+            self._overload_buffer = OverloadBuffer(overload_policy, read_queue_capacity)
+        else:
+            self._overload_buffer = None
 
         self._device_port = None
+        self.shared_ring = None
+        self._read_notifier = None
         if use_multiprocessing:
             self._device_start_event = multiprocessing.Event()
             self._device_exit_event = multiprocessing.Event()
-            self._device_read_queue = multiprocessing.Queue()
-            self._device_write_queue = multiprocessing.Queue()
+            self._write_cleared_event = multiprocessing.Event()
+            if use_shared_memory:
+                self.shared_ring = SharedRingBuffer(shared_memory_capacity)
+                self._read_notifier = WakeupPipe()
+                self._owner_pid = os.getpid()
+
+                # packets that don't fit in the ring. Puts synchronously so the data is there when notified
+                self._device_read_queue = multiprocessing.SimpleQueue()
+            else:
+                self._device_read_queue = multiprocessing.Queue()
+            # SimpleQueue writes synchronously so the data is in the pipe before the device loop is woken up
+            self._device_write_queue = multiprocessing.SimpleQueue()
+            self._call_reply_queue = multiprocessing.Queue()
             self._device_read_lock = multiprocessing.Lock()
-            self._device_write_lock = multiprocessing.Lock()
             self._device_process = multiprocessing.Process(target=self._manage_device)
         else:
             self._device_start_event = threading.Event()
             self._device_exit_event = threading.Event()
+            self._write_cleared_event = threading.Event()
             self._device_read_queue = queue.Queue()
             self._device_write_queue = queue.Queue()
+            self._call_reply_queue = queue.Queue()
             self._device_read_lock = threading.Lock()
-            self._device_write_lock = threading.Lock()
             self._device_process = threading.Thread(target=self._manage_device)
 
+        # packets from the device come in batches. read() pops them off one at a time from here
+        self._read_buffer = collections.deque()
+
+        if use_selector:
+            self._write_notifier = WakeupPipe()
+        else:
+            self._write_notifier = None
+
+        self._stats = DeviceStats(use_multiprocessing)
+        self._init_device_state(whoiam, factory, baud, use_binary_protocol, record_path)
+
+        if use_hub:
+            self._factory.hub_clients.append(self)
+
+    def _init_device_state(self, whoiam, factory, baud, use_binary_protocol, record_path):
+        """State that doesn't depend on how the device loop is run"""
         self.whoiam = whoiam
         self.start_time = 0.0
         self.first_packet = None
         self._factory = factory
         self.baud = baud
+        self._auto_baud = baud == BAUD_AUTO
+        self._reconnect_info = None  # port info from the supervisor while the device loop is waiting for its board
+        self.use_binary_protocol = use_binary_protocol
+        self.record_path = record_path
         self.device_port = None
+        self._device_port_info = None  # port info claimed from the factory in _open_device
+        self._recorder = None  # created in the device loop so its writer thread runs there
 
         self._global_sequence_num = 0
         self._arduino_time = 0.0
+        self._format_cache = FormatCache()
+        self._clock_sync = ClockSync()
+        self._clock_sync_time = None  # board time of the last clock sample
         self._current_pause_command = None
+        # commands the device loop took off the write queue but hasn't sent because of a pause command
+        self._pending_writes = collections.deque()
+        self._scheduled_writes = []  # heap of (when, handle_id, packet) from write_at
+        self._next_handle_id = 0
+        self._packets_received = 0  # packets moved from the read queue to the read buffer
+        self._latest = {}  # packet name -> most recent packet moved to the read buffer
+        self._callbacks = {}  # packet name -> functions registered with on
+        self._dispatcher = None
+
+        self._call_send_times = {}  # call id -> time the device loop sent it
+        self._calls = {}  # call id -> (future, deadline, wait_for_reply) of calls that haven't been answered
+        self._calls_lock = threading.Lock()
+        self._next_call_id = 0
+        self._call_resolver = None
+        self._commands_queued = 0
+        self._clear_lock = threading.Lock()  # one clear_write_queue waits on the device loop at a time
         # self._prev_arduino_time = 0.0
         self._prev_receive_time = time.time()
 
         self._factory.arduino_exit_events.append(self._device_exit_event)
+        self._factory.arduinos.append(self)
 
     def _manage_device(self):
         try:
@@ -58,51 +196,396 @@ class Arduino:
         return not self._device_exit_event.is_set()
 
     def read(self, block=True, timeout=1):
-        try:
-            return self._device_read_queue.get(block, timeout)
-        except queue.Empty:
+        if len(self._read_buffer) == 0 and not self._fill_read_buffer(block, timeout):
             packet = Packet()
             packet.set_null_params()
             return packet
+        return self._read_buffer.popleft()
+
+    def read_batch(self, max_items=None, timeout=1):
+        """
+        Get all packets that are available in one call.
+
+        :param max_items: maximum number of packets to return. None returns everything available
+        :param timeout: seconds to wait if no packets are available. None waits forever, 0 doesn't wait
+        :return: a list of Packets. Empty if the timeout expired
+        """
+        if len(self._read_buffer) == 0 and not self._fill_read_buffer(timeout != 0, timeout or None):
+            return []
+
+        # collect batches that have already arrived without waiting
+        while (max_items is None or len(self._read_buffer) < max_items) and self._fill_read_buffer(False):
+            pass
+
+        if max_items is None or max_items >= len(self._read_buffer):
+            packets = list(self._read_buffer)
+            self._read_buffer.clear()
+        else:
+            packets = [self._read_buffer.popleft() for _ in range(max_items)]
+        return packets
+
+    def _fill_read_buffer(self, block, timeout=None):
+        """Move the next batch from the read queue into the local read buffer. Returns False if none arrived"""
+        if self.shared_ring is not None:
+            return self._fill_read_buffer_shared(block, timeout)
+        try:
+            batch = self._device_read_queue.get(block, timeout)
+        except queue.Empty:
+            return False
+        self._read_buffer.extend(batch)
+        self._update_latest(batch)
+        self._packets_received += len(batch)
+        self._packets_consumed.value += len(batch)
+        return True
+
+    def _fill_read_buffer_shared(self, block, timeout):
+        """
+        Collect packets from the shared memory ring and the overflow queue. Overflow batches are
+        tagged with the ring position they were sent at, so they're merged back in between the
+        ring records in the order the device loop read them
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            # clear before checking so a notification sent in between isn't lost
+            self._read_notifier.clear()
+
+            # take the overflow batches first. The ring records sent before them are always visible by then
+            overflow = collections.deque()
+            while not self._device_read_queue.empty():
+                position, batch = self._device_read_queue.get()
+                overflow.append((position, batch))
+                self._packets_consumed.value += len(batch)
+
+            buffer_size = len(self._read_buffer)
+            position = self.shared_ring.consumed()
+            for packet in self.shared_ring.read():
+                while len(overflow) > 0 and overflow[0][0] <= position:
+                    self._read_buffer.extend(overflow.popleft()[1])
+                self._read_buffer.append(packet)
+                position += 1
+            for position, batch in overflow:
+                self._read_buffer.extend(batch)
+
+            if len(self._read_buffer) > buffer_size:
+                self._update_latest(itertools.islice(self._read_buffer, buffer_size, None))
+                self._packets_received += len(self._read_buffer) - buffer_size
+                return True
+
+            if not block:
+                return False
+            if deadline is None:
+                remaining = None
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+            select.select([self._read_notifier], [], [], remaining)
+
+    def _update_latest(self, packets):
+        latest = self._latest
+        for packet in packets:
+            latest[packet.name] = packet
+
+    def latest(self, name, max_age=None):
+        """
+        Most recent packet named "name" without going through every packet. Packets count once they're
+        taken off the read queue by read, read_batch or the dispatcher thread (see start_dispatcher).
+
+        :param name: packet name
+        :param max_age: return None if the packet arrived more than this many seconds ago
+        :return: a Packet or None if there hasn't been one
+        """
+        packet = self._latest.get(name)
+        if packet is not None and max_age is not None and time.time() - packet.receive_time > max_age:
+            return None
+        return packet
+
+    def latest_age(self, name):
+        """Seconds since the most recent packet named "name" arrived. None if there hasn't been one"""
+        packet = self._latest.get(name)
+        if packet is None:
+            return None
+        return time.time() - packet.receive_time
+
+    def on(self, name, callback):
+        """
+        Call callback(packets) from the dispatcher thread with the packets named "name" in each batch
+        that arrives. Starts the dispatcher if it isn't running.
+        """
+        self._callbacks.setdefault(name, []).append(callback)
+        self.start_dispatcher()
+
+    def off(self, name, callback):
+        """Unregister a callback added with on"""
+        callbacks = self._callbacks.get(name, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+            if len(callbacks) == 0:
+                del self._callbacks[name]
+
+    def start_dispatcher(self):
+        """
+        Consume packets in a background thread that keeps latest current and calls the callbacks
+        registered with on. A control loop can then sample state with latest without reading every
+        packet. The dispatcher takes every packet, so don't call read or read_batch while it runs.
+        """
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(target=self._run_dispatcher, daemon=True)
+            self._dispatcher.start()
+
+    def _run_dispatcher(self):
+        while self._device_active() or not self.empty():
+            self._dispatch(self.read_batch(timeout=DISPATCHER_TIMEOUT))
+
+    def _dispatch(self, packets):
+        """Call the callbacks registered with on. Each one gets all of its packets from this batch at once"""
+        callbacks = self._callbacks
+        if len(callbacks) == 0:
+            return
+
+        batches = {}
+        for packet in packets:
+            if packet.name in callbacks:
+                if packet.name in batches:
+                    batches[packet.name].append(packet)
+                else:
+                    batches[packet.name] = [packet]
+
+        for name, batch in batches.items():
+            for callback in list(callbacks.get(name, ())):
+                try:
+                    callback(batch)
+                except BaseException as error:
+                    self._factory.logger.error("Callback for '%s' packets from '%s' failed: %s" % (
+                        name, self.whoiam, error))
 
     def empty(self):
-        return self._device_read_queue.empty()
+        if self.shared_ring is not None and self.shared_ring.available() > 0:
+            return False
+        return len(self._read_buffer) == 0 and self._device_read_queue.empty()
 
     def write(self, packet):
-        with self._device_write_lock:
-            self._device_write_queue.put(packet)
+        self._device_write_queue.put(packet)
+        self._commands_queued += 1
+        self._notify_device()
+
+    def write_at(self, packet, when):
+        """
+        Send a command at unix time "when". Scheduled commands are sent on time regardless of pause
+        commands or other commands in the write queue. Returns a ScheduledWrite that can cancel it.
+        """
+        handle = ScheduledWrite(self, self._next_handle_id, when)
+        self._next_handle_id += 1
+        self._device_write_queue.put(ScheduledCommand(packet, when, handle.handle_id))
+        self._commands_queued += 1
+        self._notify_device()
+        return handle
+
+    def write_after(self, packet, delay):
+        """Send a command "delay" seconds from now. See write_at"""
+        return self.write_at(packet, time.time() + delay)
 
     def write_pause(self, pause_time, relative_time=True):
         """
         Send a pause command. This prevents commands from being sent for "pause_time" seconds.
         If relative_time is False, pause_time is the unix timestamp that write will be unfrozen at.
         """
-        with self._device_write_lock:
-            self._device_write_queue.put(PauseCommand(pause_time, relative_time))
+        self._device_write_queue.put(PauseCommand(pause_time, relative_time))
+        self._commands_queued += 1
+        self._notify_device()
+
+    def _notify_device(self):
+        """Wake up the device loop if it's waiting on the serial port"""
+        if self._write_notifier is not None:
+            self._write_notifier.notify()
+
+    def call(self, packet, timeout=CALL_TIMEOUT, wait_for_reply=False):
+        """
+        Send a command the board acknowledges. The firmware answers "~ack:<id>" as soon as it reads the
+        command, and the sketch can send a reply with ArduinoFactoryBridge::reply.
+        Round trip latencies are in stats (call_latency_histogram, call_latency_mean).
+
+            future = arduino.call("set 100")
+            future.result()  # raises TimeoutError if the board didn't acknowledge it within a second
+
+        :param packet: command to send. Pause commands hold it back like any other command
+        :param timeout: seconds after calling to give up on an answer
+        :param wait_for_reply: resolve with the sketch's reply instead of the acknowledgement
+        :return: a concurrent.futures.Future resolved with None (acknowledged) or the reply string.
+            It fails with TimeoutError if there's no answer in time or RuntimeError if the Arduino stops
+        """
+        future = Future()
+        with self._calls_lock:
+            call_id = self._next_call_id
+            self._next_call_id += 1
+            self._calls[call_id] = (future, time.time() + timeout, wait_for_reply)
+            if self._call_resolver is None:
+                self._call_resolver = threading.Thread(target=self._run_call_resolver, daemon=True)
+                self._call_resolver.start()
+
+        self.write(CallCommand(call_id, packet))
+        return future
+
+    def _run_call_resolver(self):
+        """Resolve call futures with answers from the device loop and time out the ones that aren't answered"""
+        while True:
+            with self._calls_lock:
+                if len(self._calls) == 0 and not self._device_active():
+                    self._call_resolver = None
+                    return
+                next_deadline = min((call[1] for call in self._calls.values()), default=None)
 
-    def clear_write_queue(self):
-        with self._device_write_lock:
-            if not self._device_write_queue.empty():
-                self._factory.logger.debug("Clearing write queue for '%s'" % self.whoiam)
-                while not self._device_write_queue.empty():
-                    packet = self._device_write_queue.get()
-                    self._factory.logger.debug("Cleared packet: '%s'" % packet)
+            timeout = DISPATCHER_TIMEOUT
+            if next_deadline is not None:
+                timeout = max(0.0, min(timeout, next_deadline - time.time()))
+            try:
+                call_id, reply = self._call_reply_queue.get(timeout=timeout)
+            except queue.Empty:
+                call_id = None
+                reply = None
+
+            results = []
+            errors = []
+            with self._calls_lock:
+                call = self._calls.get(call_id)
+                if call is not None and (reply is not None or not call[2]):
+                    del self._calls[call_id]
+                    results.append((call[0], reply))
+
+                now = time.time()
+                for pending_id, (future, deadline, wait_for_reply) in list(self._calls.items()):
+                    if now > deadline:
+                        del self._calls[pending_id]
+                        self._stats.values[CALLS_TIMED_OUT] += 1
+                        errors.append((future, TimeoutError(
+                            "'%s' didn't answer call %d in time" % (self.whoiam, pending_id)
+                        )))
+                    elif not self._device_active():
+                        del self._calls[pending_id]
+                        errors.append((future, RuntimeError(
+                            "'%s' stopped before answering call %d" % (self.whoiam, pending_id)
+                        )))
+
+            # outside of the lock since done callbacks run here
+            for future, result in results:
+                if not future.done():
+                    future.set_result(result)
+            for future, error in errors:
+                if not future.done():
+                    future.set_exception(error)
+
+    def clear_write_queue(self, timeout=CLEAR_WRITE_QUEUE_TIMEOUT):
+        """
+        Drop every command and pause command written before this that hasn't been sent yet,
+        including scheduled commands. A pause that already started still runs out.
+        Once started, this waits for the device loop to drop them, so nothing written before it is sent
+        after it returns. Before start, they're dropped as soon as the device loop starts.
+
+        :param timeout: longest time to wait for the device loop
+        :return: False if the device loop didn't drop them within timeout
+        """
+        with self._clear_lock:
+            self._write_cleared_event.clear()
+            self._device_write_queue.put(ClearCommand())
+            self._notify_device()
+            if not self.is_started():
+                return True
+
+            deadline = time.time() + timeout
+            while not self._write_cleared_event.wait(min(SELECTOR_TIMEOUT, max(0.0, deadline - time.time()))):
+                if not self._device_active() or time.time() >= deadline:
+                    return False
+            return True
 
     def start(self):
         if self._device_start_event.is_set():
             self._factory.logger.warning("Start already called for '%s'" % self.whoiam)
             return None
+        self._open_device()
+        return self._start_device_loop()
+
+    @staticmethod
+    def start_many(arduinos, timeout=START_ALL_TIMEOUT):
+        """Start Arduinos made with the same factory at once. See DeviceFactory.start_all"""
+        if len(arduinos) == 0:
+            return {}
+        return arduinos[0]._factory.start_all(arduinos, timeout)
+
+    def _start_device_loop(self):
+        """Second half of start, once the port is open"""
+        if self.use_hub:
+            self._device_start_event.set()
+            self._factory.hub_client_started()
+        else:
+            self._device_process.start()
+            self._device_start_event.set()
+
+        self.first_packet = self._make_first_packet()
+        return self.first_packet
+
+    def is_started(self):
+        return self._device_start_event.is_set()
+
+    def is_streaming(self):
+        """True once the device loop has parsed a packet from the board"""
+        return self._stats.values[PACKETS_READ] > 0
+
+    def is_connected(self):
+        """False while the device loop is waiting for a lost port to come back (see reconnect)"""
+        return self._stats.values[OUTAGE_START_TIME] == 0
+
+    def host_time(self, arduino_time):
+        """
+        Convert a board time (Packet.timestamp) to host time with the device loop's current clock estimate.
+        Returns None until the estimate has a sample.
+        """
+        values = self._stats.values
+        if values[CLOCK_SAMPLES] == 0:
+            return None
+        return values[CLOCK_OFFSET] + (1.0 + values[CLOCK_DRIFT]) * arduino_time
+
+    def stats(self):
+        """
+        Runtime counters from the device loop (see DeviceStats.snapshot) plus:
+            baud: baud rate the board is at
+            read_queue_depth: packets parsed but not read or dropped yet
+            write_backlog: commands written but not sent to the board, cleared or cancelled yet
+        """
+        stats = self._stats.snapshot()
+        stats["whoiam"] = self.whoiam
+        stats["baud"] = self.baud
+        stats["read_queue_depth"] = (
+            stats["packets_read"] - stats["packets_dropped"] - self._packets_received + len(self._read_buffer)
+        )
+        stats["write_backlog"] = max(0, self._commands_queued - stats["commands_sent"] - stats["commands_dropped"])
+        return stats
+
+    def _open_device(self):
+        """Claim this whoiam ID's configured port from the factory"""
         self._device_port_info = self._factory.get_device(self.whoiam)
-        self._device_port_info["baud"] = self.baud
+        self._device_port_info["baud"] = DEFAULT_RATE if self._auto_baud else self.baud
+        self._device_port_info["binary"] = self.use_binary_protocol
         self._device_port = DevicePort.reinit(self._device_port_info)
+        if self.use_binary_protocol and not self._device_port.binary:
+            self._factory.logger.info("'%s' doesn't support the binary protocol. Using text" % self.whoiam)
+        if self._auto_baud:
+            self._negotiate_baud()
 
-        first_packet = self._device_port.first_packet
         self.start_time = self._device_port.start_time
         # self._prev_receive_time = self._device_port.start_time
 
-        self._device_process.start()
-        self._device_start_event.set()
+    def _negotiate_baud(self):
+        """Find the fastest baud rate the link handles, starting with the one that worked last time"""
+        address = self._device_port.address
+        preferred = self._factory.cached_baud(self.whoiam, address)
+        self.baud = self._device_port.negotiate_baud(BAUD_CANDIDATES, preferred)
+        self._device_port.baud = self.baud
+        self._factory.cache_baud(self.whoiam, address, self.baud)
+        self._factory.logger.info("'%s' negotiated baud rate %s. Link probe: %s" % (
+            self.whoiam, self.baud, self._device_port.link_probe))
 
+    def _make_first_packet(self):
+        first_packet = self._device_port.first_packet
         if len(first_packet) > 0:
             name, data = self._parse_data(first_packet, is_first_packet=True)
         else:
@@ -112,41 +595,335 @@ class Arduino:
         packet_struct.global_sequence_num = -1
         packet_struct.timestamp = 0
         packet_struct.receive_time = time.time()
+        packet_struct.host_time = packet_struct.receive_time
         packet_struct.name = name
         packet_struct.data = data
-
-        self.first_packet = packet_struct
         return packet_struct
 
     def stop(self):
         self._device_exit_event.set()
+        self._notify_device()
+
+        # free the shared memory name. Mappings stay valid until they're closed
+        if self.shared_ring is not None and os.getpid() == self._owner_pid:
+            self._owner_pid = None
+            self.shared_ring.unlink()
+
+    def _open_recorder(self):
+        if self.record_path is not None:
+            self._recorder = PacketRecorder(self.record_path)
+            self._recorder.start()
+
+            # lets a replay recover first_packet and start_time
+            first_packet = self._make_first_packet()
+            first_packet.receive_time = self.start_time
+            self._recorder.record([first_packet])
+
+    def _close_recorder(self):
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
 
     def _poll_device(self):
+        selector = None
         try:
+            self._open_recorder()
             self._device_port.write_start()
 
+            if self._write_notifier is not None:
+                selector = selectors.DefaultSelector()
+                selector.register(self._device_port.fileno(), selectors.EVENT_READ)
+                selector.register(self._write_notifier.fileno(), selectors.EVENT_READ)
+
             while self._device_active():
-                time.sleep(1 / PORT_UPDATES_PER_SECOND)  # maintain a reasonable loop speed
-                if not self._device_port.is_open():
-                    self.stop()
-                    raise RuntimeError("Serial port isn't open for some reason...")
+                if self._device_port is None:
+                    self._wait_for_reconnect(selector)
+                    continue
+
+                try:
+                    port_readable = self._wait_for_device(selector)
+                    self._stats.values[LOOP_ITERATIONS] += 1
+                    if not self._device_port.is_open() or (port_readable and self._device_port.in_waiting() == 0):
+                        # readable with nothing to read means the port went away
+                        raise RuntimeError("Serial port isn't open for some reason...")
 
-                self._check_read_queue()
-                self._check_write_queue()
+                    self._check_read_queue()
+                    self._check_write_queue()
+                except (OSError, RuntimeError) as error:
+                    if not self.reconnect or not self._device_active():
+                        self.stop()
+                        raise
+                    self._lose_device(selector, error)
+            self._release_read_queue()
         except KeyboardInterrupt:
             pass
         except BaseException:
             raise
         finally:
+            if selector is not None:
+                selector.close()
+            self._close_recorder()
             # tell the arduino to stop when finished
-            self._device_port.stop()
+            if self._device_port is not None:
+                self._device_port.stop()
+
+    def _release_read_queue(self):
+        """
+        Called by the device loop when stop is called. Packets still in a multiprocessing
+        queue's pipe won't be read, so don't hold up the device process exiting to flush them.
+        Packets the overload policy was still holding back are never sent, so they count as dropped.
+        """
+        if self._overload_buffer is not None and len(self._overload_buffer) > 0:
+            self._stats.values[PACKETS_DROPPED] += len(self._overload_buffer)
+        if hasattr(self._device_read_queue, "cancel_join_thread"):
+            self._device_read_queue.cancel_join_thread()
+        if hasattr(self._call_reply_queue, "cancel_join_thread"):
+            self._call_reply_queue.cancel_join_thread()
+
+    def _wait_for_device(self, selector):
+        """
+        Block until there's serial data, a new command, a pause command expires or a scheduled
+        command is almost due. Without a selector, sleep to maintain a reasonable loop speed.
+        Returns True if the selector said the serial port is readable
+        """
+        if selector is None:
+            time.sleep(1 / PORT_UPDATES_PER_SECOND)
+            return False
+
+        timeout = SELECTOR_TIMEOUT
+        deadline = self._next_write_deadline()
+        if deadline is not None:
+            timeout = min(timeout, deadline)
+        if self._overload_buffer is not None and len(self._overload_buffer) > 0:
+            timeout = min(timeout, READ_QUEUE_RETRY_INTERVAL)
+
+        port_readable = False
+        for key, events in selector.select(timeout):
+            if key.fd == self._write_notifier.fileno():
+                self._write_notifier.clear()
+            else:
+                port_readable = True
+        return port_readable
+
+    def _lose_device(self, selector, error):
+        """The serial port went away. Close it and wait for the supervisor to find the board again"""
+        self._factory.logger.warning("Lost '%s' at '%s': %s. Waiting for it to come back" % (
+            self.whoiam, self._device_port.address, error))
+        self._stats.start_outage(time.time())
+        if selector is not None:
+            # the port might be closed already, so it's found by elimination
+            for key in list(selector.get_map().values()):
+                if key.fd != self._write_notifier.fileno():
+                    selector.unregister(key.fd)
+        try:
+            self._device_port.device.close()
+        except BaseException:
+            pass  # already gone
+        self._device_port = None
+
+    def _wait_for_reconnect(self, selector):
+        """
+        Device loop iteration while the port is lost. Commands are taken off the write queue and held,
+        but nothing is sent until the supervisor hands over the board's new port
+        """
+        if selector is None:
+            time.sleep(1 / PORT_UPDATES_PER_SECOND)
+        else:
+            for key, events in selector.select(SELECTOR_TIMEOUT):
+                self._write_notifier.clear()
+        self._stats.values[LOOP_ITERATIONS] += 1
+
+        if self._overload_buffer is not None and len(self._overload_buffer) > 0:
+            self._queue_packets([])
+        self._take_write_queue()
+        if self._check_reconnect() and selector is not None:
+            selector.register(self._device_port.fileno(), selectors.EVENT_READ)
+
+    def _reattach(self, port_info):
+        """
+        Called by the supervisor with the port it found this Arduino's board on again.
+        The device loop takes it from the write queue so the Arduino keeps all of its state
+        """
+        port_info = dict(port_info)
+        port_info["baud"] = DEFAULT_RATE if self._auto_baud else self.baud
+        port_info["binary"] = self.use_binary_protocol
+        if self.use_multiprocessing:
+            # serial ports can't be sent to another process. The device loop opens it again
+            port_info["device"].close()
+            port_info["device"] = None
+        self._device_port_info = port_info
+        self._device_write_queue.put(ReconnectCommand(port_info))
+        self._notify_device()
+
+    def _check_reconnect(self):
+        """Open the port handed over by the supervisor if there is one. Returns True if the board is back"""
+        port_info = self._reconnect_info
+        if port_info is None or self._device_port is not None:
+            return False
+        self._reconnect_info = None
+
+        device_port = DevicePort.reinit(port_info)
+        try:
+            if device_port.device is None:
+                device_port.reopen()
+            if self._auto_baud:
+                self.baud = device_port.negotiate_baud(BAUD_CANDIDATES, self.baud)
+                device_port.baud = self.baud
+            device_port.write_start()
+        except (OSError, RuntimeError) as error:
+            self._factory.logger.warning("Failed to reconnect '%s' at '%s': %s" % (
+                self.whoiam, device_port.address, error))
+            if device_port.device is not None:
+                device_port.device.close()
+            return False
+
+        self._device_port = device_port
+        # the board probably restarted, so its clock did too
+        self._clock_sync = ClockSync()
+        self._clock_sync_time = None
+        outage = self._stats.end_outage()
+        self._factory.logger.warning("'%s' is back at '%s' after a %0.3fs outage" % (
+            self.whoiam, device_port.address, outage))
+        self._notify_device()  # send the commands that piled up
+        return True
 
     def _check_read_queue(self):
+        batch = self._read_device()
+        if self._recorder is not None:
+            self._recorder.record(batch)
+
+        if self.shared_ring is not None and len(batch) > 0:
+            batch = self._write_shared_ring(batch)
+        self._queue_packets(batch)
+
+    def _write_shared_ring(self, batch):
+        """
+        Put as much of the batch in the shared memory ring as fits. Returns the packets left for the read
+        queue: a batch with anything that doesn't fit in a record falls back to the read queue whole, and
+        so does everything while the overload policy is holding packets back, to keep them in order.
+        When the ring is full, OVERLOAD_BLOCK waits for the consumer to make room. The other policies send
+        the rest to the read queue, where they're held back and dropped like any other packets
+        """
+        if self._overload_buffer is not None and len(self._overload_buffer) > 0:
+            return batch
+        written = self.shared_ring.write(batch)
+        if written is None:
+            return batch
+        if written > 0:
+            self._read_notifier.notify()
+
+        while written < len(batch) and self._overload_buffer is None and self._device_active():
+            time.sleep(READ_QUEUE_RETRY_INTERVAL)
+            count = self.shared_ring.write(batch[written:])
+            if count > 0:
+                written += count
+                self._read_notifier.notify()
+        return batch[written:]
+
+    def _queue_packets(self, batch):
+        """
+        Send everything parsed from a chunk to the read queue at once to minimize queue overhead.
+        If the queue is full, the overload policy decides what happens to the packets.
+        Called with an empty batch to retry packets held back by the policy
+        """
+        if self.read_queue_capacity is None:
+            if len(batch) > 0:
+                self._put_read_queue(batch)
+            return
+
+        if self._overload_buffer is None:
+            if len(batch) > 0:
+                # block until the batch fits, or the queue is empty if it's bigger than the whole queue
+                room = self._read_queue_room()
+                while room < len(batch) and room < self.read_queue_capacity and self._device_active():
+                    time.sleep(READ_QUEUE_RETRY_INTERVAL)
+                    room = self._read_queue_room()
+                self._put_read_queue(batch)
+                self._packets_queued += len(batch)
+            return
+
+        keep_latest = self.overload_policy == OVERLOAD_KEEP_LATEST
+        room = self._read_queue_room()
+        dropped = self._overload_buffer.add(batch, self.read_queue_capacity - room)
+        if self._overload_buffer.reclaims and self.shared_ring is None and len(self._overload_buffer) > 0 and \
+                (room < len(self._overload_buffer) or (keep_latest and room < self.read_queue_capacity)):
+            dropped += self._reclaim_read_queue()
+            room = self._read_queue_room()
+        if dropped > 0:
+            self._stats.values[PACKETS_DROPPED] += dropped
+        if keep_latest and room < self.read_queue_capacity:
+            # every name goes to the consumer at most once, so wait until it took what's queued
+            return
+        if room > 0 and len(self._overload_buffer) > 0:
+            batch = self._overload_buffer.take(room)
+            self._put_read_queue(batch)
+            self._packets_queued += len(batch)
+
+    def _reclaim_read_queue(self):
+        """
+        The consumer is behind, so the batches waiting in the read queue are older than the packets held
+        back. Take them back off the queue and let the overload policy drop them, so the queue and the
+        overload buffer together hold at most read_queue_capacity packets and the consumer gets fresh
+        data. Keep-latest takes every batch, so the queue never holds two packets with the same name.
+        Batches are taken whole, oldest first. Returns the number of packets dropped
+        """
+        keep_latest = self.overload_policy == OVERLOAD_KEEP_LATEST
+        dropped = 0
+        while keep_latest or self._read_queue_room() < len(self._overload_buffer):
+            try:
+                batch = self._device_read_queue.get(False)
+            except queue.Empty:
+                break  # the consumer took it first
+            self._packets_queued -= len(batch)
+            dropped += self._overload_buffer.add_older(batch)
+        return dropped
+
+    def _put_read_queue(self, batch):
+        if self.shared_ring is not None:
+            # the ring position the batch goes before (see _fill_read_buffer_shared)
+            self._device_read_queue.put((self.shared_ring.written(), batch))
+            self._read_notifier.notify()
+        else:
+            self._device_read_queue.put(batch)
+
+    def _read_queue_room(self):
+        return self.read_queue_capacity - (self._packets_queued - self._packets_consumed.value)
+
+    def _read_device(self):
+        """Parse whatever is waiting on the serial port into a list of Packets"""
         # if the arduino has received data
         in_waiting = self._device_port.in_waiting()
         if in_waiting > 0:
             receive_time, packets = self._device_port.read(in_waiting)
-            for packet in packets:
+            if self._device_port.binary:
+                batch = self._process_frames(receive_time, packets)
+                self._stats.record_dropped(
+                    self._device_port.decoder.dropped_bytes, self._device_port.decoder.dropped_frames
+                )
+            else:
+                batch = self._process_packets(receive_time, packets)
+                self._stats.record_dropped(self._device_port.dropped_bytes, 0)
+            self._stats.record_read(in_waiting, len(batch), receive_time)
+            self._sync_clock(receive_time, batch)
+            return batch
+        return []
+
+    def _sync_clock(self, receive_time, batch):
+        """Add the newest board time in this chunk to the clock estimate and give the packets host times"""
+        if self._arduino_time != self._clock_sync_time:
+            self._clock_sync_time = self._arduino_time
+            if self._clock_sync.update(self._arduino_time, receive_time):
+                self._stats.record_clock(self._clock_sync)
+
+        host_time = self._clock_sync.host_time
+        for packet in batch:
+            packet.host_time = host_time(packet.timestamp)
+
+    def _process_packets(self, receive_time, packets):
+        """Parse a chunk of raw packets into a list of Packet structs"""
+        batch = []
+        for packet in packets:
+            try:
                 result = self._parse_time_command(packet)
                 if result is not None:
                     self._global_sequence_num = result[0]
@@ -156,18 +933,46 @@ class Arduino:
                 if self._check_for_protocol_packets(packet):
                     continue
 
+                if self._check_for_call_answer(receive_time, packet):
+                    continue
+
                 name, data = self._parse_data(packet)
+            except (ValueError, IndexError) as error:
+                # skip packets that got garbled on the way instead of taking down the device loop
+                self._stats.values[PARSE_ERRORS] += 1
+                self._factory.logger.warning("Failed to parse packet from '%s': %s" % (self.whoiam, error))
+                continue
+            batch.append(self._make_packet(receive_time, name, data))
+        return batch
 
-                packet_struct = Packet()
-                packet_struct.global_sequence_num = self._global_sequence_num
-                packet_struct.timestamp = self._arduino_time
-                packet_struct.receive_time = receive_time
-                packet_struct.name = name
-                packet_struct.data = data
+    def _process_frames(self, receive_time, frames):
+        """Turn a chunk of decoded binary frames into a list of Packet structs"""
+        batch = []
+        for frame in frames:
+            frame_type = frame[0]
+            if frame_type == FRAME_DATA:
+                self._global_sequence_num = frame[1]
+                self._arduino_time = frame[2]
+                batch.append(self._make_packet(receive_time, frame[3], frame[4]))
+            elif frame_type == FRAME_TIME:
+                self._global_sequence_num = frame[1]
+                self._arduino_time = frame[2]
+            else:
+                # protocol packets are sent as text frames
+                batch.extend(self._process_packets(receive_time, frame[1:]))
+        return batch
 
-                # self._prev_receive_time = receive_time
+    def _make_packet(self, receive_time, name, data):
+        packet_struct = Packet()
+        packet_struct.global_sequence_num = self._global_sequence_num
+        packet_struct.timestamp = self._arduino_time
+        packet_struct.receive_time = receive_time
+        packet_struct.name = name
+        packet_struct.data = data
+
+        # self._prev_receive_time = receive_time
 
-                self._device_read_queue.put(packet_struct)
+        return packet_struct
 
     def _parse_data(self, packet, is_first_packet=False):
         data = packet.split("\t")[:-1]
@@ -183,16 +988,7 @@ class Arduino:
                     name, formats, data)
             )
 
-        parsed_data = []
-        for data_type, datum in zip(formats, data):
-            if data_type == 'd':
-                parsed_data.append(int(datum))
-            elif data_type == 'f':
-                parsed_data.append(float(datum))
-            else:
-                parsed_data.append(datum)
-
-        return name, parsed_data
+        return name, self._format_cache.get(formats)(data)
 
     def _check_for_protocol_packets(self, packet):
         """Check for misplaced init protocol packet responses (responses to whoareyou, init?, start, stop)"""
@@ -201,7 +997,7 @@ class Arduino:
             if len(packet) >= len(header) and packet[:len(header)] == header:
                 # the Arduino can signal to stop if it sends "stopping"
                 if header == STOP_RESPONSE_HEADER:
-                    self.stop()
+                    self._device_exit_event.set()
                     raise RuntimeError("Port signalled to exit (stop flag was found)", self)
                 else:
                     self._factory.logger.warning("Misplaced protocol packet: %s" % repr(packet))
@@ -209,6 +1005,34 @@ class Arduino:
 
         return False
 
+    def _check_for_call_answer(self, receive_time, packet):
+        """Check for acknowledgements and replies to calls"""
+        if packet[:len(ACK_RESPONSE_HEADER)] == ACK_RESPONSE_HEADER:
+            call_id = int(packet[len(ACK_RESPONSE_HEADER):])
+            reply = None
+            send_time = self._call_send_times.pop(call_id, None)
+            if send_time is not None:
+                self._stats.record_call_latency(receive_time - send_time)
+        elif packet[:len(REPLY_RESPONSE_HEADER)] == REPLY_RESPONSE_HEADER:
+            call_id, reply = packet[len(REPLY_RESPONSE_HEADER):].split(":", 1)
+            call_id = int(call_id)
+        else:
+            return False
+
+        self._answer_call(call_id, reply)
+        return True
+
+    def _answer_call(self, call_id, reply):
+        """Pass an answer to a call to whoever is waiting for it. reply is None for acknowledgements"""
+        self._call_reply_queue.put((call_id, reply))
+
+    def _track_call(self, call_id):
+        """Remember when a call was sent to measure its round trip"""
+        if len(self._call_send_times) >= CALL_MAX_PENDING:
+            # never answered. Dictionaries keep insertion order so this is the oldest
+            del self._call_send_times[next(iter(self._call_send_times))]
+        self._call_send_times[call_id] = time.time()
+
     def _parse_time_command(self, packet):
         if len(packet) >= len(TIME_RESPONSE_HEADER) and \
                 packet[:len(TIME_RESPONSE_HEADER)] == TIME_RESPONSE_HEADER:
@@ -226,25 +1050,123 @@ class Arduino:
             return None
 
     def _check_write_queue(self):
-        # prevent the write queue from being accessed while sending commands
-        with self._device_write_lock:
-            # if the queue isn't currently paused,
-            if self._current_pause_command is None:
-                # send all commands until it's empty
-                if not self._device_write_queue.empty():
-                    while not self._device_write_queue.empty():
-                        packet = self._device_write_queue.get()
-
-                        # if the command is a pause command, start its timer and stop sending commands
-                        if type(packet) == PauseCommand:
-                            self._current_pause_command = packet
-                            self._current_pause_command.start()
-                            break
-                        else:
-                            self._device_port.write(packet)
-            # if the pause command is over, reset current_pause_command
-            elif self._current_pause_command.expired():
-                self._current_pause_command = None
+        self._take_write_queue()
+        if self._device_port is None:
+            return  # hold everything until the port comes back
+        self._send_scheduled_writes()
+
+        # if the pause command is over, reset current_pause_command and carry on sending
+        if self._current_pause_command is not None and self._current_pause_command.expired():
+            self._current_pause_command = None
+            self._stats.end_pause()
+
+        # if the queue isn't currently paused, send all commands until the next pause
+        if self._current_pause_command is None and len(self._pending_writes) > 0:
+            self._send_pending_writes()
+
+    def _next_write_deadline(self):
+        """Seconds until the device loop has to end a pause or send a scheduled command. None if neither"""
+        deadline = None
+        if self._current_pause_command is not None:
+            deadline = self._current_pause_command.remaining()
+        if len(self._scheduled_writes) > 0:
+            scheduled = max(0.0, self._scheduled_writes[0][0] - time.time() - SCHEDULER_SPIN_TIME)
+            if deadline is None or scheduled < deadline:
+                deadline = scheduled
+        return deadline
+
+    def _take_write_queue(self):
+        """
+        Move commands from the write queue to the pending commands and the schedule. Stops after
+        write_flush_deadline so the commands taken so far get sent while the queue is still being filled.
+        """
+        deadline = time.time() + self.write_flush_deadline
+        while not self._device_write_queue.empty():
+            command = self._device_write_queue.get()
+            command_type = type(command)
+            if command_type == ScheduledCommand:
+                heapq.heappush(self._scheduled_writes, (command.when, command.handle_id, command.packet))
+            elif command_type == CancelCommand:
+                self._cancel_scheduled_write(command.handle_id)
+            elif command_type == ClearCommand:
+                self._clear_pending_writes()
+                self._write_cleared_event.set()
+            elif command_type == ReconnectCommand:
+                self._reconnect_info = command.port_info
+            else:
+                self._pending_writes.append(command)
+
+            if time.time() > deadline:
+                self._notify_device()
+                break
+
+    def _cancel_scheduled_write(self, handle_id):
+        for index, scheduled in enumerate(self._scheduled_writes):
+            if scheduled[1] == handle_id:
+                self._scheduled_writes[index] = self._scheduled_writes[-1]
+                self._scheduled_writes.pop()
+                heapq.heapify(self._scheduled_writes)
+                self._stats.values[COMMANDS_DROPPED] += 1
+                return
+        # already sent
+
+    def _clear_pending_writes(self):
+        num_dropped = len(self._pending_writes) + len(self._scheduled_writes)
+        if num_dropped > 0:
+            self._factory.logger.debug("Clearing write queue for '%s'" % self.whoiam)
+            for packet in self._pending_writes:
+                self._factory.logger.debug("Cleared packet: '%s'" % packet)
+            for scheduled in self._scheduled_writes:
+                self._factory.logger.debug("Cleared packet: '%s'" % scheduled[2])
+            self._pending_writes.clear()
+            self._scheduled_writes.clear()
+            self._stats.values[COMMANDS_DROPPED] += num_dropped
+
+    def _send_scheduled_writes(self):
+        """
+        Send the scheduled commands that are due. If the next one is due within SCHEDULER_SPIN_TIME,
+        spin until it's due instead of going back to sleep. Commands due at once share a write.
+        """
+        schedule = self._scheduled_writes
+        while len(schedule) > 0:
+            now = time.time()
+            if schedule[0][0] > now + SCHEDULER_SPIN_TIME:
+                break
+            while schedule[0][0] > now:
+                now = time.time()
+
+            batch = []
+            while len(schedule) > 0 and schedule[0][0] <= now:
+                batch.append(heapq.heappop(schedule)[2])
+            self._stats.values[COMMANDS_SENT] += len(batch)
+            self._stats.record_write(self._device_port.write_many(batch))
+
+    def _send_pending_writes(self):
+        """
+        Send pending commands up to the next pause command. Commands are coalesced into writes
+        of up to write_batch_size commands.
+        """
+        batch = []
+        while len(self._pending_writes) > 0:
+            packet = self._pending_writes.popleft()
+
+            # if the command is a pause command, start its timer and stop sending commands
+            self._stats.values[COMMANDS_SENT] += 1
+            if type(packet) == PauseCommand:
+                self._current_pause_command = packet
+                self._current_pause_command.start()
+                self._stats.start_pause(self._current_pause_command.start_time)
+                break
+            if type(packet) == CallCommand:
+                self._track_call(packet.call_id)
+
+            batch.append(packet)
+            if len(batch) >= self.write_batch_size:
+                self._stats.record_write(self._device_port.write_many(batch))
+                batch = []
+
+        if len(batch) > 0:
+            self._stats.record_write(self._device_port.write_many(batch))
 
 
 class PauseCommand:
@@ -263,3 +1185,95 @@ class PauseCommand:
             return time.time() - self.start_time > self.pause_time
         else:
             return time.time() > self.pause_time
+
+    def remaining(self):
+        """Seconds left until the pause expires"""
+        if self.relative_time:
+            return max(0.0, self.start_time + self.pause_time - time.time())
+        else:
+            return max(0.0, self.pause_time - time.time())
+
+
+class ReconnectCommand:
+    """struct holding the port the supervisor found a lost board on"""
+
+    def __init__(self, port_info):
+        self.port_info = port_info
+
+
+class CallCommand:
+    """struct holding a command sent with Arduino.call. It's written as ~#<id>:<command>"""
+
+    def __init__(self, call_id, packet):
+        self.call_id = call_id
+        self.packet = packet
+
+    def __str__(self):
+        return "%s%d:%s" % (CALL_PACKET_ASK, self.call_id, self.packet)
+
+
+class ScheduledWrite:
+    """Handle returned by Arduino.write_at and write_after"""
+
+    def __init__(self, arduino, handle_id, when):
+        self.arduino = arduino
+        self.handle_id = handle_id
+        self.when = when
+
+    def cancel(self):
+        """Don't send the command. Does nothing if it was already sent"""
+        self.arduino._device_write_queue.put(CancelCommand(self.handle_id))
+        self.arduino._notify_device()
+
+
+class ScheduledCommand:
+    """struct holding a command to send at a unix timestamp"""
+
+    def __init__(self, packet, when, handle_id):
+        self.packet = packet
+        self.when = when
+        self.handle_id = handle_id
+
+
+class CancelCommand:
+    """struct telling the device loop to drop a scheduled command"""
+
+    def __init__(self, handle_id):
+        self.handle_id = handle_id
+
+
+class ClearCommand:
+    """struct telling the device loop to drop all commands it hasn't sent"""
+
+
+class WakeupPipe:
+    """
+    Self-pipe used to wake up a device loop blocked in select. Works across fork since
+    both ends are plain file descriptors.
+    """
+
+    def __init__(self):
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._read_fd, False)
+        os.set_blocking(self._write_fd, False)
+
+    def fileno(self):
+        return self._read_fd
+
+    def notify(self):
+        try:
+            os.write(self._write_fd, b"\0")
+        except BlockingIOError:
+            pass  # pipe is full. The loop will wake up anyway
+
+    def clear(self):
+        try:
+            while os.read(self._read_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
@@ -0,0 +1,320 @@
+import time
+import asyncio
+import threading
+import collections
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from .packet import Packet
+from .arduino import Arduino, CallCommand
+from .default_params import *
+from .device_stats import DeviceStats, COMMANDS_SENT, CALLS_TIMED_OUT
+from .device_factory import DeviceFactory
+
+
+class AsyncDeviceFactory(DeviceFactory):
+    async def init(self):
+        """
+        Configure all devices without blocking the event loop. The handshakes themselves
+        are blocking so they run in the loop's default executor.
+        """
+        await asyncio.get_running_loop().run_in_executor(None, super().init)
+
+
+class AsyncArduino(Arduino):
+    supports_reconnect = False  # there's no device loop to take a new port
+    is_async = True
+
+    def __init__(self, whoiam, factory, baud=115200, use_binary_protocol=False, record_path=None):
+        """
+        An Arduino served from an asyncio event loop instead of its own process or thread.
+        The serial port is watched with loop.add_reader and packets are parsed on the loop as soon
+        as they arrive. Any number of AsyncArduinos can share one loop.
+
+            factory = AsyncDeviceFactory()
+            await factory.init()
+            arduino = AsyncArduino("test", factory)
+            first_packet = await arduino.start()
+            async for packet in arduino:
+                await arduino.write("command")
+            await arduino.stop()
+
+        DeviceFactory.stop_all stops AsyncArduinos too, from the event loop or any other thread.
+
+        :param whoiam: whoiam ID of the board to connect to
+        :param factory: DeviceFactory instance shared by all Arduinos
+        :param baud: baud rate to switch to after starting. BAUD_AUTO negotiates the fastest of BAUD_CANDIDATES
+            the link carries without errors (see DevicePort.negotiate_baud). baud is set to the chosen rate
+        :param use_binary_protocol: have the board send COBS framed binary packets instead of text.
+            Falls back to text if the firmware doesn't support it.
+        :param record_path: record every packet to this file (see PacketRecorder). Read it back with Recording
+        """
+        self.use_multiprocessing = False
+        self.use_hub = False
+        self.read_queue_capacity = None
+        self.overload_policy = OVERLOAD_BLOCK
+        self.reconnect = False
+        self._overload_buffer = None
+        self._packets_consumed = multiprocessing.Value("Q", 0, lock=False)
+
+        self._device_port = None
+        self.shared_ring = None
+        self._device_start_event = threading.Event()
+        self._device_exit_event = threading.Event()
+        self._device_read_queue = asyncio.Queue()
+        self._read_buffer = collections.deque()
+        # serial writes block, so they're done off the event loop. One thread keeps them in order
+        self._writer = ThreadPoolExecutor(max_workers=1)
+
+        self._loop = None
+        self._started = False
+        self._closed = False
+        self._error = None
+        self._write_lock = asyncio.Lock()
+        self._paused_until = 0.0
+
+        self._stats = DeviceStats(use_multiprocessing=False)
+        self._init_device_state(whoiam, factory, baud, use_binary_protocol, record_path)
+
+    async def start(self):
+        """Open the configured port, tell the board to start and start watching the port"""
+        if self._started:
+            self._factory.logger.warning("Start already called for '%s'" % self.whoiam)
+            return None
+        self._started = True
+        self._loop = asyncio.get_running_loop()
+
+        # claiming the port blocks on serial reads, and for seconds when negotiating the baud rate
+        await self._loop.run_in_executor(self._writer, self._open_device)
+        self._open_recorder()
+        await self._loop.run_in_executor(self._writer, self._device_port.write_start)
+        self._loop.add_reader(self._device_port.fileno(), self._on_readable)
+        self._device_start_event.set()
+
+        self.first_packet = self._make_first_packet()
+        return self.first_packet
+
+    def _on_readable(self):
+        try:
+            if self._device_port.in_waiting() == 0:
+                # same as pyserial: readable with nothing to read means the port went away
+                raise RuntimeError("Serial port isn't open for some reason...")
+            batch = self._read_device()
+        except BaseException as error:
+            self._close(error)
+            return
+
+        if len(batch) > 0:
+            if self._recorder is not None:
+                self._recorder.record(batch)
+            self._update_latest(batch)
+            self._dispatch(batch)
+            self._device_read_queue.put_nowait(batch)
+
+    def _close(self, error=None):
+        """Stop watching the port and wake up any readers. Runs without awaiting so it can't be interrupted"""
+        if self._closed:
+            return
+        self._closed = True
+        self._device_exit_event.set()
+        self._error = error
+        if self._loop is not None and self._device_port is not None:
+            self._loop.remove_reader(self._device_port.fileno())
+        self._close_recorder()
+
+        for call_id, call in self._calls.items():
+            if not call[0].done():
+                call[0].set_exception(RuntimeError("'%s' stopped before answering call %d" % (self.whoiam, call_id)))
+
+        # tell the arduino to stop once the commands already being written are sent
+        if self._device_port is not None:
+            self._writer.submit(self._stop_device)
+        self._writer.shutdown(wait=False)
+
+        if error is not None:
+            self._factory.logger.error("'%s' stopped: %s" % (self.whoiam, error))
+
+        # an empty batch marks the end of the stream
+        self._device_read_queue.put_nowait([])
+
+    def _stop_device(self):
+        try:
+            self._device_port.stop()
+        except BaseException as stop_error:
+            self._factory.logger.warning("Failed to stop '%s': %s" % (self.whoiam, stop_error))
+
+    async def stop(self):
+        """Stop the board. Safe to call more than once and safe to cancel"""
+        self._close()
+
+    def _close_threadsafe(self):
+        """Close from any thread, like DeviceFactory.stop_all does. Runs on the event loop if it's still going"""
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if self._loop is None or self._loop is running_loop or self._loop.is_closed():
+            self._close()
+        else:
+            self._loop.call_soon_threadsafe(self._close)
+
+    def empty(self):
+        """True if there's nothing to read. The end of stream marker left after stopping doesn't count"""
+        if len(self._read_buffer) > 0:
+            return False
+        queue_size = self._device_read_queue.qsize()
+        # the marker is always the last thing on the queue
+        return queue_size == 0 or (self._closed and queue_size == 1)
+
+    def _check_closed(self):
+        if self._error is not None:
+            raise self._error
+
+    async def read(self, timeout=None):
+        """
+        Get the next packet. Returns a null packet (see Packet.set_null_params) if the timeout
+        expires or the board stopped.
+        """
+        if len(self._read_buffer) == 0 and not await self._fill_read_buffer_async(timeout):
+            packet = Packet()
+            packet.set_null_params()
+            return packet
+        return self._read_buffer.popleft()
+
+    async def read_batch(self, max_items=None, timeout=None):
+        """Get all packets that are available at once. Returns an empty list if the timeout expires"""
+        if len(self._read_buffer) == 0 and not await self._fill_read_buffer_async(timeout):
+            return []
+        while (max_items is None or len(self._read_buffer) < max_items) and self._fill_read_buffer(False):
+            pass
+
+        if max_items is None or max_items >= len(self._read_buffer):
+            packets = list(self._read_buffer)
+            self._read_buffer.clear()
+        else:
+            packets = [self._read_buffer.popleft() for _ in range(max_items)]
+        return packets
+
+    def on(self, name, callback):
+        """Call callback(packets) on the event loop with the packets named "name" in each batch as it's parsed"""
+        self._callbacks.setdefault(name, []).append(callback)
+
+    def start_dispatcher(self):
+        """Callbacks are called from the event loop. There's no dispatcher thread"""
+
+    def _fill_read_buffer(self, block, timeout=None):
+        """Non-blocking version for collecting batches that have already arrived"""
+        try:
+            batch = self._device_read_queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return False
+        return self._extend_read_buffer(batch)
+
+    async def _fill_read_buffer_async(self, timeout):
+        if self._closed and self._device_read_queue.empty():
+            return False
+        try:
+            batch = await asyncio.wait_for(self._device_read_queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return self._extend_read_buffer(batch)
+
+    def _extend_read_buffer(self, batch):
+        if len(batch) == 0:
+            # end of stream marker. Leave it for other readers
+            self._device_read_queue.put_nowait(batch)
+            return False
+        self._read_buffer.extend(batch)
+        self._packets_received += len(batch)
+        self._packets_consumed.value += len(batch)
+        return True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if len(self._read_buffer) == 0 and not await self._fill_read_buffer_async(None):
+            self._check_closed()
+            raise StopAsyncIteration
+        return self._read_buffer.popleft()
+
+    async def write(self, packet):
+        """Send a command. Waits if a pause command is in effect"""
+        async with self._write_lock:
+            delay = self._paused_until - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if type(packet) == CallCommand:
+                self._track_call(packet.call_id)
+            self._commands_queued += 1
+            await asyncio.wrap_future(self._writer.submit(self._send, packet))
+
+    def _send(self, packet):
+        """Runs on the writer thread"""
+        self._stats.record_write(self._device_port.write_many([packet]))
+        self._stats.values[COMMANDS_SENT] += 1
+
+    async def call(self, packet, timeout=CALL_TIMEOUT, wait_for_reply=False):
+        """
+        Send a command the board acknowledges (see Arduino.call) and wait for the answer.
+        Returns None when it's acknowledged or the reply string if wait_for_reply is True.
+        Raises TimeoutError if the board doesn't answer within timeout seconds
+        """
+        deadline = time.time() + timeout
+        call_id = self._next_call_id
+        self._next_call_id += 1
+        future = self._loop.create_future()
+        self._calls[call_id] = (future, deadline, wait_for_reply)
+        try:
+            await self.write(CallCommand(call_id, packet))
+            return await asyncio.wait_for(future, max(0.0, deadline - time.time()))
+        except asyncio.TimeoutError:
+            self._stats.values[CALLS_TIMED_OUT] += 1
+            raise TimeoutError("'%s' didn't answer call %d in time" % (self.whoiam, call_id)) from None
+        finally:
+            del self._calls[call_id]
+
+    def _answer_call(self, call_id, reply):
+        call = self._calls.get(call_id)
+        if call is not None and (reply is not None or not call[2]) and not call[0].done():
+            call[0].set_result(reply)
+
+    def write_at(self, packet, when):
+        """
+        Send a command at unix time "when" from the event loop, regardless of pause commands.
+        Returns an asyncio.TimerHandle that can cancel it. Only as precise as the event loop is responsive
+        """
+        return self._loop.call_later(max(0.0, when - time.time()), self._write_scheduled, packet)
+
+    def write_after(self, packet, delay):
+        """Send a command "delay" seconds from now. See write_at"""
+        return self.write_at(packet, time.time() + delay)
+
+    def _write_scheduled(self, packet):
+        if not self._closed:
+            self._commands_queued += 1
+            self._writer.submit(self._send_scheduled, packet)
+
+    def _send_scheduled(self, packet):
+        """Runs on the writer thread. Nothing awaits scheduled commands, so errors are logged here"""
+        try:
+            self._send(packet)
+        except BaseException as error:
+            self._factory.logger.error("Failed to send scheduled command to '%s': %s" % (self.whoiam, error))
+
+    async def write_pause(self, pause_time, relative_time=True):
+        """
+        Hold back commands written after this for "pause_time" seconds. Doesn't wait for the pause itself.
+        If relative_time is False, pause_time is the unix timestamp that write will be unfrozen at.
+        """
+        async with self._write_lock:
+            delay = self._paused_until - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if relative_time:
+                self._paused_until = time.time() + pause_time
+            else:
+                self._paused_until = pause_time
+
+    def clear_write_queue(self):
+        """Commands are written directly. Nothing is queued"""
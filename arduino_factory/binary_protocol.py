@@ -0,0 +1,218 @@
+import struct
+import binascii
+
+from .default_params import *
+
+# Binary frames are COBS encoded and end with a zero byte. Decoded, a frame is:
+#   frame type (1 byte), body, CRC-16/CCITT-FALSE of the type and body (2 bytes, little endian)
+FRAME_TIME = 1  # body: overflow count (uint32), micros (uint32), global sequence number (uint64)
+FRAME_DATA = 2  # body: time fields like FRAME_TIME, name, formats, packed data
+FRAME_TEXT = 3  # body: an ascii protocol packet (ex. "~stopping")
+
+FRAME_END = b"\x00"
+
+TIME_STRUCT = struct.Struct("<IIQ")
+CRC_STRUCT = struct.Struct("<H")
+
+# how each format character is packed. Strings are a length byte followed by the characters
+BINARY_FORMATS = {
+    'd': "i",
+    'f': "f",
+}
+
+
+def crc16(data):
+    """CRC-16/CCITT-FALSE. Matches ArduinoFactoryBridge::crc16"""
+    return binascii.crc_hqx(data, 0xffff)
+
+
+def cobs_encode(data):
+    """Consistent overhead byte stuffing. The result contains no zero bytes"""
+    output = bytearray(b"\x00")
+    code_index = 0
+    code = 1
+    for byte in data:
+        if byte == 0:
+            output[code_index] = code
+            code_index = len(output)
+            output.append(0)
+            code = 1
+        else:
+            output.append(byte)
+            code += 1
+            if code == 0xff:
+                output[code_index] = code
+                code_index = len(output)
+                output.append(0)
+                code = 1
+    output[code_index] = code
+    return bytes(output)
+
+
+def cobs_decode(data):
+    """Undo cobs_encode. Raises ValueError if the data isn't valid COBS"""
+    output = bytearray()
+    index = 0
+    length = len(data)
+    while index < length:
+        code = data[index]
+        if code == 0:
+            raise ValueError("Zero byte found inside COBS frame")
+        end = index + code
+        if end > length:
+            raise ValueError("COBS block runs past the end of the frame")
+        output += data[index + 1: end]
+        index = end
+        if code < 0xff and index < length:
+            output.append(0)
+    return bytes(output)
+
+
+def encode_frame(frame_type, body):
+    """Add the frame type and CRC, COBS encode and terminate a frame body"""
+    payload = bytes([frame_type]) + body
+    return cobs_encode(payload + CRC_STRUCT.pack(crc16(payload))) + FRAME_END
+
+
+def encode_time_frame(overflow, micros, global_sequence_num):
+    return encode_frame(FRAME_TIME, TIME_STRUCT.pack(overflow, micros, global_sequence_num))
+
+
+def encode_data_frame(overflow, micros, global_sequence_num, name, formats, data):
+    """Encode a data packet the same way ArduinoFactoryBridge::write does in binary mode"""
+    body = bytearray(TIME_STRUCT.pack(overflow, micros, global_sequence_num))
+    for string in (name, formats):
+        encoded = string.encode("ascii")
+        body.append(len(encoded))
+        body += encoded
+    for data_type, datum in zip(formats, data):
+        if data_type in BINARY_FORMATS:
+            body += struct.pack("<" + BINARY_FORMATS[data_type], datum)
+        else:
+            encoded = str(datum).encode("ascii")[:255]
+            body.append(len(encoded))
+            body += encoded
+    return encode_frame(FRAME_DATA, bytes(body))
+
+
+def encode_text_frame(text):
+    return encode_frame(FRAME_TEXT, text.encode("ascii"))
+
+
+class BinaryDecoder:
+    def __init__(self, max_frame_size=BINARY_MAX_FRAME_SIZE):
+        """
+        Incrementally splits a byte stream into binary frames and decodes them.
+        Frames that fail COBS or CRC checks are dropped and counted.
+
+        feed returns a list of tuples, one per frame:
+            (FRAME_TIME, global_sequence_num, arduino_time)
+            (FRAME_DATA, global_sequence_num, arduino_time, name, data)
+            (FRAME_TEXT, packet)
+
+        :param max_frame_size: frames longer than this are discarded without waiting for their end
+        """
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray()
+        self.dropped_frames = 0
+        self.dropped_bytes = 0
+
+        self._structs = {}
+
+    def feed(self, data):
+        """Add bytes from the serial port and get the frames they complete"""
+        self.buffer += data
+        frames = []
+
+        start = 0
+        while True:
+            end = self.buffer.find(FRAME_END, start)
+            if end < 0:
+                break
+            if end > start:
+                frame = self._decode(self.buffer[start: end])
+                if frame is None:
+                    self.dropped_frames += 1
+                    self.dropped_bytes += end - start
+                else:
+                    frames.append(frame)
+            start = end + 1
+        del self.buffer[:start]
+
+        if len(self.buffer) > self.max_frame_size:
+            # never going to be a valid frame. Wait for the next frame end
+            self.dropped_frames += 1
+            self.dropped_bytes += len(self.buffer)
+            self.buffer.clear()
+
+        return frames
+
+    def _decode(self, encoded):
+        try:
+            payload = cobs_decode(encoded)
+        except ValueError:
+            return None
+
+        if len(payload) < 3 or crc16(payload[:-2]) != CRC_STRUCT.unpack_from(payload, len(payload) - 2)[0]:
+            return None
+
+        frame_type = payload[0]
+        try:
+            if frame_type == FRAME_DATA:
+                return self._decode_data(payload)
+            elif frame_type == FRAME_TIME:
+                return (FRAME_TIME,) + self._decode_time(payload)
+            elif frame_type == FRAME_TEXT:
+                return FRAME_TEXT, payload[1:-2].decode("ascii", "ignore")
+        except (struct.error, IndexError, ValueError):
+            pass
+        return None
+
+    @staticmethod
+    def _decode_time(payload):
+        overflow, micros, global_sequence_num = TIME_STRUCT.unpack_from(payload, 1)
+        arduino_time = ((overflow << 32) | micros) / 1E6
+        return global_sequence_num, arduino_time
+
+    def _decode_data(self, payload):
+        global_sequence_num, arduino_time = self._decode_time(payload)
+
+        index = 1 + TIME_STRUCT.size
+        name_length = payload[index]
+        name = payload[index + 1: index + 1 + name_length].decode("ascii")
+        index += 1 + name_length
+        formats_length = payload[index]
+        formats = payload[index + 1: index + 1 + formats_length].decode("ascii")
+        index += 1 + formats_length
+
+        data_struct = self._get_struct(formats)
+        if data_struct is not None:
+            data = list(data_struct.unpack_from(payload, index))
+            index += data_struct.size
+        else:
+            data = []
+            for data_type in formats:
+                if data_type in BINARY_FORMATS:
+                    datum_struct = self._get_struct(data_type)
+                    data.append(datum_struct.unpack_from(payload, index)[0])
+                    index += datum_struct.size
+                else:
+                    length = payload[index]
+                    data.append(payload[index + 1: index + 1 + length].decode("ascii", "ignore"))
+                    index += 1 + length
+
+        if index != len(payload) - 2:
+            raise ValueError("Data frame length doesn't match its formats")
+
+        return FRAME_DATA, global_sequence_num, arduino_time, name, data
+
+    def _get_struct(self, formats):
+        """Cached struct for formats with no strings. None if formats contains strings"""
+        if formats not in self._structs:
+            if len(self._structs) >= FORMAT_CACHE_SIZE:
+                del self._structs[next(iter(self._structs))]
+            if all(data_type in BINARY_FORMATS for data_type in formats):
+                self._structs[formats] = struct.Struct("<" + "".join(BINARY_FORMATS[c] for c in formats))
+            else:
+                self._structs[formats] = None
+        return self._structs[formats]
@@ -0,0 +1,134 @@
+import math
+import collections
+
+from .default_params import *
+
+
+class ClockSync:
+    def __init__(self, window=CLOCK_SYNC_WINDOW, interval=CLOCK_SYNC_INTERVAL,
+                 outlier_threshold=CLOCK_SYNC_OUTLIER_THRESHOLD):
+        """
+        Online estimate of the host time a board's clock reading corresponds to:
+
+            host_time = offset + (1 + drift) * arduino_time
+
+        Samples are (arduino_time, receive_time) pairs. USB delays only ever make packets arrive later,
+        so only the fastest sample of every interval is kept (the lower envelope of the delays).
+        A line is fit through the last window of those samples. Samples much later than the line
+        predicts are rejected as outliers. If the board's clock goes backwards (it was reset) or most
+        samples are being rejected, the estimate starts over.
+
+        :param window: number of interval samples to fit the line to
+        :param interval: seconds of board time each sample covers
+        :param outlier_threshold: reject samples further above the line than this many times the fit's
+            RMS error (or CLOCK_SYNC_MIN_JITTER, whichever is bigger)
+        """
+        self.window = window
+        self.interval = interval
+        self.outlier_threshold = outlier_threshold
+
+        self.samples = 0  # interval samples used
+        self.rejected = 0  # interval samples rejected as outliers
+        self.resets = 0
+
+        self.reset()
+
+    def reset(self):
+        self.offset = None  # None until the first sample
+        self.drift = 0.0
+        self.jitter = 0.0  # RMS difference between receive times and the estimate
+
+        self._points = collections.deque()
+        self._origin = None  # (arduino_time, receive_time) the fit is relative to, for precision
+        self._alpha = 0.0
+        self._beta = 1.0
+        self._fit_error = 0.0
+        self._jitter_squared = 0.0
+
+        self._prev_arduino_time = None
+        self._interval_start = None
+        self._best_sample = None  # fastest sample of the current interval
+        self._consecutive_rejects = 0
+
+    def is_ready(self):
+        return self.offset is not None
+
+    def host_time(self, arduino_time):
+        """Host (unix) time that a board clock reading happened at"""
+        if self._origin is None:
+            return arduino_time
+        return self._origin[1] + (self._alpha + self._beta * (arduino_time - self._origin[0]))
+
+    def update(self, arduino_time, receive_time):
+        """
+        Add a sample. Returns True if the estimate was refit.
+
+        :param arduino_time: board clock reading in seconds
+        :param receive_time: host time the reading arrived
+        """
+        if self._prev_arduino_time is not None and arduino_time < self._prev_arduino_time:
+            # the board's clock went backwards. It was probably reset
+            self.resets += 1
+            self.reset()
+        self._prev_arduino_time = arduino_time
+
+        if self._origin is None:
+            self._origin = (arduino_time, receive_time)
+            self._interval_start = arduino_time
+            self.offset = receive_time - arduino_time
+        else:
+            residual = receive_time - self.host_time(arduino_time)
+            self._jitter_squared += CLOCK_SYNC_JITTER_SMOOTHING * (residual * residual - self._jitter_squared)
+            self.jitter = math.sqrt(self._jitter_squared)
+
+        if self._best_sample is None or receive_time - arduino_time < self._best_sample[1] - self._best_sample[0]:
+            self._best_sample = (arduino_time, receive_time)
+
+        if arduino_time - self._interval_start < self.interval:
+            return False
+        sample = self._best_sample
+        self._best_sample = None
+        self._interval_start = arduino_time
+        return self._add_sample(sample[0] - self._origin[0], sample[1] - self._origin[1])
+
+    def _add_sample(self, x, y):
+        if len(self._points) >= CLOCK_SYNC_MIN_SAMPLES:
+            residual = y - (self._alpha + self._beta * x)
+            if residual > self.outlier_threshold * max(self._fit_error, CLOCK_SYNC_MIN_JITTER):
+                self.rejected += 1
+                self._consecutive_rejects += 1
+                if self._consecutive_rejects > self.window // 4:
+                    # the line doesn't describe the clocks anymore (ex. the host clock jumped)
+                    self.resets += 1
+                    origin = self._origin
+                    self.reset()
+                    self.update(x + origin[0], y + origin[1])
+                return False
+        self._consecutive_rejects = 0
+
+        self._points.append((x, y))
+        if len(self._points) > self.window:
+            self._points.popleft()
+        self.samples += 1
+        self._fit()
+        return True
+
+    def _fit(self):
+        count = len(self._points)
+        mean_x = sum(point[0] for point in self._points) / count
+        mean_y = sum(point[1] for point in self._points) / count
+        variance_x = sum((point[0] - mean_x) ** 2 for point in self._points)
+
+        if self._points[-1][0] - self._points[0][0] < CLOCK_SYNC_MIN_SPAN or variance_x <= 0.0:
+            # too short to tell drift from jitter. Only estimate the offset
+            self._beta = 1.0
+        else:
+            covariance = sum((point[0] - mean_x) * (point[1] - mean_y) for point in self._points)
+            self._beta = covariance / variance_x
+        self._alpha = mean_y - self._beta * mean_x
+
+        self._fit_error = math.sqrt(
+            sum((point[1] - self._alpha - self._beta * point[0]) ** 2 for point in self._points) / count
+        )
+        self.offset = self._origin[1] + self._alpha - self._beta * self._origin[0]
+        self.drift = self._beta - 1.0
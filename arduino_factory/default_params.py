@@ -19,15 +19,81 @@ STOP_RESPONSE_HEADER = "~stopping"
 
 START_PACKET_ASK = "~>"
 
+# binary protocol negotiation
+BINARY_CAPABILITY = "b"  # firmware that can send binary frames ends its hello response with this
+BINARY_START_FLAG = "b"  # put after the start packet ask to switch the firmware to binary frames
+BINARY_MAX_FRAME_SIZE = 1024  # bytes
+
+# baud negotiation (see DevicePort.negotiate_baud)
+AUTO_BAUD_CAPABILITY = "a"  # firmware that can change its own baud rate puts this in its hello response
+BAUD_PACKET_ASK = "~%"  # "~%<baud>" switches the firmware to a new baud until it's committed
+BAUD_RESPONSE_HEADER = "~baud:"  # sent at the old baud right before switching
+BAUD_COMMIT_ASK = "~%!"  # keep the new baud. Otherwise the firmware goes back after its watchdog time
+ECHO_PACKET_ASK = "~="  # "~=<payload>" is echoed back as is to probe the link
+ECHO_RESPONSE_HEADER = "~="
+
 TIME_RESPONSE_HEADER = "~ct:"
 
+CALL_PACKET_ASK = "~#"  # "~#<id>:<command>" is a command the firmware acknowledges (see Arduino.call)
+ACK_RESPONSE_HEADER = "~ack:"  # "~ack:<id>" is sent as soon as the firmware reads a call
+REPLY_RESPONSE_HEADER = "~re:"  # "~re:<id>:<reply>" is sent by the sketch with ArduinoFactoryBridge::reply
+
 # misc. device protocol
 PROTOCOL_TIMEOUT = 5  # seconds
 READY_PROTOCOL_TIMEOUT = 10
+CONFIRM_PROTOCOL_TIMEOUT = 1  # whoiam check for boards found in the discovery cache
 PACKET_END = "\n"  # what this microcontroller's packets end with
+PACKET_END_BYTES = PACKET_END.encode("ascii")
+MAX_PACKET_LENGTH = 4096  # bytes. Text packets longer than this are treated as garbage
+FORMAT_CACHE_SIZE = 64  # number of packet formats to keep compiled converters for
 DEFAULT_RATE = 115200
 
-PORT_UPDATES_PER_SECOND = 1000
+# automatic baud rates. Pass BAUD_AUTO as an Arduino's baud to use the fastest candidate the link handles
+BAUD_AUTO = "auto"
+BAUD_CANDIDATES = [115200, 230400, 460800, 500000, 921600, 1000000, 2000000]
+LINK_PROBE_COUNT = 4  # echoes per candidate. Every one has to come back intact
+LINK_PROBE_SIZE = 48  # bytes of payload per echo
+LINK_PROBE_TIMEOUT = 0.5  # seconds to wait for each echo
+BAUD_SETTLE_TIME = 0.15  # seconds the firmware takes to restart its serial port at a new baud
+BAUD_WATCHDOG_TIME = 1.0  # seconds before the firmware gives up on an uncommitted baud. See BAUD_WATCHDOG_TIME in the firmware
+
+PORT_UPDATES_PER_SECOND = 1000  # loop rate when polling instead of waiting on the serial file descriptor
+SELECTOR_TIMEOUT = 0.1  # longest time the device loop blocks without any serial or write queue activity
+
+# command writes. Queued commands are coalesced into one serial write
+WRITE_BATCH_SIZE = 256  # most commands per write
+WRITE_FLUSH_DEADLINE = 0.005  # seconds. Longest a command waits in a batch while the write queue keeps refilling
+CLEAR_WRITE_QUEUE_TIMEOUT = 1.0  # longest clear_write_queue waits for the device loop to drop the commands
+# seconds before a write_at deadline that the device loop stops sleeping and spins. Sleeps can overshoot by
+# a millisecond or more, spinning is accurate to a few microseconds
+SCHEDULER_SPIN_TIME = 0.002
+
+# read queue overload policies. What to do with new packets when a bounded read queue is full
+OVERLOAD_BLOCK = "block"  # stop reading the serial port until the consumer makes room
+OVERLOAD_DROP_OLDEST = "drop-oldest"
+OVERLOAD_DROP_NEWEST = "drop-newest"
+OVERLOAD_KEEP_LATEST = "keep-latest"  # keep only the most recent packet of each name
+OVERLOAD_POLICIES = [OVERLOAD_BLOCK, OVERLOAD_DROP_OLDEST, OVERLOAD_DROP_NEWEST, OVERLOAD_KEEP_LATEST]
+READ_QUEUE_RETRY_INTERVAL = 0.005  # seconds between checks for room in a full read queue
+DISPATCHER_TIMEOUT = 0.1  # seconds the dispatcher thread waits for packets before checking if its Arduino stopped
+
+# acknowledged commands (see Arduino.call)
+CALL_TIMEOUT = 1.0  # default seconds to wait for an acknowledgement or reply
+CALL_MAX_PENDING = 4096  # unanswered calls the device loop keeps send times of for latencies
+CALL_LATENCY_BUCKETS = 24  # log2 buckets of round trip microseconds. The last one is 4 seconds and up
+
+# starting several Arduinos at once (see DeviceFactory.start_all)
+START_ALL_TIMEOUT = 5.0  # seconds to wait for every board to start streaming
+STARTUP_POLL_INTERVAL = 0.001  # seconds between checks for boards that started streaming
+
+# hot plugging (see DeviceSupervisor)
+HOTPLUG_POLL_INTERVAL = 0.1  # seconds between checks of the serial port list
+RECONNECT_HANDOVER_TIMEOUT = 2.0  # seconds a device loop gets to take a found port before the board is looked for again
+
+# shared memory transport
+SHARED_MEMORY_CAPACITY = 4096  # packet records in the ring buffer
+SHARED_MEMORY_MAX_FIELDS = 16  # packets with more values than this go through the read queue
+SHARED_MEMORY_MAX_NAMES = 256  # distinct packet names (and int/float layouts) per device
 
 INIT_PROTOCOL_PACKETS = [
     HELLO_RESPONSE_HEADER,
@@ -39,7 +105,36 @@ INIT_PROTOCOL_PACKETS = [
 
 # all runtime protocol packets
 RUNTIME_PROTOCOL_PACKETS = [
-    TIME_RESPONSE_HEADER
+    TIME_RESPONSE_HEADER,
+    ACK_RESPONSE_HEADER,
+    REPLY_RESPONSE_HEADER
 ]
 
+# bytes of a text log each worker process parses at a time in packet.parse_file
+LOG_PARSE_CHUNK_SIZE = 1 << 22
+
+# runtime stats
+STATS_HISTOGRAM_BUCKETS = 16  # log2 buckets of serial buffer fill per read
+STATS_REPORT_INTERVAL = 1.0  # seconds between DeviceFactory.report_stats callbacks
+
+# clock synchronization (see ClockSync)
+CLOCK_SYNC_INTERVAL = 0.1  # seconds of board time per sample. The fastest packet in each one is used
+CLOCK_SYNC_WINDOW = 300  # samples to fit offset and drift to
+CLOCK_SYNC_MIN_SPAN = 5.0  # seconds of samples needed before estimating drift
+CLOCK_SYNC_MIN_SAMPLES = 8  # samples needed before rejecting outliers
+CLOCK_SYNC_OUTLIER_THRESHOLD = 4.0  # multiples of the fit's error a sample can be late by before it's rejected
+CLOCK_SYNC_MIN_JITTER = 0.0005  # seconds. Floor for the fit's error in outlier rejection
+CLOCK_SYNC_JITTER_SMOOTHING = 0.01  # weight of each new sample in the jitter average
+
+# packet recorder
+RECORDER_CHUNK_SIZE = 1 << 20  # bytes of encoded packets to collect before writing them to disk
+RECORDER_INDEX_INTERVAL = 1024  # records between index entries
+RECORDER_FLUSH_INTERVAL = 1.0  # longest time in seconds encoded packets wait before being written
+
+# virtual arduino emulator
+EMULATOR_MAX_PENDING = 1 << 16  # bytes waiting for the host to read before packets are dropped
+EMULATOR_IDLE_TIMEOUT = 0.05  # seconds
+
+DEFAULT_DISCOVERY_CACHE_PATH = "~/.arduino_factory/discovery_cache.json"
+
 DEFAULT_LOG_FORMAT = "[%(name)s @ %(filename)s:%(lineno)d][%(levelname)s] %(asctime)s: %(message)s"
\ No newline at end of file
@@ -1,18 +1,49 @@
+import time
+import queue
 import logging
+import threading
 from threading import Thread
 from serial.tools import list_ports
 
 from .default_params import *
+from .device_hub import DeviceHub
+from .device_supervisor import DeviceSupervisor
 from .device_port import DevicePort
+from .discovery_cache import DiscoveryCache
 
 
 class DeviceFactory:
     is_initialized = False
     logger = None
 
-    def __init__(self, log_level=logging.INFO, list_devices_fn=None):
+    def __init__(self, log_level=logging.INFO, list_devices_fn=None, discovery_cache_path=None, hub_pool_size=1):
+        """
+        :param log_level: log level for debugging
+        :param list_devices_fn: function returning the serial addresses to check for Arduinos
+        :param discovery_cache_path: file to remember which board is on which port in. Boards found there
+            only get a quick whoiam check on the next run instead of the full handshake. Arduinos with
+            baud=BAUD_AUTO also start from the rate they negotiated last time.
+            DEFAULT_DISCOVERY_CACHE_PATH is a good choice. None disables the cache
+        :param hub_pool_size: number of hubs to spread Arduinos made with use_hub=True across
+        """
         self.ports = {}
         self.arduino_exit_events = []
+        self.arduinos = []  # every Arduino made with this factory
+
+        self._stats_exit_event = threading.Event()
+
+        self.hub_pool_size = hub_pool_size
+        self.hub_clients = []  # Arduinos made with use_hub=True
+        self.hubs = []
+        self._hubbed_clients = set()
+        self.supervisor = None  # see supervise
+
+        if discovery_cache_path is None:
+            self.discovery_cache = None
+        else:
+            self.discovery_cache = DiscoveryCache(discovery_cache_path)
+        self._port_identities = {}
+        self.discovery_time = None  # seconds init took
 
         if list_devices_fn is None:
             list_devices_fn = DeviceFactory.list_devices_default
@@ -61,16 +92,24 @@ class DeviceFactory:
             self.make_logger(self.log_level)
             self.logger.info("Device factory configuring for the first time")
 
+            discovery_start_time = time.time()
             addresses = self.list_devices_fn()
             self.logger.info("Found suitable addresses: '%s'" % addresses)
 
             if len(addresses) == 0:
                 raise RuntimeError("Found no valid Arduino addresses!!")
 
+            if self.discovery_cache is not None:
+                self._port_identities = DiscoveryCache.port_identities()
+
             # start threads that poll all discovered addresses
             self.collect_all_devices(addresses)
 
-            self.logger.info("configuring done")
+            if self.discovery_cache is not None:
+                self.discovery_cache.save()
+
+            self.discovery_time = time.time() - discovery_start_time
+            self.logger.info("configuring done in %0.3fs" % self.discovery_time)
 
             DeviceFactory.is_initialized = True
         else:
@@ -93,23 +132,11 @@ class DeviceFactory:
     def configure_devices_task(self, address):
         """Threading task to initialize an address"""
 
-        # Attempt to initialize the port. Don't throw an error. It will be handled later
-        try:
-            device_port = DevicePort.init_configure(address, self.log_level)
-        except BaseException as error:
-            self.logger.warning(error)
-            return
+        device_port = self.configure_device(address)
 
         # if initialized correctly, check for overlap otherwise add it to the ports dictionary
-        if device_port.is_arduino:
-            port_info = dict(
-                whoiam=device_port.whoiam,
-                address=device_port.address,
-                device=device_port.device,
-                start_time=device_port.start_time,
-                first_packet=device_port.first_packet,
-                log_level=self.log_level
-            )
+        if device_port is not None and device_port.is_arduino:
+            port_info = self.port_info(device_port)
             self.logger.info("address '%s' has ID '%s'" % (device_port.address, device_port.whoiam))
 
             if device_port.whoiam in self.ports:
@@ -120,6 +147,92 @@ class DeviceFactory:
 
                 self.ports[device_port.whoiam] = [port_info]
 
+    def configure_device(self, address):
+        """
+        Run the handshake on an address, the quick one if the discovery cache knows it.
+        Returns the DevicePort (check is_arduino) or None if the port couldn't be opened
+        """
+        device_port = self.confirm_cached_device(address)
+
+        # Attempt to initialize the port. Don't throw an error. It will be handled later
+        if device_port is None:
+            try:
+                device_port = DevicePort.init_configure(address, self.log_level)
+            except BaseException as error:
+                self.logger.warning(error)
+                return None
+
+            if device_port.is_arduino and self.discovery_cache is not None:
+                self.discovery_cache.set(
+                    self.port_identity(address), device_port.whoiam, device_port.first_packet,
+                    device_port.binary_supported, device_port.auto_baud_supported
+                )
+        return device_port
+
+    def port_info(self, device_port):
+        """What an Arduino needs to take over a configured port (see Arduino._open_device)"""
+        return dict(
+            whoiam=device_port.whoiam,
+            address=device_port.address,
+            device=device_port.device,
+            start_time=device_port.start_time,
+            first_packet=device_port.first_packet,
+            binary_supported=device_port.binary_supported,
+            auto_baud_supported=device_port.auto_baud_supported,
+            log_level=self.log_level
+        )
+
+    def port_identity(self, address):
+        """Stable identity of the port at an address. Falls back to the address for non-USB ports"""
+        return self._port_identities.get(address, address)
+
+    def cached_baud(self, whoiam, address):
+        """Baud rate negotiated with this board on a previous run. None if it isn't known"""
+        if self.discovery_cache is None:
+            return None
+        entry = self.discovery_cache.get(self.port_identity(address))
+        if entry is None or entry["whoiam"] != whoiam:
+            return None
+        return entry.get("baud")
+
+    def cache_baud(self, whoiam, address, baud):
+        """Remember the baud rate negotiated with a board so the next run tries it first"""
+        if self.discovery_cache is None:
+            return
+        identity = self.port_identity(address)
+        entry = self.discovery_cache.get(identity)
+        if entry is not None and entry["whoiam"] == whoiam and entry.get("baud") != baud:
+            self.discovery_cache.set_baud(identity, baud)
+            self.discovery_cache.save()
+
+    def confirm_cached_device(self, address):
+        """
+        If the discovery cache knows this port, check that the same board is still there.
+        Returns the configured DevicePort or None if the full handshake is needed
+        """
+        if self.discovery_cache is None:
+            return None
+        identity = self.port_identity(address)
+        entry = self.discovery_cache.get(identity)
+        if entry is None:
+            return None
+
+        try:
+            device_port = DevicePort.init_confirm(
+                address, self.log_level, entry["whoiam"], entry["first_packet"], entry["binary_supported"],
+                entry.get("auto_baud_supported", False)
+            )
+        except BaseException as error:
+            self.logger.info("Cached board '%s' didn't answer at '%s'. Reconfiguring: %s" % (
+                entry["whoiam"], address, error))
+            return None
+
+        if not device_port.is_arduino:
+            self.discovery_cache.remove(identity)
+            return None
+        self.logger.info("Confirmed cached board '%s' at '%s'" % (device_port.whoiam, address))
+        return device_port
+
     def get_device(self, whoiam):
         if not self.is_initialized:
             raise RuntimeError("Factory isn't initialized!! Please call DeviceFactory.init().")
@@ -132,8 +245,192 @@ class DeviceFactory:
 
         return self.ports[whoiam].pop(0)
 
+    def hub_client_started(self):
+        """Called by hub Arduinos in start. Once all of them have started, start the hubs"""
+        if all(arduino.is_started() for arduino in self.hub_clients):
+            self.start_hubs()
+
+    def start_hubs(self):
+        """
+        Start hubs for all started hub Arduinos that aren't being served yet. Called automatically
+        once every hub Arduino has started. Call it directly if some of them will never be started
+        """
+        clients = [arduino for arduino in self.hub_clients
+                   if arduino.is_started() and id(arduino) not in self._hubbed_clients]
+        if len(clients) == 0:
+            return
+
+        # process and thread Arduinos have different queues so they can't share a hub
+        for use_multiprocessing in (True, False):
+            group = [arduino for arduino in clients if arduino.use_multiprocessing == use_multiprocessing]
+            pool_size = min(self.hub_pool_size, len(group))
+            for index in range(pool_size):
+                arduinos = group[index::pool_size]
+                hub = DeviceHub(arduinos, use_multiprocessing)
+                self.logger.info("Starting hub for %s" % str([arduino.whoiam for arduino in arduinos]))
+                hub.start()
+                self.hubs.append(hub)
+        self._hubbed_clients.update(id(arduino) for arduino in clients)
+
+    def start_all(self, arduinos=None, timeout=START_ALL_TIMEOUT):
+        """
+        Start several Arduinos at once instead of one after the other. Every Arduino claims and reopens
+        its port (and negotiates its baud rate) on its own thread. The device loops are started from this
+        thread once every port is ready, so no process is forked while the opening threads are running.
+        Returns once every board is streaming or timeout seconds passed.
+
+        If any port fails to open, no device loop is started. The ports that did open are handed back to
+        the factory, so the Arduinos can be started again, and the first error is raised.
+
+        :param arduinos: Arduinos to start. Defaults to every Arduino made with this factory. Ones that
+            already started are skipped. AsyncArduinos start on their event loop, so they're left out
+        :param timeout: seconds to wait for the boards to start streaming
+        :return: whoiam ID -> startup timings in seconds since start_all was called:
+            opened: port claimed and ready
+            started: device loop running
+            streaming: first packet parsed. None if there wasn't one within timeout
+        """
+        start_time = time.time()
+        if arduinos is None:
+            arduinos = self.arduinos
+        arduinos = [arduino for arduino in arduinos
+                    if not arduino.is_async and not arduino.is_started()]
+
+        opened = queue.Queue()
+
+        def open_device(arduino):
+            arduino._device_port_info = None
+            try:
+                arduino._open_device()
+                opened.put((arduino, time.time() - start_time, None))
+            except BaseException as error:
+                opened.put((arduino, None, error))
+
+        tasks = []
+        for arduino in arduinos:
+            task = Thread(target=open_device, args=(arduino,))
+            tasks.append(task)
+            task.start()
+        # forking while other threads hold locks can deadlock the child, so wait for all of them first
+        for task in tasks:
+            task.join()
+
+        timings = []
+        errors = []
+        while not opened.empty():
+            arduino, opened_time, error = opened.get()
+            if error is not None:
+                self.logger.error("Failed to open '%s': %s" % (arduino.whoiam, error))
+                errors.append(error)
+                if arduino._device_port_info is not None:
+                    # it claimed its port before failing, like when the baud negotiation fails
+                    self._release_device(arduino)
+            else:
+                timings.append((arduino, dict(opened=opened_time)))
+
+        if len(errors) > 0:
+            for arduino, timing in timings:
+                self._release_device(arduino)
+            raise errors[0]
+
+        for arduino, timing in timings:
+            arduino._start_device_loop()
+            timing["started"] = time.time() - start_time
+
+        pending = list(timings)
+        while len(pending) > 0 and time.time() - start_time < timeout:
+            for arduino, timing in list(pending):
+                if arduino.is_streaming():
+                    timing["streaming"] = time.time() - start_time
+                    pending.remove((arduino, timing))
+            if len(pending) > 0:
+                time.sleep(STARTUP_POLL_INTERVAL)
+        for arduino, timing in pending:
+            timing["streaming"] = None
+            self.logger.warning("'%s' didn't send anything within %ss of starting" % (arduino.whoiam, timeout))
+
+        report = {}
+        for arduino, timing in timings:
+            key = arduino.whoiam
+            if key in report:
+                key = "%s (%d)" % (key, len(report))
+            report[key] = timing
+            self.logger.info("'%s' opened in %0.3fs, started in %0.3fs, streaming in %s" % (
+                key, timing["opened"], timing["started"],
+                "-" if timing["streaming"] is None else "%0.3fs" % timing["streaming"]))
+
+        return report
+
+    def _release_device(self, arduino):
+        """
+        Give a port claimed by start_all back, still open, so the Arduino can be started again.
+        Whatever the board sent in the meantime is thrown away. A port that stopped working isn't given back
+        """
+        port_info = arduino._device_port_info
+        arduino._device_port = None
+        arduino._device_port_info = None
+        try:
+            port_info["device"].reset_input_buffer()
+        except BaseException as error:
+            self.logger.warning("Not giving back '%s' at '%s': %s" % (arduino.whoiam, port_info["address"], error))
+            return
+        self.ports[arduino.whoiam].insert(0, port_info)
+
+    def supervise(self, interval=HOTPLUG_POLL_INTERVAL):
+        """
+        Start watching the serial ports for boards that come back after their port went away.
+        Only Arduinos made with reconnect=True wait for their boards. The rest stop like before.
+
+        :param interval: seconds between checks of the serial port list
+        :return: the DeviceSupervisor
+        """
+        if self.supervisor is None:
+            self.supervisor = DeviceSupervisor(self, interval)
+            self.supervisor.start()
+        return self.supervisor
+
+    def stats(self):
+        """
+        Arduino.stats for every Arduino made with this factory, keyed by whoiam ID, and
+        totals of the counters across all of them
+        """
+        devices = {}
+        totals = dict(packets_read=0, packets_dropped=0, bytes_read=0, parse_errors=0, dropped_bytes=0, dropped_frames=0,
+                      commands_sent=0, commands_dropped=0, bytes_written=0, write_calls=0, read_queue_depth=0, write_backlog=0,
+                      disconnects=0, reconnects=0, outage_time=0.0,
+                      packet_rate=0.0, byte_rate=0.0, write_byte_rate=0.0, write_call_rate=0.0)
+        for arduino in self.arduinos:
+            stats = arduino.stats()
+            key = arduino.whoiam
+            if key in devices:
+                key = "%s (%d)" % (key, len(devices))
+            devices[key] = stats
+            for name in totals:
+                totals[name] += stats[name]
+        return dict(time=time.time(), devices=devices, totals=totals)
+
+    def report_stats(self, callback, interval=STATS_REPORT_INTERVAL):
+        """
+        Call callback with a snapshot of stats() every interval seconds from a background thread
+        until stop_all is called
+        """
+        def report():
+            while not self._stats_exit_event.wait(interval):
+                try:
+                    callback(self.stats())
+                except BaseException as error:
+                    self.logger.warning("Stats callback failed: %s" % error)
+
+        thread = Thread(target=report, daemon=True)
+        thread.start()
+        return thread
+
     def stop_all(self):
-        print(self.ports)
+        self._stats_exit_event.set()
+        if self.supervisor is not None:
+            self.supervisor.stop()
+        for hub in self.hubs:
+            hub.stop()
         for device_ports in self.ports.values():
             for device_port in device_ports:
                 try:
@@ -144,3 +441,7 @@ class DeviceFactory:
 
         for event in self.arduino_exit_events:
             event.set()
+        # AsyncArduinos don't have a device loop watching the exit event
+        for arduino in self.arduinos:
+            if arduino.is_async:
+                arduino._close_threadsafe()
@@ -0,0 +1,159 @@
+import logging
+import selectors
+import threading
+import multiprocessing
+
+from .default_params import *
+from .arduino import WakeupPipe
+from .device_stats import LOOP_ITERATIONS
+
+# what a selector key is waiting on
+READ_EVENT = 0
+WRITE_EVENT = 1
+
+
+class DeviceHub:
+    def __init__(self, arduinos, use_multiprocessing=True):
+        """
+        Serves several Arduinos from one process (or thread) instead of one each. A single selector
+        waits on every serial port and write queue notifier. Packets are handed to each Arduino's own
+        read queue, so the Arduino objects in the parent keep working like normal.
+
+        Created by DeviceFactory for Arduinos made with use_hub=True. Hub Arduinos made with reconnect=True
+        stay in the hub while their port is lost.
+
+        :param arduinos: started Arduinos to serve
+        :param use_multiprocessing: run the hub in its own process instead of a thread
+        """
+        self.arduinos = arduinos
+        self.logger = logging.getLogger("Device Factory")
+        self._wakeup = WakeupPipe()
+        if use_multiprocessing:
+            self._exit_event = multiprocessing.Event()
+            self._process = multiprocessing.Process(target=self._run)
+        else:
+            self._exit_event = threading.Event()
+            self._process = threading.Thread(target=self._run)
+
+    def start(self):
+        self._process.start()
+
+    def stop(self):
+        self._exit_event.set()
+        self._wakeup.notify()
+
+    def _run(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self._wakeup.fileno(), selectors.EVENT_READ, (None, None))
+        active = []
+        try:
+            for arduino in self.arduinos:
+                try:
+                    arduino._open_recorder()
+                    arduino._device_port.write_start()
+                except BaseException as error:
+                    self._close_device(arduino, error)
+                    continue
+                selector.register(arduino._device_port.fileno(), selectors.EVENT_READ, (arduino, READ_EVENT))
+                selector.register(arduino._write_notifier.fileno(), selectors.EVENT_READ, (arduino, WRITE_EVENT))
+                active.append(arduino)
+
+            # Arduinos with commands held back by a pause command or scheduled for later
+            waiting = set()
+            while len(active) > 0 and not self._exit_event.is_set():
+                timeout = SELECTOR_TIMEOUT
+                for arduino in waiting:
+                    deadline = arduino._next_write_deadline()
+                    if deadline is not None:
+                        timeout = min(timeout, deadline)
+                for arduino in active:
+                    if arduino._overload_buffer is not None and len(arduino._overload_buffer) > 0:
+                        timeout = min(timeout, READ_QUEUE_RETRY_INTERVAL)
+
+                writable = set(waiting)
+                for key, events in selector.select(timeout):
+                    arduino, event = key.data
+                    if arduino is None:
+                        self._wakeup.clear()
+                    elif event == WRITE_EVENT:
+                        arduino._write_notifier.clear()
+                        writable.add(arduino)
+                    elif arduino in active:
+                        arduino._stats.values[LOOP_ITERATIONS] += 1
+                        try:
+                            if not arduino._device_port.in_waiting():
+                                # readable with nothing to read means the port went away
+                                raise RuntimeError("Serial port isn't open for some reason...")
+                            arduino._check_read_queue()
+                        except BaseException as error:
+                            self._lost_device(selector, active, arduino, error)
+                            waiting.discard(arduino)
+
+                for arduino in list(active):
+                    if arduino._overload_buffer is not None and len(arduino._overload_buffer) > 0:
+                        # packets held back by a full read queue
+                        arduino._queue_packets([])
+
+                    if not arduino._device_active():
+                        # stop was called for this arduino
+                        arduino._release_read_queue()
+                        self._remove_device(selector, active, arduino)
+                    elif arduino in writable:
+                        arduino._stats.values[LOOP_ITERATIONS] += 1
+                        try:
+                            arduino._check_write_queue()
+                            if arduino._device_port is None and arduino._check_reconnect():
+                                selector.register(
+                                    arduino._device_port.fileno(), selectors.EVENT_READ, (arduino, READ_EVENT)
+                                )
+                        except BaseException as error:
+                            self._lost_device(selector, active, arduino, error)
+                            waiting.discard(arduino)
+                            continue
+                        if arduino._device_port is not None and arduino._next_write_deadline() is not None:
+                            waiting.add(arduino)
+                        else:
+                            waiting.discard(arduino)
+                waiting.intersection_update(active)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for arduino in list(active):
+                if self._exit_event.is_set():
+                    arduino._release_read_queue()
+                self._remove_device(selector, active, arduino)
+            selector.close()
+
+    def _lost_device(self, selector, active, arduino, error):
+        """Wait for the supervisor to find the board again if the Arduino reconnects. Otherwise drop it"""
+        if arduino.reconnect and arduino._device_active() and arduino._device_port is not None and \
+                isinstance(error, (OSError, RuntimeError)):
+            self._unregister_port(selector, arduino)
+            arduino._lose_device(None, error)
+        else:
+            self._remove_device(selector, active, arduino, error)
+
+    def _unregister_port(self, selector, arduino):
+        # the port might be closed already, so it's found by its key instead of its file descriptor
+        for key in list(selector.get_map().values()):
+            if key.data == (arduino, READ_EVENT):
+                selector.unregister(key.fd)
+
+    def _remove_device(self, selector, active, arduino, error=None):
+        self._unregister_port(selector, arduino)
+        selector.unregister(arduino._write_notifier.fileno())
+        active.remove(arduino)
+        self._close_device(arduino, error)
+
+    def _close_device(self, arduino, error=None):
+        if error is not None:
+            self.logger.error("Hub lost '%s': %s" % (arduino.whoiam, error))
+        arduino._device_exit_event.set()
+        arduino._close_recorder()
+        if arduino._device_port is None:
+            return  # lost while waiting to reconnect
+        try:
+            # tell the arduino to stop
+            arduino._device_port.stop()
+        except BaseException as stop_error:
+            self.logger.warning("Failed to stop '%s': %s" % (arduino.whoiam, stop_error))
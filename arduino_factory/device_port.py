@@ -1,12 +1,16 @@
 import time
+import random
+import string
 import serial
 import logging
 
 from .default_params import *
+from .binary_protocol import BinaryDecoder
 
 
 class DevicePort:
-    def __init__(self, address, log_level, device=None, start_time=None, first_packet="", whoiam="", baud=DEFAULT_RATE):
+    def __init__(self, address, log_level, device=None, start_time=None, first_packet="", whoiam="", baud=DEFAULT_RATE,
+                 binary_supported=False, binary=False, max_packet_length=MAX_PACKET_LENGTH, auto_baud_supported=False):
         """
         Wraps the serial.Serial class and implements the atlasbuggy serial protocol for arduinos 
 
@@ -16,6 +20,11 @@ class DevicePort:
         :param start_time: device unix timestamp start time
         :param first_packet: initialization data sent by the arduino at the start
         :param whoiam: whoiam ID indicating which Arduino class should be matched to which serial port
+        :param baud: baud rate to switch to after starting
+        :param binary_supported: the firmware said it can send binary frames during the hello protocol
+        :param binary: switch the firmware to binary frames when starting. Ignored if binary isn't supported
+        :param max_packet_length: longest text packet in bytes. Longer packets are dropped
+        :param auto_baud_supported: the firmware said it can change its own baud rate during the hello protocol
         """
         self.address = address
 
@@ -25,8 +34,17 @@ class DevicePort:
         self.first_packet = first_packet
         self.whoiam = whoiam
         self.baud = baud
-
-        self.buffer = ''  # current packet buffer
+        self.binary_supported = binary_supported
+        self.binary = binary and binary_supported
+        self.auto_baud_supported = auto_baud_supported
+        self.link_probe = {}  # bytes per second each baud rate echoed at in negotiate_baud. None if it failed
+
+        self.buffer = bytearray()  # bytes of the current incomplete packet
+        self.max_packet_length = max_packet_length
+        self.dropped_bytes = 0  # bytes thrown away because a packet was too long
+        self._search_start = 0  # where in the buffer to start looking for the next packet end
+        self._resyncing = False  # if True, drop everything up to the next packet end
+        self.decoder = BinaryDecoder()  # current frame buffer if binary is enabled
 
         self.make_logger(log_level)
 
@@ -80,6 +98,56 @@ class DevicePort:
                     if self.first_packet is not None:
                         self.is_arduino = True
 
+    @classmethod
+    def init_confirm(cls, address, log_level, whoiam, first_packet, binary_supported, auto_baud_supported=False):
+        """
+        Initialize a device port that was configured on a previous run.
+        Only checks that the board still has the same whoiam ID.
+        """
+        device_port = DevicePort(address, log_level, first_packet=first_packet, binary_supported=binary_supported,
+                                 auto_baud_supported=auto_baud_supported)
+        device_port.confirm(whoiam)
+
+        return device_port
+
+    def confirm(self, whoiam):
+        """
+        Fast version of configure for boards found in the discovery cache. Skips the boot wait and the
+        hello, ready and first packet protocols. Raises RuntimeError if the board doesn't answer in time.
+        """
+        self.logger.debug("Confirming '%s' is at address '%s'" % (whoiam, self.address))
+        self.device = serial.Serial(self.address, self.baud)
+
+        try:
+            # the board might still be running if the last run didn't exit cleanly
+            self.write(STOP_PACKET_ASK)
+            found_whoiam = self.check_protocol(WHOIAM_PACKET_ASK, WHOIAM_RESPONSE_HEADER, CONFIRM_PROTOCOL_TIMEOUT)
+        except BaseException:
+            self.device.close()
+            raise
+
+        if found_whoiam == whoiam:
+            self.whoiam = whoiam
+            self.is_arduino = True
+        else:
+            self.logger.info("Address '%s' changed from '%s' to '%s'" % (self.address, whoiam, found_whoiam))
+            self.device.close()
+
+    def reopen(self):
+        """
+        Open the port again in a device process after the supervisor found the board in the parent
+        (see DeviceSupervisor). Serial ports can't be handed between processes. Raises RuntimeError if
+        a different board answers
+        """
+        self.device = serial.Serial(self.address, DEFAULT_RATE)
+        try:
+            found_whoiam = self.check_protocol(WHOIAM_PACKET_ASK, WHOIAM_RESPONSE_HEADER, CONFIRM_PROTOCOL_TIMEOUT)
+            if found_whoiam != self.whoiam:
+                raise RuntimeError("Expected '%s' at '%s', found '%s'" % (self.whoiam, self.address, found_whoiam))
+        except BaseException:
+            self.device.close()
+            raise
+
     @classmethod
     def reinit(cls, kwargs):
         """Reinitialize a device port. All ports are configured at this point. Use supplied constructor values."""
@@ -92,11 +160,15 @@ class DevicePort:
         """
 
         hello_packet = self.check_protocol(HELLO_PACKET_ASK, HELLO_RESPONSE_HEADER)
-        if hello_packet:
+        if hello_packet is None:
             self.logger.debug("'%s' never sent hello!" % self.address)
         else:
             self.logger.debug("'%s' said hello!" % self.address)
 
+            # older firmware only sends the header
+            self.binary_supported = BINARY_CAPABILITY in hello_packet
+            self.auto_baud_supported = AUTO_BAUD_CAPABILITY in hello_packet
+
         return hello_packet is not None
 
     def find_ready(self):
@@ -246,6 +318,12 @@ class DevicePort:
         data = bytearray(str(packet) + PACKET_END, 'ascii')
         self.device.write(data)
 
+    def write_many(self, packets):
+        """Write several commands with one write call. Returns the number of bytes written"""
+        data = (PACKET_END.join(str(packet) for packet in packets) + PACKET_END).encode('ascii')
+        self.device.write(data)
+        return len(data)
+
     def in_waiting(self):
         """
         Safely check the serial buffer.
@@ -261,6 +339,10 @@ class DevicePort:
         """Wrap isOpen for the Arduino class"""
         return self.device.isOpen()
 
+    def fileno(self):
+        """File descriptor of the serial port so the device loop can wait on it with a selector"""
+        return self.device.fileno()
+
     def readline(self):
         """
         Read until the next new line character
@@ -287,7 +369,8 @@ class DevicePort:
     def read(self, in_waiting):
         """
         Read all available data on serial and split them into packets as
-        indicated by packet_end.
+        indicated by packet_end. If binary is enabled, decoded frames are returned instead
+        (see BinaryDecoder.feed).
 
         For initialization and process use
         """
@@ -298,26 +381,174 @@ class DevicePort:
         else:
             raise RuntimeError("Serial port wasn't open for reading...")
 
-        if len(incoming) > 0:
-            # append to the buffer
-            try:
-                self.buffer += incoming.decode("utf-8", "ignore")
-            except UnicodeDecodeError:
-                self.logger.debug("Found non-ascii characters! '%s'" % incoming)
-                raise
+        if self.binary:
+            return receive_time, self.decoder.feed(incoming)
+
+        return receive_time, self.split_packets(incoming)
 
-            if len(self.buffer) > len(PACKET_END):
-                # split based on user defined packet end
-                packets = self.buffer.split(PACKET_END)
+    def split_packets(self, incoming):
+        """
+        Add bytes to the buffer and return every complete packet as a string. Only the newly added bytes
+        are searched for a packet end and only complete packets are decoded. If no packet end shows up
+        within max_packet_length bytes, the buffer is thrown away along with everything up to the next
+        packet end so the stream resyncs. Empty packets are skipped.
+        """
+        self.buffer += incoming
+        end = self.buffer.rfind(PACKET_END_BYTES, self._search_start)
+        if end < 0:
+            self._search_start = len(self.buffer)
+            if len(self.buffer) > self.max_packet_length:
+                self.logger.debug("No packet end in %s bytes from '%s'. Resyncing" % (len(self.buffer), self.address))
+                self.dropped_bytes += len(self.buffer)
+                self.buffer.clear()
+                self._search_start = 0
+                self._resyncing = True
+            return []
+
+        # split based on user defined packet end
+        packets = self.buffer[:end].decode("utf-8", "ignore").split(PACKET_END)
+        del self.buffer[:end + len(PACKET_END_BYTES)]
+        self._search_start = 0
+
+        if self._resyncing:
+            # the rest of the packet that was thrown away
+            self.dropped_bytes += len(packets.pop(0)) + len(PACKET_END_BYTES)
+            self._resyncing = False
+
+        if "" in packets or max(map(len, packets), default=0) > self.max_packet_length:
+            for packet in packets:
+                if len(packet) > self.max_packet_length:
+                    self.dropped_bytes += len(packet) + len(PACKET_END_BYTES)
+            packets = [packet for packet in packets if 0 < len(packet) <= self.max_packet_length]
+        return packets
+
+    def negotiate_baud(self, candidates, preferred=None):
+        """
+        Find the fastest baud rate the link carries cleanly. Candidates are tried in ascending order from the
+        current rate. At each one the board is switched over and sent LINK_PROBE_COUNT echo packets, which all
+        have to come back intact. The sweep stops at the first rate that fails and the board is left at the
+        fastest one that passed. A board that can't hear the host at a new rate goes back to the old one on
+        its own after BAUD_WATCHDOG_TIME, so a failed rate costs about a second.
+
+        Bytes per second for each rate tried are kept in link_probe (None for rates that failed).
+        Call before write_start.
+
+        :param candidates: baud rates to try
+        :param preferred: rate to try first, like one that worked on a previous run. If it passes,
+            the sweep is skipped
+        :return: the baud rate the board and port are at
+        """
+        current_rate = self.device.baudrate
+        if not self.auto_baud_supported:
+            self.logger.info("'%s' at '%s' can't negotiate its baud rate. Staying at %s" % (
+                self.whoiam, self.address, current_rate))
+            return current_rate
+
+        if preferred is not None and preferred != current_rate and self.try_baud(preferred):
+            return preferred
+
+        if self.try_baud(current_rate):
+            for rate in sorted(candidates):
+                if rate > current_rate:
+                    if not self.try_baud(rate):
+                        break
+                    current_rate = rate
+        else:
+            self.logger.warning("'%s' at '%s' failed its link probe at %s" % (self.whoiam, self.address, current_rate))
+        return current_rate
 
-                # reset the buffer. If the buffer ends with \n, the last element in packets will be an empty string
-                self.buffer = packets.pop(-1)
+    def try_baud(self, rate):
+        """
+        Switch the board and port to a baud rate and probe the link. Commits the rate if every probe
+        came back intact, otherwise goes back to the previous rate. Returns True if the rate was kept
+        """
+        previous_rate = self.device.baudrate
+        if rate != previous_rate:
+            self.write(BAUD_PACKET_ASK + str(rate))
+            if self.wait_for_packet(BAUD_RESPONSE_HEADER, LINK_PROBE_TIMEOUT) != str(rate):
+                self.logger.info("'%s' at '%s' refused baud rate %s" % (self.whoiam, self.address, rate))
+                self.link_probe[rate] = None
+                return False
+            self.device.baudrate = rate
+            time.sleep(BAUD_SETTLE_TIME)
+            self.device.reset_input_buffer()
+
+        throughput = self.probe_link(LINK_PROBE_COUNT)
+        if rate != previous_rate and throughput is not None:
+            self.write(BAUD_COMMIT_ASK)
+            # make sure the commit got there before the board's watchdog switched it back
+            if self.probe_link(1) is None:
+                throughput = None
+        self.link_probe[rate] = throughput
+
+        if throughput is None:
+            self.logger.info("'%s' at '%s' failed its link probe at baud rate %s" % (self.whoiam, self.address, rate))
+            if rate != previous_rate:
+                self.recover_link(previous_rate, rate)
+            return False
+
+        self.logger.info("'%s' at '%s' echoed %0.0f bytes/s at baud rate %s" % (
+            self.whoiam, self.address, throughput, rate))
+        return True
+
+    def recover_link(self, previous_rate, rate):
+        """
+        Get back in touch with the board after a failed baud change. It should be back at previous_rate once
+        its watchdog runs out, unless the commit made it through and only the reply got garbled
+        """
+        time.sleep(BAUD_WATCHDOG_TIME + BAUD_SETTLE_TIME)
+        for recovery_rate in (previous_rate, rate):
+            self.device.baudrate = recovery_rate
+            self.device.reset_input_buffer()
+            if self.probe_link(1) is not None:
+                return recovery_rate
+        raise RuntimeError("Lost the link to '%s' at '%s' while changing its baud rate from %s to %s" % (
+            self.whoiam, self.address, previous_rate, rate))
+
+    def probe_link(self, count):
+        """
+        Send "count" echo packets of random printable characters one at a time. Returns the bytes per second
+        sent and received, or None if any echo didn't come back exactly as it was sent
+        """
+        characters = string.ascii_letters + string.digits + string.punctuation
+        num_bytes = 0
+        start_time = time.time()
+        for _ in range(count):
+            payload = "".join(random.choice(characters) for _ in range(LINK_PROBE_SIZE))
+            self.write(ECHO_PACKET_ASK + payload)
+            if self.wait_for_packet(ECHO_RESPONSE_HEADER, LINK_PROBE_TIMEOUT) != payload:
+                return None
+            num_bytes += 2 * (len(ECHO_PACKET_ASK) + len(payload) + len(PACKET_END))
+        return num_bytes / max(time.time() - start_time, 1E-6)
+
+    def wait_for_packet(self, header, timeout):
+        """
+        Read one line within timeout seconds. Returns it with the header removed, or None if it timed out,
+        didn't start with the header or wasn't valid ascii. At the wrong baud rate, lines come in garbled
+        or not at all, so unlike check_protocol, the first line decides.
+        """
+        previous_timeout = self.device.timeout
+        self.device.timeout = timeout
+        try:
+            incoming = self.device.read_until(PACKET_END_BYTES, self.max_packet_length)
+        finally:
+            self.device.timeout = previous_timeout
 
-                return receive_time, packets
-        return receive_time, []
+        if not incoming.endswith(PACKET_END_BYTES):
+            return None
+        try:
+            packet = incoming[:-len(PACKET_END_BYTES)].decode("ascii")
+        except UnicodeDecodeError:
+            return None
+        if not packet.startswith(header):
+            return None
+        return packet[len(header):]
 
     def write_start(self):
-        self.write(START_PACKET_ASK + str(int(self.start_time)))
+        if self.binary:
+            self.write(START_PACKET_ASK + BINARY_START_FLAG + str(int(self.start_time)))
+        else:
+            self.write(START_PACKET_ASK + str(int(self.start_time)))
 
         if self.baud != DEFAULT_RATE:
             time.sleep(0.01)  # wait for start packet to process
@@ -0,0 +1,176 @@
+import time
+import multiprocessing
+
+from .default_params import *
+
+# slots of the shared stats array. Only the device loop writes to them
+PACKETS_READ = 0  # packets parsed and sent to the read queue
+BYTES_READ = 1  # bytes read from the serial port
+SERIAL_READS = 2  # times the serial port had data
+PARSE_ERRORS = 3  # text packets that couldn't be parsed
+DROPPED_BYTES = 4  # bytes thrown away by packet framing (text resyncs and bad binary frames)
+DROPPED_FRAMES = 5  # binary frames that failed their checks
+LOOP_ITERATIONS = 6  # device loop wakeups
+COMMANDS_SENT = 7  # commands and pause commands taken off the write queue
+PAUSED_TIME = 8  # seconds spent in finished pause commands
+PAUSE_START_TIME = 9  # when the current pause command started. 0 if not paused
+LAST_IN_WAITING = 10  # serial buffer fill at the last read
+MAX_IN_WAITING = 11
+LAST_PACKET_TIME = 12  # receive time of the last packet
+CLOCK_OFFSET = 13  # ClockSync estimate: host_time = offset + (1 + drift) * arduino_time
+CLOCK_DRIFT = 14
+CLOCK_JITTER = 15  # RMS difference between receive times and the estimate
+CLOCK_SAMPLES = 16
+CLOCK_REJECTED = 17
+BYTES_WRITTEN = 18  # bytes of commands written to the serial port
+WRITE_CALLS = 19  # serial writes. Commands are coalesced, so this is usually less than commands_sent
+COMMANDS_DROPPED = 20  # commands cleared or cancelled before they were sent
+PACKETS_DROPPED = 21  # packets thrown away by the read queue's overload policy
+CALLS_ACKED = 22  # calls the board acknowledged
+CALLS_TIMED_OUT = 23  # calls that weren't answered in time. Written by the owner, not the device loop
+CALL_LATENCY_SUM = 24  # seconds between sending calls and their acknowledgements
+DISCONNECTS = 25  # times the serial port went away (see Arduino's reconnect)
+RECONNECTS = 26  # times the board was found again after its port went away
+OUTAGE_TIME = 27  # seconds spent without a port in finished outages
+OUTAGE_START_TIME = 28  # when the port went away. 0 while connected
+LAST_OUTAGE = 29  # seconds the last finished outage lasted
+IN_WAITING_HISTOGRAM = 30  # STATS_HISTOGRAM_BUCKETS slots. Bucket n counts reads of 2 ** (n - 1) to 2 ** n - 1 bytes
+# CALL_LATENCY_BUCKETS slots. Bucket n counts round trips of 2 ** (n - 1) to 2 ** n - 1 microseconds
+CALL_LATENCY_HISTOGRAM = IN_WAITING_HISTOGRAM + STATS_HISTOGRAM_BUCKETS
+
+COUNTER_NAMES = (
+    "packets_read", "bytes_read", "serial_reads", "parse_errors", "dropped_bytes", "dropped_frames",
+    "loop_iterations", "commands_sent", "paused_time", "pause_start_time", "last_in_waiting", "max_in_waiting",
+    "last_packet_time", "clock_offset", "clock_drift", "clock_jitter", "clock_samples", "clock_rejected",
+    "bytes_written", "write_calls", "commands_dropped", "packets_dropped", "calls_acked", "calls_timed_out",
+    "call_latency_sum", "disconnects", "reconnects", "outage_time", "outage_start_time", "last_outage",
+)
+NUM_SLOTS = CALL_LATENCY_HISTOGRAM + CALL_LATENCY_BUCKETS
+
+
+class DeviceStats:
+    def __init__(self, use_multiprocessing=True):
+        """
+        Counters kept by a device loop and readable from the process that owns the Arduino.
+        The device loop only does a few array updates per serial read so it's cheap enough
+        to leave on all the time.
+
+        :param use_multiprocessing: keep the counters in shared memory so a device process can update them
+        """
+        if use_multiprocessing:
+            self.values = multiprocessing.Array("d", NUM_SLOTS, lock=False)
+        else:
+            self.values = [0.0] * NUM_SLOTS
+
+        # for the rates in snapshot
+        self._prev_time = time.time()
+        self._prev_packets = 0.0
+        self._prev_bytes = 0.0
+        self._prev_bytes_written = 0.0
+        self._prev_write_calls = 0.0
+
+    # ----- device loop side -----
+
+    def record_read(self, in_waiting, num_packets, receive_time):
+        values = self.values
+        values[SERIAL_READS] += 1
+        values[BYTES_READ] += in_waiting
+        values[LAST_IN_WAITING] = in_waiting
+        if in_waiting > values[MAX_IN_WAITING]:
+            values[MAX_IN_WAITING] = in_waiting
+        values[IN_WAITING_HISTOGRAM + min(in_waiting.bit_length(), STATS_HISTOGRAM_BUCKETS - 1)] += 1
+        if num_packets > 0:
+            values[PACKETS_READ] += num_packets
+            values[LAST_PACKET_TIME] = receive_time
+
+    def record_dropped(self, dropped_bytes, dropped_frames):
+        self.values[DROPPED_BYTES] = dropped_bytes
+        self.values[DROPPED_FRAMES] = dropped_frames
+
+    def record_write(self, num_bytes):
+        self.values[BYTES_WRITTEN] += num_bytes
+        self.values[WRITE_CALLS] += 1
+
+    def record_call_latency(self, latency):
+        values = self.values
+        values[CALLS_ACKED] += 1
+        values[CALL_LATENCY_SUM] += latency
+        bucket = min(int(latency * 1E6).bit_length(), CALL_LATENCY_BUCKETS - 1)
+        values[CALL_LATENCY_HISTOGRAM + bucket] += 1
+
+    def record_clock(self, clock_sync):
+        values = self.values
+        values[CLOCK_OFFSET] = clock_sync.offset
+        values[CLOCK_DRIFT] = clock_sync.drift
+        values[CLOCK_JITTER] = clock_sync.jitter
+        values[CLOCK_SAMPLES] = clock_sync.samples
+        values[CLOCK_REJECTED] = clock_sync.rejected
+
+    def start_outage(self, start_time):
+        self.values[DISCONNECTS] += 1
+        self.values[OUTAGE_START_TIME] = start_time
+
+    def end_outage(self):
+        """Returns how long the outage lasted"""
+        values = self.values
+        outage = time.time() - values[OUTAGE_START_TIME]
+        values[RECONNECTS] += 1
+        values[OUTAGE_TIME] += outage
+        values[LAST_OUTAGE] = outage
+        values[OUTAGE_START_TIME] = 0.0
+        return outage
+
+    def start_pause(self, start_time):
+        self.values[PAUSE_START_TIME] = start_time
+
+    def end_pause(self):
+        values = self.values
+        if values[PAUSE_START_TIME] > 0:
+            values[PAUSED_TIME] += time.time() - values[PAUSE_START_TIME]
+            values[PAUSE_START_TIME] = 0.0
+
+    # ----- owner side -----
+
+    def snapshot(self):
+        """
+        Copy the counters into a dictionary. packet_rate, byte_rate, write_byte_rate and write_call_rate
+        are averaged over the time since the previous snapshot.
+        """
+        values = list(self.values)
+        now = time.time()
+
+        stats = dict(zip(COUNTER_NAMES, values))
+        for name in ("packets_read", "bytes_read", "serial_reads", "parse_errors", "dropped_bytes",
+                     "dropped_frames", "loop_iterations", "commands_sent", "last_in_waiting", "max_in_waiting",
+                     "clock_samples", "clock_rejected", "bytes_written", "write_calls",
+                     "commands_dropped", "packets_dropped", "calls_acked", "calls_timed_out", "disconnects",
+                     "reconnects"):
+            stats[name] = int(stats[name])
+        if stats["pause_start_time"] > 0:
+            stats["paused_time"] += now - stats["pause_start_time"]
+        stats["paused"] = stats.pop("pause_start_time") > 0
+        if stats["outage_start_time"] > 0:
+            stats["outage_time"] += now - stats["outage_start_time"]
+        stats["connected"] = stats.pop("outage_start_time") == 0
+        stats["in_waiting_histogram"] = [int(count) for count in values[IN_WAITING_HISTOGRAM:CALL_LATENCY_HISTOGRAM]]
+        stats["call_latency_histogram"] = [int(count) for count in values[CALL_LATENCY_HISTOGRAM:]]
+        stats["call_latency_mean"] = stats.pop("call_latency_sum") / max(1, stats["calls_acked"])
+
+        duration = now - self._prev_time
+        if duration > 0:
+            stats["packet_rate"] = (stats["packets_read"] - self._prev_packets) / duration
+            stats["byte_rate"] = (stats["bytes_read"] - self._prev_bytes) / duration
+            stats["write_byte_rate"] = (stats["bytes_written"] - self._prev_bytes_written) / duration
+            stats["write_call_rate"] = (stats["write_calls"] - self._prev_write_calls) / duration
+        else:
+            stats["packet_rate"] = 0.0
+            stats["byte_rate"] = 0.0
+            stats["write_byte_rate"] = 0.0
+            stats["write_call_rate"] = 0.0
+        self._prev_time = now
+        self._prev_packets = stats["packets_read"]
+        self._prev_bytes = stats["bytes_read"]
+        self._prev_bytes_written = stats["bytes_written"]
+        self._prev_write_calls = stats["write_calls"]
+
+        return stats
@@ -0,0 +1,162 @@
+import time
+import logging
+import threading
+
+from .default_params import *
+from .device_port import DevicePort
+from .discovery_cache import DiscoveryCache
+
+
+class DeviceSupervisor:
+    def __init__(self, factory, interval=HOTPLUG_POLL_INTERVAL):
+        """
+        Finds boards again after their serial port goes away, like when a USB cable glitches. Arduinos made
+        with reconnect=True keep their device loop, queues, callbacks and stats while they wait. Every
+        interval the serial port list is checked. When one of those Arduinos is waiting, only addresses that
+        appeared since the last check and the addresses the waiting boards were last on get a handshake,
+        the quick whoiam check first and the full one if that fails. A board that answers is handed to the
+        Arduino with its whoiam ID.
+
+        Created by DeviceFactory.supervise.
+
+        :param factory: DeviceFactory whose Arduinos to watch
+        :param interval: seconds between checks of the serial port list
+        """
+        self.factory = factory
+        self.interval = interval
+        self.logger = logging.getLogger("Device Factory")
+
+        self._exit_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._lock = threading.Lock()
+        self._handed_over = {}  # id(arduino) -> when a port was handed to its device loop
+        self._ignored = set()  # addresses without a waiting board. Checked again if they're replugged
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._exit_event.set()
+
+    def _run(self):
+        known = self._list_addresses()
+        try:
+            self._ignored = known - self._addresses_in_use()
+        except BaseException as error:
+            self.logger.warning("Supervisor check failed: %s" % error)
+        while not self._exit_event.wait(self.interval):
+            addresses = self._list_addresses()
+            for address in known - addresses:
+                self.logger.info("Address '%s' went away" % address)
+                self._ignored.discard(address)
+            added = addresses - known
+            for address in added:
+                self.logger.info("Address '%s' appeared" % address)
+            known = addresses
+
+            try:
+                self.check(addresses, len(added) > 0)
+            except BaseException as error:
+                self.logger.warning("Supervisor check failed: %s" % error)
+
+    def _list_addresses(self):
+        try:
+            return set(self.factory.list_devices_fn())
+        except BaseException as error:
+            # list_devices_default raises if there aren't any ports
+            self.logger.debug("Couldn't list serial ports: %s" % error)
+            return set()
+
+    def _addresses_in_use(self):
+        """Addresses of connected Arduinos and configured ports that haven't been claimed yet"""
+        in_use = set()
+        for arduino in self.factory.arduinos:
+            if arduino.is_started() and arduino.is_connected():
+                in_use.add(arduino._device_port_info["address"])
+        for port_infos in self.factory.ports.values():
+            for port_info in port_infos:
+                in_use.add(port_info["address"])
+        return in_use
+
+    def waiting_arduinos(self):
+        """Started Arduinos waiting for their board that don't have a port on the way already"""
+        now = time.time()
+        return [
+            arduino for arduino in self.factory.arduinos
+            if arduino.supports_reconnect and arduino.reconnect and arduino.is_started() and
+            arduino._device_active() and not arduino.is_connected() and
+            now - self._handed_over.get(id(arduino), 0.0) > RECONNECT_HANDOVER_TIMEOUT
+        ]
+
+    def check(self, addresses, ports_added=False):
+        """Handshake with the addresses a waiting board could be on and hand over the ones that answer"""
+        waiting = self.waiting_arduinos()
+        if len(waiting) == 0:
+            return
+
+        last_addresses = set(arduino._device_port_info["address"] for arduino in waiting)
+        candidates = ((addresses - self._ignored) | (addresses & last_addresses)) - self._addresses_in_use()
+        if len(candidates) == 0:
+            return
+
+        if ports_added and self.factory.discovery_cache is not None:
+            self.factory._port_identities = DiscoveryCache.port_identities()
+
+        # handshakes wait on the boards, so do them all at once
+        tasks = []
+        claimed = set()
+        for address in candidates:
+            task = threading.Thread(target=self._find_board, args=(address, waiting, last_addresses, claimed))
+            tasks.append(task)
+            task.start()
+        for task in tasks:
+            task.join()
+
+        if self.factory.discovery_cache is not None:
+            self.factory.discovery_cache.save()
+
+    def _find_board(self, address, waiting, last_addresses, claimed):
+        # most likely a waiting board came back, so try the quick whoiam check first.
+        # Whichever board was last on this address is the best guess
+        expected = waiting[0]
+        for arduino in waiting:
+            if arduino._device_port_info["address"] == address:
+                expected = arduino
+                break
+        port_info = expected._device_port_info
+        try:
+            device_port = DevicePort.init_confirm(
+                address, self.factory.log_level, port_info["whoiam"], port_info["first_packet"],
+                port_info["binary_supported"], port_info.get("auto_baud_supported", False)
+            )
+        except BaseException as error:
+            self.logger.debug("'%s' isn't at '%s': %s" % (expected.whoiam, address, error))
+            device_port = None
+        if device_port is None or not device_port.is_arduino:
+            device_port = self.factory.configure_device(address)
+
+        if device_port is None or not device_port.is_arduino:
+            if device_port is not None and device_port.device is not None:
+                device_port.device.close()
+            if address not in last_addresses:
+                self._ignored.add(address)
+            return
+
+        with self._lock:
+            # more than one board can have the same whoiam ID. Each one gets one of them
+            for arduino in waiting:
+                if arduino.whoiam == device_port.whoiam and id(arduino) not in claimed:
+                    claimed.add(id(arduino))
+                    self._handed_over[id(arduino)] = time.time()
+                    break
+            else:
+                arduino = None
+
+        if arduino is None:
+            self.logger.info("Found '%s' at '%s', but nothing is waiting for it" % (device_port.whoiam, address))
+            device_port.device.close()
+            self._ignored.add(address)
+            return
+
+        self.logger.info("Found '%s' again at '%s'" % (device_port.whoiam, address))
+        arduino._reattach(self.factory.port_info(device_port))
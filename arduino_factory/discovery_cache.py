@@ -0,0 +1,89 @@
+import os
+import json
+import logging
+import threading
+
+from serial.tools import list_ports
+
+
+class DiscoveryCache:
+    def __init__(self, path):
+        """
+        On disk record of which board was found on which port so restarts can skip the full handshake.
+        Ports are identified by something that survives replugging and reboots where possible
+        (see port_identities). Each entry holds the whoiam ID, first packet, binary and baud negotiation
+        support found during the last full handshake, and the baud rate negotiated on the last run.
+
+        :param path: JSON file to keep the cache in. Created if it doesn't exist
+        """
+        self.path = os.path.expanduser(path)
+        self.logger = logging.getLogger("Device Factory")
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path) as file:
+                contents = json.load(file)
+        except (OSError, ValueError) as error:
+            self.logger.warning("Ignoring unreadable discovery cache '%s': %s" % (self.path, error))
+            return
+        self._entries = contents.get("ports", {})
+
+    def save(self):
+        """
+        Write the cache atomically so a crash can't leave half a file behind. Arduinos started together
+        save from their own threads, so each write gets its own temporary file and they're done one at a time
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        temp_path = "%s.%s.%s.tmp" % (self.path, os.getpid(), threading.get_ident())
+        with self._lock:
+            with open(temp_path, "w") as file:
+                json.dump(dict(ports=self._entries), file, indent=4, sort_keys=True)
+            os.replace(temp_path, self.path)
+
+    def get(self, identity):
+        with self._lock:
+            return self._entries.get(identity)
+
+    def set(self, identity, whoiam, first_packet, binary_supported, auto_baud_supported=False):
+        with self._lock:
+            self._entries[identity] = dict(
+                whoiam=whoiam,
+                first_packet=first_packet,
+                binary_supported=binary_supported,
+                auto_baud_supported=auto_baud_supported
+            )
+
+    def set_baud(self, identity, baud):
+        """Remember the baud rate negotiated with the board at a port (see Arduino's baud)"""
+        with self._lock:
+            if identity in self._entries:
+                self._entries[identity]["baud"] = baud
+
+    def remove(self, identity):
+        with self._lock:
+            self._entries.pop(identity, None)
+
+    @staticmethod
+    def port_identities():
+        """
+        Map serial addresses to stable port identities. USB serial number if the device has one,
+        otherwise the USB location (which physical port it's plugged into).
+        """
+        identities = {}
+        for port_info in list_ports.comports():
+            if port_info.vid is None:
+                continue
+            usb_id = "%04x:%04x" % (port_info.vid, port_info.pid)
+            if port_info.serial_number:
+                identities[port_info.device] = "%s:%s" % (usb_id, port_info.serial_number)
+            elif port_info.location:
+                identities[port_info.device] = "%s@%s" % (usb_id, port_info.location)
+        return identities
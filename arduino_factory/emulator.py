@@ -0,0 +1,333 @@
+import os
+import time
+import queue
+import select
+import weakref
+import threading
+import multiprocessing
+
+try:
+    import pty
+    import tty
+except ImportError:  # windows
+    pty = None
+
+from .default_params import *
+from .binary_protocol import encode_data_frame, encode_text_frame
+
+_emulators = weakref.WeakSet()  # VirtualArduinos that haven't been unplugged
+_forking_emulator = None  # the VirtualArduino starting its own process
+_fork_hook_registered = False
+
+
+def _close_inherited_ptys():
+    """
+    Forked processes get a copy of every pseudo-terminal. The port only goes away once they're all
+    closed, so without this, stopping an emulator wouldn't unplug it while a device process is running
+    """
+    for emulator in list(_emulators):
+        if emulator is not _forking_emulator:
+            _emulators.discard(emulator)
+            os.close(emulator._master)
+            os.close(emulator._slave)
+
+
+def _register_fork_hook():
+    """Only processes that made an emulator need their forks cleaned up, so the hook isn't added on import"""
+    global _fork_hook_registered
+    if not _fork_hook_registered and hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_close_inherited_ptys)
+        _fork_hook_registered = True
+
+
+class EmulatedPacket:
+    def __init__(self, name, formats, rate, data_fn=None):
+        """
+        A stream of user packets sent by a VirtualArduino.
+
+        :param name: packet name
+        :param formats: format characters like the firmware's write ('d' int, 'f' float, 's' string)
+        :param rate: packets per second
+        :param data_fn: function taking the packet's index in the stream and returning its data.
+            Defaults to the index for ints, the time for floats and "s<index>" for strings
+        """
+        self.name = name
+        self.formats = formats
+        self.rate = rate
+        self.data_fn = data_fn
+        self.count = 0
+
+    def make_data(self):
+        if self.data_fn is not None:
+            data = self.data_fn(self.count)
+        else:
+            data = []
+            for data_type in self.formats:
+                if data_type == 'd':
+                    data.append(self.count)
+                elif data_type == 'f':
+                    data.append(time.time())
+                else:
+                    data.append("s%d" % self.count)
+        self.count += 1
+        return data
+
+
+class VirtualArduino:
+    def __init__(self, whoiam, packets=None, init_formats="s", init_data=("hi!",), binary_supported=True,
+                 use_multiprocessing=False, max_pending=EMULATOR_MAX_PENDING, reply_fn=None, auto_baud_supported=True,
+                 max_baud=None):
+        """
+        A board running ArduinoFactoryBridge, emulated on a Linux pseudo-terminal. Point a
+        DeviceFactory at the address of each board to test without hardware:
+
+            boards = [VirtualArduino("board%d" % index) for index in range(8)]
+            factory = DeviceFactory(list_devices_fn=lambda: [board.address for board in boards])
+
+        Answers the hello, ready, whoiam, first packet, start and stop protocols like the firmware.
+        Once started, each user packet is sent after a "~ct:" time packet (or as a binary frame if
+        the host asked for them). Commands from the host that aren't part of the protocol are put on
+        the commands queue. Commands sent with Arduino.call are acknowledged like the firmware does.
+        Like the firmware, user commands and calls are ignored unless the board is started.
+        Baud changes don't do anything on a pseudo-terminal, so max_baud stands in for the cable.
+
+        :param whoiam: whoiam ID to report
+        :param packets: list of EmulatedPackets to send while started. Defaults to 100 "counter" packets a second
+        :param init_formats: formats of the first packet. None sends an empty first packet
+        :param init_data: data of the first packet
+        :param binary_supported: advertise and honor the binary protocol
+        :param use_multiprocessing: run the emulator in its own process so high rates don't compete
+            with the code under test for the GIL
+        :param max_pending: bytes to hold when the host isn't reading. Packets past this are dropped and counted
+        :param reply_fn: function taking a called command and returning the reply to send, like a sketch
+            calling ArduinoFactoryBridge::reply. None or returning None only acknowledges calls.
+            Needs to be picklable with use_multiprocessing
+        :param auto_baud_supported: advertise and honor baud negotiation (see DevicePort.negotiate_baud)
+        :param max_baud: fastest baud rate the emulated link carries. Above it, commands from the host are
+            lost and echoes come back garbled, like framing errors on a real link. None carries every rate
+        """
+        if pty is None:
+            raise RuntimeError("VirtualArduino needs pseudo-terminals, which aren't available on this platform")
+
+        if packets is None:
+            packets = [EmulatedPacket("counter", "df", 100.0)]
+
+        self.whoiam = whoiam
+        self.packets = packets
+        self.init_formats = init_formats
+        self.init_data = init_data
+        self.binary_supported = binary_supported
+        self.max_pending = max_pending
+        self.reply_fn = reply_fn
+        self.auto_baud_supported = auto_baud_supported
+        self.max_baud = max_baud
+
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.address = os.ttyname(self._slave)
+
+        self.packets_sent = multiprocessing.Value("Q", 0, lock=False)
+        self.packets_dropped = multiprocessing.Value("Q", 0, lock=False)
+        self.bytes_sent = multiprocessing.Value("Q", 0, lock=False)
+        self.baud = multiprocessing.Value("Q", DEFAULT_RATE, lock=False)  # rate the board is at
+        if use_multiprocessing:
+            self.commands = multiprocessing.Queue()
+            self._running = multiprocessing.Event()
+            self._exit_event = multiprocessing.Event()
+            self._process = multiprocessing.Process(target=self._run, daemon=True)
+        else:
+            self.commands = queue.Queue()
+            self._running = threading.Event()
+            self._exit_event = threading.Event()
+            self._process = threading.Thread(target=self._run, daemon=True)
+
+        # board state. Only touched by the emulator loop
+        self._binary = False
+        self._start_time = time.time()
+        self._sequence_num = 0
+        self._pending = bytearray()
+        self._previous_baud = DEFAULT_RATE
+        self._baud_deadline = 0.0  # when an uncommitted baud change is undone. 0 if there isn't one
+
+        global _forking_emulator
+        _register_fork_hook()
+        _emulators.add(self)
+        _forking_emulator = self
+        try:
+            self._process.start()
+        finally:
+            _forking_emulator = None
+
+    def is_running(self):
+        """True between the host's start and stop commands"""
+        return self._running.is_set()
+
+    def stop(self):
+        """Unplug the board"""
+        self._exit_event.set()
+        self._process.join()
+        _emulators.discard(self)
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _run(self):
+        os.set_blocking(self._master, False)
+        incoming = bytearray()
+        next_times = [0.0] * len(self.packets)
+
+        while not self._exit_event.is_set():
+            now = time.time()
+            timeout = EMULATOR_IDLE_TIMEOUT
+            if self._running.is_set() and len(next_times) > 0:
+                timeout = max(0.0, min(timeout, min(next_times) - now))
+            if self._baud_deadline > 0:
+                timeout = max(0.0, min(timeout, self._baud_deadline - now))
+            writers = [self._master] if len(self._pending) > 0 else []
+            readable, writable, _ = select.select([self._master], writers, [], timeout)
+
+            if readable:
+                try:
+                    incoming += os.read(self._master, 4096)
+                except BlockingIOError:
+                    pass
+                except OSError:
+                    return  # the pty was closed
+                end = incoming.rfind(PACKET_END_BYTES)
+                if end >= 0:
+                    lines = incoming[:end].split(PACKET_END_BYTES)
+                    del incoming[:end + 1]
+                    for line in lines:
+                        if self._handle_command(line.decode("ascii", "ignore")):
+                            next_times = [time.time()] * len(self.packets)
+
+            if 0 < self._baud_deadline <= time.time():
+                # the host never committed the new rate
+                self._baud_deadline = 0.0
+                self.baud.value = self._previous_baud
+
+            if self._running.is_set():
+                now = time.time()
+                for index, packet in enumerate(self.packets):
+                    if now - next_times[index] > 1.0:
+                        next_times[index] = now  # fell too far behind. Don't send a flood
+                    while next_times[index] <= now:
+                        self._send_packet(packet)
+                        next_times[index] += 1.0 / packet.rate
+
+            if len(self._pending) > 0:
+                try:
+                    written = os.write(self._master, self._pending)
+                    del self._pending[:written]
+                    self.bytes_sent.value += written
+                except BlockingIOError:
+                    pass
+                except OSError:
+                    return
+
+    def _write(self, data):
+        self._pending += data
+
+    def _write_text(self, text):
+        self._pending += text.encode("ascii")
+
+    def _handle_command(self, command):
+        """Respond to a command from the host. Returns True if it was a start command"""
+        if self._link_garbled():
+            if command.startswith(ECHO_PACKET_ASK):
+                # a real link flips bits. Any change makes the echo fail
+                self._write_text(command.swapcase()[::-1] + PACKET_END)
+            return False
+
+        if command.startswith(HELLO_PACKET_ASK):
+            capabilities = BINARY_CAPABILITY if self.binary_supported else ""
+            if self.auto_baud_supported:
+                capabilities += AUTO_BAUD_CAPABILITY
+            self._write_text(HELLO_RESPONSE_HEADER + capabilities + PACKET_END)
+        elif command.startswith(READY_PACKET_ASK):
+            self._write_text(READY_RESPONSE_HEADER + PACKET_END)
+        elif command.startswith(WHOIAM_PACKET_ASK):
+            self._write_text(WHOIAM_RESPONSE_HEADER + self.whoiam + PACKET_END)
+        elif command.startswith(FIRST_PACKET_ASK):
+            if self.init_formats is None:
+                self._write_text(FIRST_RESPONSE_HEADER + PACKET_END)
+            else:
+                fields = [self.init_formats] + [str(datum) for datum in self.init_data]
+                self._write_text(FIRST_RESPONSE_HEADER + "\t".join(fields) + "\t" + PACKET_END)
+        elif command.startswith(START_PACKET_ASK):
+            flags = command[len(START_PACKET_ASK):]
+            self._binary = self.binary_supported and flags.startswith(BINARY_START_FLAG)
+            if self._binary:
+                self._write(b"\x00")  # end any partial text so the first frame isn't lost
+            if not self._running.is_set():
+                self._running.set()
+                return True
+        elif command.startswith(STOP_PACKET_ASK):
+            if self._running.is_set():
+                if self._binary:
+                    self._write(encode_text_frame(STOP_RESPONSE_HEADER))
+                    self._binary = False
+                else:
+                    self._write_text(PACKET_END + STOP_RESPONSE_HEADER + PACKET_END)
+                self._running.clear()
+            # back to the default baud for the next run like the firmware
+            self._baud_deadline = 0.0
+            self.baud.value = DEFAULT_RATE
+        elif command.startswith(ECHO_PACKET_ASK) and self.auto_baud_supported:
+            self._write_text(command + PACKET_END)
+        elif command.startswith(BAUD_COMMIT_ASK) and self.auto_baud_supported:
+            self._baud_deadline = 0.0
+        elif command.startswith(BAUD_PACKET_ASK) and self.auto_baud_supported:
+            new_baud = int(command[len(BAUD_PACKET_ASK):])
+            self._write_text(BAUD_RESPONSE_HEADER + str(new_baud) + PACKET_END)
+            self._previous_baud = self.baud.value
+            self.baud.value = new_baud
+            self._baud_deadline = time.time() + BAUD_WATCHDOG_TIME
+        elif command.startswith(CALL_PACKET_ASK):
+            call_id, separator, command = command[len(CALL_PACKET_ASK):].partition(":")
+            # like the firmware, user commands are ignored while stopped, so calls aren't acknowledged
+            if len(separator) == 0 or not self._running.is_set():
+                return False
+            self._write_protocol_packet(ACK_RESPONSE_HEADER + call_id)
+            self.commands.put(command)
+            if self.reply_fn is not None:
+                reply = self.reply_fn(command)
+                if reply is not None:
+                    self._write_protocol_packet("%s%s:%s" % (REPLY_RESPONSE_HEADER, call_id, reply))
+        elif len(command) > 0 and self._running.is_set():
+            self.commands.put(command)
+        return False
+
+    def _link_garbled(self):
+        return self.max_baud is not None and self.baud.value > self.max_baud
+
+    def _write_protocol_packet(self, text):
+        """Send a protocol packet as a text frame in binary mode, as a line otherwise"""
+        if self._binary:
+            self._write(encode_text_frame(text))
+        else:
+            self._write_text(text + PACKET_END)
+
+    def _board_time(self):
+        """overflow count and micros like the firmware's updateTime"""
+        micros = int((time.time() - self._start_time) * 1E6)
+        return micros >> 32, micros & 0xffffffff
+
+    def _send_packet(self, packet):
+        data = packet.make_data()
+        if len(self._pending) >= self.max_pending:
+            self.packets_dropped.value += 1
+            return
+
+        overflow, micros = self._board_time()
+        if self._binary:
+            self._write(encode_data_frame(
+                overflow, micros, self._sequence_num, packet.name, packet.formats, data
+            ))
+        else:
+            fields = [packet.name, packet.formats] + [str(datum) for datum in data]
+            self._write_text("%s%d:%d:%d:%d%s%s\t%s" % (
+                TIME_RESPONSE_HEADER, overflow, micros, self._sequence_num >> 32, self._sequence_num & 0xffffffff,
+                PACKET_END, "\t".join(fields), PACKET_END
+            ))
+        self._sequence_num += 1
+        self.packets_sent.value += 1
@@ -0,0 +1,61 @@
+import collections
+
+from .default_params import *
+
+# 'd' is an integer, 'f' is a float. Anything else is left as a string
+FORMAT_CONVERTERS = {
+    'd': int,
+    'f': float,
+}
+
+
+class FormatCache:
+    def __init__(self, max_size=FORMAT_CACHE_SIZE):
+        """
+        Bounded cache of data converters keyed by packet format string (ex. "ddf").
+        Boards send the same few formats over and over, so each format is turned into
+        a converter once. Most of the time goes to splitting the packet and int/float
+        themselves, so this is about as fast as checking every format character
+        (see benchmarks/parse_benchmark.py).
+        When the cache is full the least recently used format is evicted.
+
+        :param max_size: maximum number of formats to keep
+        """
+        self.max_size = max_size
+        self._converters = collections.OrderedDict()
+
+    def get(self, formats):
+        """Get the converter for a format string. Call it with a list of data segments of the same length"""
+        converters = self._converters
+        converter = converters.get(formats)
+        if converter is None:
+            if len(converters) >= self.max_size:
+                converters.popitem(last=False)
+            converter = self._compile(formats)
+            converters[formats] = converter
+        else:
+            converters.move_to_end(formats)
+        return converter
+
+    def __len__(self):
+        return len(self._converters)
+
+    def clear(self):
+        self._converters.clear()
+
+    @staticmethod
+    def _compile(formats):
+        """
+        Build a function that converts every data segment with no per segment type checks. The segments
+        are converted in place, so it's given the list split from the packet, not a copy
+        """
+        conversions = tuple(
+            (index, FORMAT_CONVERTERS[data_type]) for index, data_type in enumerate(formats)
+            if data_type in FORMAT_CONVERTERS
+        )
+
+        def convert(data):
+            for index, converter in conversions:
+                data[index] = converter(data[index])
+            return data
+        return convert
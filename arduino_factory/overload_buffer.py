@@ -0,0 +1,94 @@
+import collections
+
+from .default_params import *
+
+
+class OverloadBuffer:
+    def __init__(self, policy, capacity):
+        """
+        Packets a device loop is holding back because the read queue is full. The policy decides
+        which packets are thrown away when the consumer falls behind:
+            OVERLOAD_DROP_NEWEST: keep the first capacity packets, drop what arrives after
+            OVERLOAD_DROP_OLDEST: keep the last capacity packets
+            OVERLOAD_KEEP_LATEST: keep the last packet of each name. Past capacity names, the ones
+                that haven't been updated for the longest are dropped
+
+        :param policy: one of the policies above
+        :param capacity: most packets to hold
+        """
+        self.policy = policy
+        self.capacity = capacity
+        # whether packets already sent to the consumer should be taken back and dropped before fresher ones
+        self.reclaims = policy != OVERLOAD_DROP_NEWEST
+        if policy == OVERLOAD_KEEP_LATEST:
+            # dictionaries keep insertion order. Re-inserting a name moves it to the back
+            self._packets = {}
+        else:
+            self._packets = collections.deque()
+
+    def add(self, packets, queued=0):
+        """
+        Hold packets. Returns the number of packets dropped to make room
+
+        :param packets: packets that just arrived
+        :param queued: packets waiting in the read queue. Drop-newest counts them toward capacity
+        """
+        held = self._packets
+        if self.policy == OVERLOAD_KEEP_LATEST:
+            dropped = 0
+            for packet in packets:
+                if held.pop(packet.name, None) is not None:
+                    dropped += 1
+                held[packet.name] = packet
+            return dropped + self._drop_stale_names()
+
+        if self.policy == OVERLOAD_DROP_NEWEST:
+            space = max(0, self.capacity - queued - len(held))
+            held.extend(packets[:space])
+            return max(0, len(packets) - space)
+
+        # drop oldest
+        held.extend(packets)
+        dropped = max(0, len(held) - self.capacity)
+        for _ in range(dropped):
+            held.popleft()
+        return dropped
+
+    def add_older(self, packets):
+        """
+        Hold packets that arrived before everything already held, like ones taken back off the read queue.
+        Returns the number of packets dropped
+        """
+        held = self._packets
+        if self.policy == OVERLOAD_KEEP_LATEST:
+            older = {}
+            for packet in packets:
+                if packet.name not in held:
+                    older.pop(packet.name, None)
+                    older[packet.name] = packet
+            dropped = len(packets) - len(older)
+            older.update(held)
+            self._packets = older
+            return dropped + self._drop_stale_names()
+
+        # they're older than anything held, so drop-oldest drops all of them
+        return len(packets)
+
+    def _drop_stale_names(self):
+        """Keep-latest. Drop the names that went the longest without an update past capacity"""
+        held = self._packets
+        dropped = max(0, len(held) - self.capacity)
+        for name in list(held)[:dropped]:
+            del held[name]
+        return dropped
+
+    def take(self, max_items):
+        """Remove up to max_items of the oldest held packets"""
+        held = self._packets
+        if self.policy == OVERLOAD_KEEP_LATEST:
+            names = list(held)[:max_items]
+            return [held.pop(name) for name in names]
+        return [held.popleft() for _ in range(min(max_items, len(held)))]
+
+    def __len__(self):
+        return len(self._packets)
@@ -1,6 +1,16 @@
+import os
 import re
+import logging
+import collections
+import multiprocessing
+
+from .default_params import *
+
 
 class Packet:
+    # slots instead of a __dict__ keep packets small. The order here is the order __str__ prints them in
+    __slots__ = ("name", "data", "receive_time", "timestamp", "global_sequence_num", "sequence_num", "host_time")
+
     def __init__(self):
         self.name = ""
         self.data = []
@@ -8,6 +18,7 @@ class Packet:
         self.timestamp = 0.0
         self.global_sequence_num = 0
         self.sequence_num = 0
+        self.host_time = 0.0  # timestamp converted to host time by the device's ClockSync
 
     def set_null_params(self):
         self.name = None
@@ -16,60 +27,192 @@ class Packet:
         self.timestamp = 0.0
         self.global_sequence_num = -1
         self.sequence_num = -1
+        self.host_time = 0.0
+
+    def __reduce__(self):
+        # pickle as a flat tuple of values instead of a dictionary of attribute names
+        return _unpickle_packet, (
+            self.__class__, self.name, self.data, self.receive_time, self.timestamp,
+            self.global_sequence_num, self.sequence_num, self.host_time
+        )
 
     def __str__(self):
         string = "%s(" % self.__class__.__name__
-        for key, value in self.__dict__.items():
-            string += "%s=%s, " % (key, value)
+        for key in Packet.__slots__:
+            string += "%s=%s, " % (key, getattr(self, key))
         return string[:-2] + ")"
 
+
+def _unpickle_packet(cls, name, data, receive_time, timestamp, global_sequence_num, sequence_num, host_time):
+    packet = cls.__new__(cls)
+    packet.name = name
+    packet.data = data
+    packet.receive_time = receive_time
+    packet.timestamp = timestamp
+    packet.global_sequence_num = global_sequence_num
+    packet.sequence_num = sequence_num
+    packet.host_time = host_time
+    return packet
+
+
+FLOAT_REGEX = r"[-+]?(?:(?:\d*\.\d+)|(?:\d+\.?))(?:[Ee][+-]?\d+)?"
+INT_REGEX = r"[-+]?[0-9]+"
+
+GLOBAL_PATTERN = re.compile(r"Packet(\(.*\))")
+FIELD_PATTERNS = {
+    "timestamp": (re.compile("[, (]timestamp=(%s)[, )]" % FLOAT_REGEX), float),
+    "global_sequence_num": (re.compile("[, (]global_sequence_num=(%s)[,)]" % INT_REGEX), int),
+    "receive_time": (re.compile("[, (]receive_time=(%s)[, )]" % FLOAT_REGEX), float),
+    "sequence_num": (re.compile("[, (]sequence_num=(%s)[, )]" % FLOAT_REGEX), int),
+    "name": (re.compile(r"[, (]name=(.*?)[, )]"), str),
+    "data": (re.compile(r"[, (]data=(None|\[.*?\])[, )]"), str),
+}
+# packets printed before host_time was added don't have it
+OPTIONAL_FIELD_PATTERNS = {
+    "host_time": (re.compile("[, (]host_time=(%s)[, )]" % FLOAT_REGEX), float),
+}
+# a data segment is parsed as a float if it contains anything that looks like a number
+NUMBER_PATTERN = re.compile(FLOAT_REGEX)
+
+# exactly what Packet.__str__ prints. Names and data containing characters that could confuse
+# the field searches in parse aren't matched here and go through parse instead
+PRINTED_PACKET_PATTERN = re.compile(
+    r"\(name=([^ ,)=]*), data=\[([^=\]]*)\], receive_time=(%s), timestamp=(%s), "
+    r"global_sequence_num=(%s), sequence_num=(%s)(?:, host_time=(%s))?\)" % (
+        FLOAT_REGEX, FLOAT_REGEX, INT_REGEX, FLOAT_REGEX, FLOAT_REGEX
+    )
+)
+
+
 def parse(string):
     packet = Packet()
 
-    global_regex = r"Packet(\(.*\))"
-
-    match = re.search(global_regex, string)
+    match = GLOBAL_PATTERN.search(string)
     if match is None or len(match.groups()) == 0:
         return None
 
     string = match.group(1)
 
-    float_regex = r"[-+]?(?:(?:\d*\.\d+)|(?:\d+\.?))(?:[Ee][+-]?\d+)?"
-    int_regex = r"[-+]?[0-9]+"
-
-    timestamp_regex = re.compile("[, (]timestamp=(%s)[, )]" % float_regex)
-    global_sequence_num_regex = re.compile("[, (]global_sequence_num=(%s)[,)]" % int_regex)
-    receive_time_regex = re.compile("[, (]receive_time=(%s)[, )]" % float_regex)
-    sequence_num_regex = re.compile("[, (]sequence_num=(%s)[, )]" % float_regex)
-    name_regex = r"[, (]name=(.*?)[, )]"
-    data_regex = r"[, (]data=\[(.*?)\][, )]"
-
-    all_regexes = {
-        "timestamp": (timestamp_regex, float),
-        "global_sequence_num": (global_sequence_num_regex, int),
-        "receive_time": (receive_time_regex, float),
-        "sequence_num": (sequence_num_regex, int),
-        "name": (name_regex, str),
-        "data": (data_regex, str)
-    }
-
-    for name, info in all_regexes.items():
+    for name, info in FIELD_PATTERNS.items():
         regex, data_type = info
-        match = re.search(regex, string)
+        match = regex.search(string)
         if match is None:
             raise ValueError("Couldn't find required property '%s' in string '%s'" % (name, string))
-        packet.__dict__[name] = data_type(match.group(1))
+        setattr(packet, name, data_type(match.group(1)))
+
+    for name, info in OPTIONAL_FIELD_PATTERNS.items():
+        regex, data_type = info
+        match = regex.search(string)
+        if match is not None:
+            setattr(packet, name, data_type(match.group(1)))
+
+    if packet.data == "None":
+        # null packets (see Packet.set_null_params) and first packets without data
+        packet.data = None
+    else:
+        packet.data = _parse_data_segments(packet.data[1:-1])
+
+    return packet
 
+
+def _parse_data_segments(string):
     parsed_data = []
-    for segment in packet.data.split(", "):
-        parsed_datum = None
-        if re.search(float_regex, segment):
+    for segment in string.split(", "):
+        if NUMBER_PATTERN.search(segment):
             parsed_datum = float(segment)
-        elif re.search(int_regex, segment):
-            parsed_datum = int(segment)
         else:
-            parsed_datum = str(segment)
+            parsed_datum = segment
         parsed_data.append(parsed_datum)
-    packet.data = parsed_data
+    return parsed_data
+
+
+def parse_line(line):
+    """
+    Same result as parse but scans lines printed by Packet.__str__ with one precompiled pattern.
+    Anything else falls back to parse.
+    """
+    start = line.find("Packet(")
+    end = line.rfind(")")
+    if start < 0 or end < start + 7:
+        return None
+
+    match = PRINTED_PACKET_PATTERN.fullmatch(line, start + 6, end + 1)
+    if match is None:
+        return parse(line)
+    name, data, receive_time, timestamp, global_sequence_num, sequence_num, host_time = match.groups()
 
+    packet = Packet()
+    packet.name = name
+    packet.data = _parse_data_segments(data)
+    packet.receive_time = float(receive_time)
+    packet.timestamp = float(timestamp)
+    packet.global_sequence_num = int(global_sequence_num)
+    packet.sequence_num = int(sequence_num)
+    if host_time is not None:
+        packet.host_time = float(host_time)
     return packet
+
+
+def iter_packets(file):
+    """Lazily parse a text log one line at a time. Lines that aren't packets are skipped"""
+    for line in file:
+        packet = _parse_log_line(line)
+        if packet is not None:
+            yield packet
+
+
+def _parse_log_line(line):
+    """parse_line, but a garbled line is logged and skipped instead of ending the whole parse"""
+    try:
+        return parse_line(line)
+    except ValueError as error:
+        logging.getLogger("Device Factory").warning("Skipping unparsable log line: %s" % error)
+        return None
+
+
+def parse_file(path, processes=1, chunk_size=LOG_PARSE_CHUNK_SIZE):
+    """
+    Lazily parse a text log of printed Packets.
+
+    :param path: log file
+    :param processes: number of worker processes. With more than one, the file is split into
+        chunk_size byte pieces that are parsed in parallel. Packets still come out in file order
+        and only a few chunks are held in memory at a time
+    :param chunk_size: bytes per piece when using worker processes
+    """
+    if processes <= 1:
+        with open(path, encoding="utf-8", errors="replace") as file:
+            yield from iter_packets(file)
+        return
+
+    file_size = os.path.getsize(path)
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = collections.deque()
+        for chunk_start in range(0, file_size, chunk_size):
+            chunk_end = min(chunk_start + chunk_size, file_size)
+            pending.append(pool.apply_async(_parse_chunk, (path, chunk_start, chunk_end)))
+            if len(pending) >= 2 * processes:
+                yield from pending.popleft().get()
+        while len(pending) > 0:
+            yield from pending.popleft().get()
+    finally:
+        pool.terminate()
+
+
+def _parse_chunk(path, chunk_start, chunk_end):
+    """Parse the lines that start between chunk_start and chunk_end"""
+    packets = []
+    with open(path, "rb") as file:
+        if chunk_start > 0:
+            # skip the end of the line that started in the previous chunk
+            file.seek(chunk_start - 1)
+            file.readline()
+        while file.tell() < chunk_end:
+            line = file.readline()
+            if len(line) == 0:
+                break
+            packet = _parse_log_line(line.decode("utf-8", "replace"))
+            if packet is not None:
+                packets.append(packet)
+    return packets
@@ -0,0 +1,369 @@
+import os
+import json
+import mmap
+import queue
+import bisect
+import struct
+import logging
+import threading
+
+from .packet import Packet
+from .default_params import *
+
+# A recording is three files:
+#   <path>        RECORDING_MAGIC followed by packet records
+#   <path>.names  one JSON encoded [name, layout] line per interned name ID, so names can hold any character
+#   <path>.idx    INDEX_STRUCT entries pointing at every RECORDER_INDEX_INTERVAL'th record
+#
+# A record is RECORD_STRUCT followed by the payload. The layout has one character per value:
+#   'd' int (int64), 'f' float (double), 's' string (uint16 length then utf-8 bytes)
+# Packets with data=None have RECORD_NULL_DATA set in their flags and no payload
+RECORDING_MAGIC = b"AFREC\x00\x03\x00"
+NAMES_EXTENSION = ".names"
+INDEX_EXTENSION = ".idx"
+
+# global_sequence_num, timestamp, receive_time, host_time, name id, payload size in bytes, flags
+RECORD_STRUCT = struct.Struct("<qdddIIB")
+RECORD_NULL_DATA = 0x01
+# record number, global_sequence_num, receive_time, offset into the recording
+INDEX_STRUCT = struct.Struct("<QqdQ")
+STRING_LENGTH_STRUCT = struct.Struct("<H")
+
+LAYOUT_CODES = {
+    int: "d",
+    float: "f",
+    str: "s",
+}
+LAYOUT_STRUCT_CODES = {
+    'd': "q",
+    'f': "d",
+}
+
+
+class PacketRecorder:
+    def __init__(self, path, chunk_size=RECORDER_CHUNK_SIZE, index_interval=RECORDER_INDEX_INTERVAL,
+                 flush_interval=RECORDER_FLUSH_INTERVAL):
+        """
+        Appends packets to a compact binary recording (see Recording for reading it back).
+        record only puts the batch on a queue. Encoding and writing happen on the recorder's own
+        thread in large chunks so the serial read path never waits on the disk.
+
+        Arduinos made with record_path create one of these in their device loop.
+
+        :param path: file to record to. Overwritten if it exists. Sidecar files are written next to it
+        :param chunk_size: bytes to collect before writing to the file
+        :param index_interval: records between index entries
+        :param flush_interval: longest time in seconds that encoded packets wait before being written
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.index_interval = index_interval
+        self.flush_interval = flush_interval
+        self.logger = logging.getLogger("Device Factory")
+
+        self.record_count = 0
+        self.error = None
+
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+
+        self._name_ids = {}
+        self._structs = {}
+
+        self._buffer = bytearray()
+        self._index_buffer = bytearray()
+        self._names_buffer = []
+        self._offset = 0  # file offset of the start of the buffer
+
+        self._file = None
+        self._index_file = None
+        self._names_file = None
+
+    def start(self):
+        self._file = open(self.path, "wb")
+        self._index_file = open(self.path + INDEX_EXTENSION, "wb")
+        self._names_file = open(self.path + NAMES_EXTENSION, "w", encoding="utf-8")
+        self._file.write(RECORDING_MAGIC)
+        self._file.flush()
+        self._offset = len(RECORDING_MAGIC)
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def record(self, packets):
+        """Queue a batch of packets to be written. Never blocks"""
+        if len(packets) > 0 and self.error is None:
+            self._queue.put(packets)
+
+    def close(self):
+        """Write everything that's been queued and close the files"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+        self._file.close()
+        self._index_file.close()
+        self._names_file.close()
+
+    def _run(self):
+        try:
+            while True:
+                try:
+                    packets = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    self._flush()
+                    continue
+                if packets is None:
+                    break
+
+                for packet in packets:
+                    self._encode(packet)
+                if len(self._buffer) >= self.chunk_size:
+                    self._flush()
+            self._flush()
+        except BaseException as error:
+            self.error = error
+            self.logger.error("Recording to '%s' stopped: %s" % (self.path, error))
+
+    def _flush(self):
+        if len(self._buffer) == 0:
+            return
+
+        # names and records have to be on disk before the index can point at them
+        if len(self._names_buffer) > 0:
+            self._names_file.write("".join(self._names_buffer))
+            self._names_file.flush()
+            self._names_buffer.clear()
+
+        self._file.write(self._buffer)
+        self._file.flush()
+        self._offset += len(self._buffer)
+        self._buffer.clear()
+
+        if len(self._index_buffer) > 0:
+            self._index_file.write(self._index_buffer)
+            self._index_file.flush()
+            self._index_buffer.clear()
+
+    def _intern(self, name, layout):
+        key = (name, layout)
+        name_id = self._name_ids.get(key)
+        if name_id is None:
+            name_id = len(self._name_ids)
+            self._name_ids[key] = name_id
+            self._names_buffer.append(json.dumps([name, layout]) + "\n")
+        return name_id
+
+    def _get_struct(self, layout):
+        """Cached struct for layouts with no strings"""
+        data_struct = self._structs.get(layout)
+        if data_struct is None:
+            data_struct = struct.Struct("<" + "".join(LAYOUT_STRUCT_CODES[c] for c in layout))
+            self._structs[layout] = data_struct
+        return data_struct
+
+    def _pack(self, layout, data):
+        if "s" not in layout:
+            return self._get_struct(layout).pack(*data)
+
+        payload = bytearray()
+        for data_type, datum in zip(layout, data):
+            if data_type == "s":
+                encoded = str(datum).encode("utf-8")[:0xffff]
+                payload += STRING_LENGTH_STRUCT.pack(len(encoded))
+                payload += encoded
+            else:
+                payload += struct.pack("<" + LAYOUT_STRUCT_CODES[data_type], datum)
+        return payload
+
+    def _encode(self, packet):
+        data = packet.data
+        flags = 0
+        if data is None:
+            data = []
+            flags = RECORD_NULL_DATA
+
+        layout = ""
+        for datum in data:
+            layout += LAYOUT_CODES.get(type(datum), "s")
+
+        try:
+            payload = self._pack(layout, data)
+        except struct.error:
+            # ints that don't fit in 64 bits are stored as strings
+            layout = "s" * len(data)
+            payload = self._pack(layout, data)
+
+        if self.record_count % self.index_interval == 0:
+            self._index_buffer += INDEX_STRUCT.pack(
+                self.record_count, packet.global_sequence_num, packet.receive_time, self._offset + len(self._buffer)
+            )
+        self._buffer += RECORD_STRUCT.pack(
+            packet.global_sequence_num, packet.timestamp, packet.receive_time, packet.host_time,
+            self._intern(packet.name, layout), len(payload), flags
+        )
+        self._buffer += payload
+        self.record_count += 1
+
+
+class Recording:
+    def __init__(self, path):
+        """
+        Read a recording made by PacketRecorder. The recording is memory mapped and the sidecar
+        index is used to jump close to the requested sequence number or time, so slicing a
+        large recording only reads the records that are needed.
+
+            with Recording("run.rec") as recording:
+                for packet in recording.by_time(start_time, start_time + 10):
+                    ...
+
+        Only what was on disk when the recording was opened is visible.
+
+        :param path: recording file given to PacketRecorder
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < len(RECORDING_MAGIC):
+            self._file.close()
+            raise ValueError("'%s' isn't a packet recording" % path)
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(RECORDING_MAGIC)] != RECORDING_MAGIC:
+            self.close()
+            raise ValueError("'%s' isn't a packet recording" % path)
+
+        self._names = []
+        self._structs = {}
+        self._load_names()
+
+        self._index_sequence_nums = []
+        self._index_times = []
+        self._index_offsets = []
+        self._load_index()
+
+    def _load_names(self):
+        names_path = self.path + NAMES_EXTENSION
+        if not os.path.isfile(names_path):
+            return
+        with open(names_path, encoding="utf-8") as file:
+            lines = file.read().split("\n")[:-1]
+        self._names = []
+        for line in lines:
+            name, layout = json.loads(line)
+            self._names.append((name, layout))
+
+    def _load_index(self):
+        index_path = self.path + INDEX_EXTENSION
+        if not os.path.isfile(index_path):
+            return
+        with open(index_path, "rb") as file:
+            contents = file.read()
+        contents = contents[:len(contents) - len(contents) % INDEX_STRUCT.size]
+        for record_num, global_sequence_num, receive_time, offset in INDEX_STRUCT.iter_unpack(contents):
+            if offset >= len(self._map):
+                break
+            self._index_sequence_nums.append(global_sequence_num)
+            self._index_times.append(receive_time)
+            self._index_offsets.append(offset)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        return self._iter_records(len(RECORDING_MAGIC))
+
+    def by_sequence_num(self, start=None, stop=None):
+        """Packets with start <= global_sequence_num < stop. None leaves that end open"""
+        offset = self._seek(self._index_sequence_nums, start)
+        for packet in self._iter_records(offset):
+            if start is not None and packet.global_sequence_num < start:
+                continue
+            if stop is not None and packet.global_sequence_num >= stop:
+                break
+            yield packet
+
+    def by_time(self, start=None, stop=None):
+        """Packets with start <= receive_time < stop. None leaves that end open"""
+        offset = self._seek(self._index_times, start)
+        for packet in self._iter_records(offset):
+            if start is not None and packet.receive_time < start:
+                continue
+            if stop is not None and packet.receive_time >= stop:
+                break
+            yield packet
+
+    def _seek(self, keys, start):
+        """Offset of the last indexed record before start"""
+        if start is None:
+            return len(RECORDING_MAGIC)
+        position = bisect.bisect_left(keys, start) - 1
+        if position < 0:
+            return len(RECORDING_MAGIC)
+        return self._index_offsets[position]
+
+    def _get_struct(self, layout):
+        data_struct = self._structs.get(layout)
+        if data_struct is None:
+            if "s" in layout:
+                data_struct = False
+            else:
+                data_struct = struct.Struct("<" + "".join(LAYOUT_STRUCT_CODES[c] for c in layout))
+            self._structs[layout] = data_struct
+        return data_struct
+
+    def _iter_records(self, offset):
+        buffer = self._map
+        size = len(buffer)
+        while offset + RECORD_STRUCT.size <= size:
+            global_sequence_num, timestamp, receive_time, host_time, name_id, payload_size, flags = \
+                RECORD_STRUCT.unpack_from(buffer, offset)
+            offset += RECORD_STRUCT.size
+            if offset + payload_size > size:
+                # the recorder was stopped part way through writing this record
+                break
+
+            if name_id >= len(self._names):
+                self._load_names()
+            name, layout = self._names[name_id]
+
+            data_struct = self._get_struct(layout)
+            if flags & RECORD_NULL_DATA:
+                data = None
+            elif data_struct:
+                data = list(data_struct.unpack_from(buffer, offset))
+            else:
+                data = self._unpack_data(buffer, offset, layout)
+            offset += payload_size
+
+            packet = Packet()
+            packet.global_sequence_num = global_sequence_num
+            packet.timestamp = timestamp
+            packet.receive_time = receive_time
+            packet.host_time = host_time
+            packet.name = name
+            packet.data = data
+            yield packet
+
+    @staticmethod
+    def _unpack_data(buffer, offset, layout):
+        data = []
+        for data_type in layout:
+            if data_type == "s":
+                length = STRING_LENGTH_STRUCT.unpack_from(buffer, offset)[0]
+                offset += STRING_LENGTH_STRUCT.size
+                data.append(bytes(buffer[offset: offset + length]).decode("utf-8", "ignore"))
+                offset += length
+            else:
+                datum_struct_code = "<" + LAYOUT_STRUCT_CODES[data_type]
+                data.append(struct.unpack_from(datum_struct_code, buffer, offset)[0])
+                offset += struct.calcsize(datum_struct_code)
+        return data
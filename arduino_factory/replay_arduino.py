@@ -0,0 +1,189 @@
+import time
+import logging
+import threading
+
+from .packet import Packet, iter_packets
+from .recorder import Recording, RECORDING_MAGIC
+
+PACE_FIELDS = ("receive_time", "timestamp")
+
+
+class ReplayArduino:
+    def __init__(self, source, factory=None, whoiam="replay", speed=1.0, pace_by="receive_time"):
+        """
+        Plays back a recorded session through the same interface as a live Arduino
+        (start, read, read_batch, empty, first_packet, start_time, stop).
+
+        Packets are pulled from the source one at a time when they're due so memory use doesn't
+        depend on the length of the recording. Nothing runs in the background.
+
+            arduino = ReplayArduino("run.rec", factory, speed=100)
+            first_packet = arduino.start()
+            while factory.ok():
+                packet = arduino.read()
+
+        :param source: a recording made by PacketRecorder, a text file of printed Packets
+            (str(packet) per line) or any iterable of Packets
+        :param factory: DeviceFactory to report to. factory.ok() turns False when the replay finishes
+        :param whoiam: whoiam ID to report
+        :param speed: playback speed. 1.0 is real time, 100 is 100x. None replays as fast as possible
+        :param pace_by: which time to pace packets with. "receive_time" or "timestamp"
+        """
+        if pace_by not in PACE_FIELDS:
+            raise ValueError("pace_by must be one of %s, not '%s'" % (PACE_FIELDS, pace_by))
+        if speed is not None and speed <= 0:
+            raise ValueError("speed must be positive or None, not %s" % speed)
+
+        self.source = source
+        self.whoiam = whoiam
+        self.speed = speed
+        self.pace_by = pace_by
+        self.start_time = 0.0
+        self.first_packet = None
+        self.logger = logging.getLogger("Device Factory")
+
+        self._device_exit_event = threading.Event()
+        if factory is not None:
+            factory.arduino_exit_events.append(self._device_exit_event)
+
+        self._packets = None
+        self._recording = None
+        self._file = None
+        self._next_packet = None
+        self._replay_start_time = 0.0  # wall clock time the first packet was due at
+        self._first_packet_time = 0.0  # pace_by time of the first packet
+
+    def start(self):
+        """Open the source and return the recorded first packet"""
+        if self._packets is not None:
+            self.logger.warning("Start already called for '%s'" % self.whoiam)
+            return None
+        self._packets = self._open_source()
+        self._next_packet = next(self._packets, None)
+
+        if self._next_packet is not None and self._next_packet.name == "first_packet" and \
+                self._next_packet.global_sequence_num == -1:
+            self.first_packet = self._next_packet
+            self.start_time = self.first_packet.receive_time
+            self._next_packet = next(self._packets, None)
+        else:
+            self.first_packet = Packet()
+            self.first_packet.global_sequence_num = -1
+            self.first_packet.name = "first_packet"
+            self.first_packet.data = None
+            if self._next_packet is not None:
+                self.start_time = self._next_packet.receive_time
+
+        if self._next_packet is None:
+            self._finish()
+        else:
+            self._first_packet_time = getattr(self._next_packet, self.pace_by)
+        self._replay_start_time = time.time()
+        return self.first_packet
+
+    def _open_source(self):
+        if not isinstance(self.source, str):
+            return iter(self.source)
+
+        with open(self.source, "rb") as file:
+            is_recording = file.read(len(RECORDING_MAGIC)) == RECORDING_MAGIC
+        if is_recording:
+            self._recording = Recording(self.source)
+            return iter(self._recording)
+        else:
+            self._file = open(self.source, encoding="utf-8", errors="replace")
+            return iter_packets(self._file)
+
+    def _due_time(self, packet):
+        """Wall clock time a packet should be read at"""
+        if self.speed is None:
+            return 0.0
+        return self._replay_start_time + (getattr(packet, self.pace_by) - self._first_packet_time) / self.speed
+
+    def _pop_due(self, block, timeout):
+        """Next packet if it's due (waiting up to timeout for it if block is True), otherwise None"""
+        if self._next_packet is None:
+            return None
+
+        delay = self._due_time(self._next_packet) - time.time()
+        if delay > 0:
+            if not block or (timeout is not None and timeout <= 0):
+                return None
+            if timeout is not None and delay > timeout:
+                time.sleep(timeout)
+                return None
+            time.sleep(delay)
+
+        packet = self._next_packet
+        self._next_packet = next(self._packets, None)
+        if self._next_packet is None:
+            self._finish()
+        return packet
+
+    def read(self, block=True, timeout=1):
+        packet = self._pop_due(block, timeout)
+        if packet is None:
+            packet = Packet()
+            packet.set_null_params()
+        return packet
+
+    def read_batch(self, max_items=None, timeout=1):
+        """
+        Get all packets that are due in one call.
+
+        :param max_items: maximum number of packets to return. None returns everything due
+        :param timeout: seconds to wait if no packets are due. None waits forever, 0 doesn't wait
+        :return: a list of Packets. Empty if the timeout expired
+        """
+        packet = self._pop_due(timeout != 0, timeout)
+        if packet is None:
+            return []
+
+        packets = [packet]
+        while max_items is None or len(packets) < max_items:
+            packet = self._pop_due(False, 0)
+            if packet is None:
+                break
+            packets.append(packet)
+        return packets
+
+    def empty(self):
+        """True if no packet is due yet"""
+        return self._next_packet is None or self._due_time(self._next_packet) > time.time()
+
+    def finished(self):
+        """True once every packet has been read"""
+        return self._device_exit_event.is_set()
+
+    def write(self, packet):
+        """Commands have nowhere to go during a replay. They're logged and dropped"""
+        self.logger.debug("Replay '%s' dropped command: '%s'" % (self.whoiam, packet))
+
+    def write_at(self, packet, when):
+        self.write(packet)
+
+    def write_after(self, packet, delay):
+        self.write(packet)
+
+    def write_pause(self, pause_time, relative_time=True):
+        pass
+
+    def clear_write_queue(self):
+        pass
+
+    def _finish(self):
+        self._device_exit_event.set()
+        self._close_source()
+
+    def _close_source(self):
+        if self._recording is not None:
+            self._recording.close()
+            self._recording = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stop(self):
+        self._next_packet = None
+        self._packets = iter(())
+        self._finish()
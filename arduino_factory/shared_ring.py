@@ -0,0 +1,243 @@
+import struct
+import contextlib
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # python < 3.8
+    shared_memory = None
+
+from .packet import Packet
+from .default_params import *
+
+# head: records written, tail: records consumed, name count
+HEADER_STRUCT = struct.Struct("<QQQ")
+HEADER_SIZE = 64  # keep the records on their own cache lines
+HEAD_OFFSET = 0
+TAIL_OFFSET = 8
+NAME_COUNT_OFFSET = 16
+
+# global_sequence_num, timestamp, receive_time, host_time, name id, number of payload values
+RECORD_HEADER_STRUCT = struct.Struct("<qdddII")
+NAME_SLOT_SIZE = 64
+
+# payload value types in a layout. Both take 8 bytes
+INT_FIELD = "q"
+FLOAT_FIELD = "d"
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+_counter_struct = struct.Struct("<Q")
+
+
+class SharedRingBuffer:
+    def __init__(self, capacity=SHARED_MEMORY_CAPACITY, max_fields=SHARED_MEMORY_MAX_FIELDS,
+                 max_names=SHARED_MEMORY_MAX_NAMES):
+        """
+        Lock-free single producer, single consumer ring buffer of fixed size packet records
+        living in shared memory. The device process writes, the consumer process reads.
+
+        Each record holds the global sequence number, timestamp, receive time, host time, an interned
+        name ID and up to max_fields numbers. The interned names (and the int/float layout of
+        the payload) are stored in a table at the start of the shared memory block. Ints are stored
+        as int64 and floats as doubles so neither loses precision.
+        Packets containing strings, ints that don't fit in 64 bits or more than max_fields values
+        can't be stored. A batch with any of those isn't written at all so the caller can send it
+        another way without reordering it. Nothing is dropped here: when the ring is full, write
+        stops and the caller decides what to do with the rest.
+
+        :param capacity: number of records in the ring
+        :param max_fields: maximum number of values in a packet's data
+        :param max_names: maximum number of distinct name and data layout pairs
+        """
+        if shared_memory is None:
+            raise RuntimeError("Shared memory transport requires python 3.8 or newer")
+
+        self.capacity = capacity
+        self.max_fields = max_fields
+        self.max_names = max_names
+        self.record_size = RECORD_HEADER_STRUCT.size + 8 * max_fields
+        self._names_offset = HEADER_SIZE
+        self._records_offset = self._names_offset + NAME_SLOT_SIZE * max_names
+
+        self._memory = shared_memory.SharedMemory(
+            create=True, size=self._records_offset + self.record_size * capacity
+        )
+        self._buffer = self._memory.buf
+        HEADER_STRUCT.pack_into(self._buffer, 0, 0, 0, 0)
+
+        # producer side name interning and the number of records written
+        self._name_ids = {}
+        self._written = 0
+
+        # consumer side copy of the name table
+        self._names = []
+
+        self._payload_structs = {}
+
+    @property
+    def name(self):
+        """Name of the shared memory block"""
+        return self._memory.name
+
+    def _get_counter(self, offset):
+        return _counter_struct.unpack_from(self._buffer, offset)[0]
+
+    def _set_counter(self, offset, value):
+        _counter_struct.pack_into(self._buffer, offset, value)
+
+    def available(self):
+        """Number of records waiting to be read"""
+        return self._get_counter(HEAD_OFFSET) - self._get_counter(TAIL_OFFSET)
+
+    def written(self):
+        """Producer side. Number of records written so far"""
+        return self._written
+
+    def consumed(self):
+        """Consumer side. Number of records read so far, which is the position of the next record"""
+        return self._get_counter(TAIL_OFFSET)
+
+    def _payload_struct(self, layout):
+        if layout not in self._payload_structs:
+            self._payload_structs[layout] = struct.Struct("<" + layout)
+        return self._payload_structs[layout]
+
+    # ----- producer -----
+
+    def _intern(self, name, layout):
+        key = (name, layout)
+        name_id = self._name_ids.get(key)
+        if name_id is not None:
+            return name_id
+
+        encoded = ("%s\t%s" % (name, layout)).encode("utf-8")
+        name_id = len(self._name_ids)
+        if name_id >= self.max_names or len(encoded) >= NAME_SLOT_SIZE:
+            return None
+
+        offset = self._names_offset + name_id * NAME_SLOT_SIZE
+        self._buffer[offset] = len(encoded)
+        self._buffer[offset + 1: offset + 1 + len(encoded)] = encoded
+
+        self._name_ids[key] = name_id
+
+        # publish the name after it's written
+        self._set_counter(NAME_COUNT_OFFSET, name_id + 1)
+        return name_id
+
+    def _layout(self, data):
+        """int64/double layout of a packet's data. None if it can't be stored in a record"""
+        if data is None or len(data) > self.max_fields:
+            return None
+        layout = ""
+        for datum in data:
+            datum_type = type(datum)
+            if datum_type is int and INT_MIN <= datum <= INT_MAX:
+                layout += INT_FIELD
+            elif datum_type is float:
+                layout += FLOAT_FIELD
+            else:
+                return None
+        return layout
+
+    def write(self, packets):
+        """
+        Append as many packets as there's room for. Returns the number written, which is less than
+        len(packets) if the ring filled up. Returns None without writing anything if any of the packets
+        don't fit in a record.
+        """
+        name_ids = []
+        for packet in packets:
+            layout = self._layout(packet.data)
+            if layout is None:
+                return None
+            name_id = self._intern(packet.name, layout)
+            if name_id is None:
+                return None
+            name_ids.append((name_id, layout))
+
+        head = self._written
+        count = min(len(packets), self.capacity - (head - self._get_counter(TAIL_OFFSET)))
+
+        for packet, (name_id, layout) in zip(packets[:count], name_ids):
+            offset = self._records_offset + (head % self.capacity) * self.record_size
+            RECORD_HEADER_STRUCT.pack_into(
+                self._buffer, offset,
+                packet.global_sequence_num, packet.timestamp, packet.receive_time, packet.host_time, name_id,
+                len(layout)
+            )
+            self._payload_struct(layout).pack_into(self._buffer, offset + RECORD_HEADER_STRUCT.size, *packet.data)
+            head += 1
+
+        # publish the records after they're written
+        self._written = head
+        self._set_counter(HEAD_OFFSET, head)
+        return count
+
+    # ----- consumer -----
+
+    def _lookup_name(self, name_id):
+        if name_id >= len(self._names):
+            name_count = self._get_counter(NAME_COUNT_OFFSET)
+            for index in range(len(self._names), name_count):
+                offset = self._names_offset + index * NAME_SLOT_SIZE
+                length = self._buffer[offset]
+                name, layout = bytes(self._buffer[offset + 1: offset + 1 + length]).decode("utf-8").rsplit("\t", 1)
+                self._names.append((name, layout))
+        return self._names[name_id]
+
+    @contextlib.contextmanager
+    def records(self, max_items=None):
+        """
+        Borrow the available records without copying them. Yields a list of memoryviews into
+        the shared memory block, one per record. Use unpack to decode them. The records are
+        released back to the producer when the with block exits so the views shouldn't
+        be used after that.
+
+            with ring.records() as views:
+                for view in views:
+                    sequence_num, timestamp, receive_time, host_time, name, data = ring.unpack(view)
+        """
+        tail = self._get_counter(TAIL_OFFSET)
+        count = self._get_counter(HEAD_OFFSET) - tail
+        if max_items is not None:
+            count = min(count, max_items)
+
+        views = []
+        for index in range(tail, tail + count):
+            offset = self._records_offset + (index % self.capacity) * self.record_size
+            views.append(self._buffer[offset: offset + self.record_size])
+        try:
+            yield views
+        finally:
+            for view in views:
+                view.release()
+            self._set_counter(TAIL_OFFSET, tail + count)
+
+    def unpack(self, view):
+        """Decode a record into (global_sequence_num, timestamp, receive_time, host_time, name, data)"""
+        global_sequence_num, timestamp, receive_time, host_time, name_id, length = \
+            RECORD_HEADER_STRUCT.unpack_from(view)
+        name, layout = self._lookup_name(name_id)
+        data = list(self._payload_struct(layout).unpack_from(view, RECORD_HEADER_STRUCT.size))
+        return global_sequence_num, timestamp, receive_time, host_time, name, data
+
+    def read(self, max_items=None):
+        """Copy the available records out as Packets"""
+        packets = []
+        with self.records(max_items) as views:
+            for view in views:
+                packet = Packet()
+                packet.global_sequence_num, packet.timestamp, packet.receive_time, packet.host_time, packet.name, \
+                    packet.data = self.unpack(view)
+                packets.append(packet)
+        return packets
+
+    def close(self):
+        """Detach from the shared memory block"""
+        self._buffer = None
+        self._memory.close()
+
+    def unlink(self):
+        """Free the shared memory block. Only call from the process that created the ring."""
+        self._memory.unlink()
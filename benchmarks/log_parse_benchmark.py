@@ -0,0 +1,125 @@
+"""
+Measure lines/sec for parsing a text log of printed Packets: the original packet.parse,
+packet.parse_file, and packet.parse_file with worker processes. Run from the repository root:
+
+    python -m benchmarks.log_parse_benchmark
+"""
+import os
+import re
+import time
+import tempfile
+import multiprocessing
+
+from arduino_factory.packet import Packet, parse_file
+
+NUM_LINES = 200000
+
+
+def original_parse(string):
+    """packet.parse before the patterns were precompiled"""
+    packet = Packet()
+
+    global_regex = r"Packet(\(.*\))"
+
+    match = re.search(global_regex, string)
+    if match is None or len(match.groups()) == 0:
+        return None
+
+    string = match.group(1)
+
+    float_regex = r"[-+]?(?:(?:\d*\.\d+)|(?:\d+\.?))(?:[Ee][+-]?\d+)?"
+    int_regex = r"[-+]?[0-9]+"
+
+    timestamp_regex = re.compile("[, (]timestamp=(%s)[, )]" % float_regex)
+    global_sequence_num_regex = re.compile("[, (]global_sequence_num=(%s)[,)]" % int_regex)
+    receive_time_regex = re.compile("[, (]receive_time=(%s)[, )]" % float_regex)
+    sequence_num_regex = re.compile("[, (]sequence_num=(%s)[, )]" % float_regex)
+    name_regex = r"[, (]name=(.*?)[, )]"
+    data_regex = r"[, (]data=\[(.*?)\][, )]"
+
+    all_regexes = {
+        "timestamp": (timestamp_regex, float),
+        "global_sequence_num": (global_sequence_num_regex, int),
+        "receive_time": (receive_time_regex, float),
+        "sequence_num": (sequence_num_regex, int),
+        "name": (name_regex, str),
+        "data": (data_regex, str)
+    }
+
+    for name, info in all_regexes.items():
+        regex, data_type = info
+        match = re.search(regex, string)
+        if match is None:
+            raise ValueError("Couldn't find required property '%s' in string '%s'" % (name, string))
+        setattr(packet, name, data_type(match.group(1)))
+
+    parsed_data = []
+    for segment in packet.data.split(", "):
+        parsed_datum = None
+        if re.search(float_regex, segment):
+            parsed_datum = float(segment)
+        elif re.search(int_regex, segment):
+            parsed_datum = int(segment)
+        else:
+            parsed_datum = str(segment)
+        parsed_data.append(parsed_datum)
+    packet.data = parsed_data
+
+    return packet
+
+
+def original_parse_file(path):
+    with open(path) as file:
+        for line in file:
+            packet = original_parse(line)
+            if packet is not None:
+                yield packet
+
+
+def write_log(path):
+    with open(path, "w") as file:
+        for index in range(NUM_LINES):
+            packet = Packet()
+            packet.receive_time = 1500000000.0 + index * 0.001
+            packet.timestamp = index * 0.001
+            packet.global_sequence_num = index
+            if index % 4 == 0:
+                packet.name = "status"
+                packet.data = ["ok", index]
+            else:
+                packet.name = "imu"
+                packet.data = [index * 0.01, -index * 0.02, 9.81, index]
+            print(packet, file=file)
+
+
+def measure(parse_fn, path):
+    t0 = time.perf_counter()
+    packets = [str(packet) for packet in parse_fn(path)]
+    duration = time.perf_counter() - t0
+    return packets, NUM_LINES / duration
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "log.txt")
+        write_log(path)
+
+        processes = max(2, multiprocessing.cpu_count())
+        parsers = [
+            ("original parse", original_parse_file),
+            ("parse_file", parse_file),
+            ("parse_file x%d" % processes, lambda path: parse_file(path, processes)),
+        ]
+
+        expected = None
+        print("%-20s %14s" % ("parser", "lines/s"))
+        for name, parse_fn in parsers:
+            packets, rate = measure(parse_fn, path)
+            if expected is None:
+                expected = packets
+            assert packets == expected
+            print("%-20s %14.0f" % (name, rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Compare the slotted Packet against the original __dict__ based Packet.
+Reports memory per packet and how fast batches of packets go through pickle (what multiprocessing queues do).
+Run from the repository root:
+
+    python -m benchmarks.packet_benchmark
+"""
+import sys
+import time
+import pickle
+import tracemalloc
+
+from arduino_factory.packet import Packet
+
+
+class DictPacket:
+    """The original Packet implementation"""
+
+    def __init__(self):
+        self.name = ""
+        self.data = []
+        self.receive_time = 0.0
+        self.timestamp = 0.0
+        self.global_sequence_num = 0
+        self.sequence_num = 0
+
+
+NUM_PACKETS = 100000
+BATCH_SIZE = 50
+
+
+def make_packets(cls):
+    packets = []
+    for index in range(NUM_PACKETS):
+        packet = cls()
+        packet.name = "encoders"
+        packet.data = [index, index * 0.5, -index]
+        packet.receive_time = 1500000000.0 + index * 0.001
+        packet.timestamp = index * 0.001
+        packet.global_sequence_num = index
+        packets.append(packet)
+    return packets
+
+
+def measure_memory(cls):
+    tracemalloc.start()
+    packets = make_packets(cls)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # don't count the data lists, they're the same for both
+    data_size = sum(sys.getsizeof(packet.data) + sum(sys.getsizeof(datum) for datum in packet.data)
+                    for packet in packets)
+    return (size - data_size) / len(packets)
+
+
+def measure_pickle(cls):
+    packets = make_packets(cls)
+    batches = [packets[index: index + BATCH_SIZE] for index in range(0, len(packets), BATCH_SIZE)]
+
+    t0 = time.perf_counter()
+    pickled = [pickle.dumps(batch, pickle.HIGHEST_PROTOCOL) for batch in batches]
+    t1 = time.perf_counter()
+    for string in pickled:
+        pickle.loads(string)
+    t2 = time.perf_counter()
+
+    num_bytes = sum(len(string) for string in pickled)
+    return num_bytes / len(packets), len(packets) / (t1 - t0), len(packets) / (t2 - t1)
+
+
+def main():
+    print("%-12s %14s %14s %16s %16s" % ("class", "bytes/packet", "pickled bytes", "dumps packets/s", "loads packets/s"))
+    for cls in (DictPacket, Packet):
+        memory = measure_memory(cls)
+        pickled_size, dumps_rate, loads_rate = measure_pickle(cls)
+        print("%-12s %14.1f %14.1f %16.0f %16.0f" % (cls.__name__, memory, pickled_size, dumps_rate, loads_rate))
+
+
+if __name__ == '__main__':
+    main()
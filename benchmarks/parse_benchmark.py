@@ -0,0 +1,78 @@
+"""
+Measure the cost per line of Arduino._parse_data against the original format character dispatch.
+Run from the repository root:
+
+    python -m benchmarks.parse_benchmark
+"""
+import time
+
+from arduino_factory import Arduino, DeviceFactory
+
+LINES = [
+    "encoders\tdd\t1024\t-2048\t",
+    "imu\tfffffffff\t0.01\t-0.02\t9.81\t0.1\t0.2\t0.3\t12.5\t-3.25\t0.0\t",
+    "status\tsdf\tok\t5\t0.5\t",
+]
+NUM_LINES = 100000
+REPEATS = 15
+
+
+def original_parse_data(packet, is_first_packet=False):
+    data = packet.split("\t")[:-1]
+    if not is_first_packet:
+        name = data.pop(0)
+    else:
+        name = "first_packet"
+    formats = data.pop(0)
+
+    if len(formats) != len(data):
+        raise ValueError(
+            "Length of formats doesn't equal number of data segments. Name: '%s', formats: '%s', data: '%s'" % (
+                name, formats, data)
+        )
+
+    parsed_data = []
+    for data_type, datum in zip(formats, data):
+        if data_type == 'd':
+            parsed_data.append(int(datum))
+        elif data_type == 'f':
+            parsed_data.append(float(datum))
+        else:
+            parsed_data.append(datum)
+
+    return name, parsed_data
+
+
+def time_lines(parse_fn, line):
+    t0 = time.perf_counter()
+    for _ in range(NUM_LINES):
+        parse_fn(line)
+    return time.perf_counter() - t0
+
+
+def measure(parse_fns, line):
+    """
+    Best of REPEATS runs of each function in nanoseconds per line. The runs take turns so a slow
+    stretch on a busy machine doesn't land on only one of them
+    """
+    best = [None] * len(parse_fns)
+    for _ in range(REPEATS):
+        for index, parse_fn in enumerate(parse_fns):
+            duration = time_lines(parse_fn, line)
+            if best[index] is None or duration < best[index]:
+                best[index] = duration
+    return [duration / NUM_LINES * 1E9 for duration in best]
+
+
+def main():
+    arduino = Arduino("benchmark", DeviceFactory(), use_multiprocessing=False)
+
+    print("%-10s %14s %14s %8s" % ("packet", "before ns/line", "after ns/line", "speedup"))
+    for line in LINES:
+        assert original_parse_data(line) == arduino._parse_data(line)
+        before, after = measure([original_parse_data, arduino._parse_data], line)
+        print("%-10s %14.0f %14.0f %7.2fx" % (line.split("\t")[0], before, after, before / after))
+
+
+if __name__ == '__main__':
+    main()
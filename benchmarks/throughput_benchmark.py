@@ -0,0 +1,196 @@
+"""
+End to end throughput and latency through DevicePort.read -> Arduino._parse_data -> read queue -> Arduino.read_batch
+using emulated boards (see arduino_factory.emulator). Linux only.
+
+Each configuration runs in a fresh python process, so DeviceFactory is initialized once per run.
+Results are printed as a table and written as JSON so runs can be compared. Run from the repository root:
+
+    python -m benchmarks.throughput_benchmark --devices 1 4 8 --rates 1000 5000 --output results.json
+
+Reported per configuration:
+    packets/s, bytes/s      packets read by the consumers and bytes sent by the boards during the measurement
+    p50/p99 latency         time from a board sending a packet to a consumer reading it
+    cpu/device              host CPU seconds per second per device (main process plus device processes)
+    discovery               time DeviceFactory.init took
+    rss                     peak main process RSS plus device process RSS
+"""
+import os
+import sys
+import time
+import json
+import logging
+import argparse
+import resource
+import threading
+import subprocess
+
+from arduino_factory import Arduino, DeviceFactory
+from arduino_factory.emulator import VirtualArduino, EmulatedPacket
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LATENCY_PERIOD = 1000  # seconds. Board send times are sent as microseconds within this period to fit in an int
+WARMUP = 0.5  # seconds before measuring
+
+
+def send_time(index):
+    return [index, int((time.time() % LATENCY_PERIOD) * 1E6)]
+
+
+def latency(sent_micros):
+    latency_micros = int((time.time() % LATENCY_PERIOD) * 1E6) - sent_micros
+    if latency_micros < 0:
+        latency_micros += LATENCY_PERIOD * 1000000
+    return latency_micros / 1E6
+
+
+def process_cpu_time(pid):
+    """user + system CPU seconds of another process"""
+    with open("/proc/%d/stat" % pid) as file:
+        fields = file.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def process_rss(pid):
+    """resident memory of another process in bytes"""
+    with open("/proc/%d/status" % pid) as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def percentile(values, fraction):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_one(config):
+    """Run a single configuration in this process and return its results"""
+    use_multiprocessing = config["mode"] == "process"
+    boards = [
+        VirtualArduino(
+            "bench%d" % index,
+            packets=[EmulatedPacket("bench", "dd", config["rate"], send_time)],
+            use_multiprocessing=True
+        )
+        for index in range(config["devices"])
+    ]
+
+    factory = DeviceFactory(log_level=logging.WARNING, list_devices_fn=lambda: [board.address for board in boards])
+    factory.init()
+
+    arduinos = [
+        Arduino(board.whoiam, factory, use_multiprocessing=use_multiprocessing,
+                use_binary_protocol=config["binary"])
+        for board in boards
+    ]
+    for arduino in arduinos:
+        arduino.start()
+
+    measuring = threading.Event()
+    done = threading.Event()
+    counts = [0] * len(arduinos)
+    latencies = [[] for _ in arduinos]
+
+    def consume(index, arduino):
+        while not done.is_set():
+            packets = arduino.read_batch(timeout=0.1)
+            if not measuring.is_set():
+                continue
+            now_latencies = latencies[index]
+            for packet in packets:
+                now_latencies.append(latency(packet.data[1]))
+            counts[index] += len(packets)
+
+    consumers = [threading.Thread(target=consume, args=(index, arduino)) for index, arduino in enumerate(arduinos)]
+    for consumer in consumers:
+        consumer.start()
+
+    time.sleep(WARMUP)
+
+    device_pids = [arduino._device_process.pid for arduino in arduinos if use_multiprocessing]
+    start_bytes = sum(board.bytes_sent.value for board in boards)
+    start_cpu = time.process_time() + sum(process_cpu_time(pid) for pid in device_pids)
+    start_time = time.time()
+    measuring.set()
+
+    time.sleep(config["duration"])
+
+    measuring.clear()
+    duration = time.time() - start_time
+    cpu = time.process_time() + sum(process_cpu_time(pid) for pid in device_pids) - start_cpu
+    num_bytes = sum(board.bytes_sent.value for board in boards) - start_bytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 + sum(process_rss(pid) for pid in device_pids)
+    dropped = sum(board.packets_dropped.value for board in boards)
+
+    done.set()
+    for consumer in consumers:
+        consumer.join()
+    for arduino in arduinos:
+        arduino.stop()
+    time.sleep(0.2)
+    for board in boards:
+        board.stop()
+
+    all_latencies = [value for values in latencies for value in values]
+    results = dict(config)
+    results.update(
+        packets_per_second=sum(counts) / duration,
+        bytes_per_second=num_bytes / duration,
+        latency_p50=percentile(all_latencies, 0.5),
+        latency_p99=percentile(all_latencies, 0.99),
+        cpu_per_device=cpu / duration / len(arduinos),
+        discovery_time=factory.discovery_time,
+        rss_bytes=rss,
+        dropped_by_boards=dropped,
+    )
+    return results
+
+
+def run_sweep(args):
+    results = []
+    print("%-8s %7s %6s %6s %12s %14s %9s %9s %10s %10s %9s" % (
+        "mode", "devices", "rate", "binary", "packets/s", "bytes/s", "p50 ms", "p99 ms", "cpu/device",
+        "discovery", "rss MB"))
+    for mode in args.modes:
+        for devices in args.devices:
+            for rate in args.rates:
+                config = dict(mode=mode, devices=devices, rate=rate, binary=args.binary, duration=args.duration)
+                output = subprocess.check_output(
+                    [sys.executable, "-m", "benchmarks.throughput_benchmark", "--config", json.dumps(config)], cwd=ROOT_DIRECTORY
+                )
+                result = json.loads(output.decode().strip().split("\n")[-1])
+                results.append(result)
+
+                print("%-8s %7d %6d %6s %12.0f %14.0f %9.2f %9.2f %10.3f %9.2fs %9.1f" % (
+                    mode, devices, rate, args.binary, result["packets_per_second"], result["bytes_per_second"],
+                    (result["latency_p50"] or 0) * 1E3, (result["latency_p99"] or 0) * 1E3,
+                    result["cpu_per_device"], result["discovery_time"], result["rss_bytes"] / 1E6))
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(dict(time=time.time(), python=sys.version, results=results), file, indent=4)
+        print("results written to '%s'" % args.output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=["thread", "process"], choices=["thread", "process"])
+    parser.add_argument("--devices", nargs="+", type=int, default=[1, 4, 8])
+    parser.add_argument("--rates", nargs="+", type=int, default=[1000, 5000], help="packets per second per device")
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds to measure each configuration for")
+    parser.add_argument("--binary", action="store_true", help="use the binary protocol")
+    parser.add_argument("--output", default=None, help="JSON file to write the results to")
+    parser.add_argument("--config", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.config is not None:
+        print(json.dumps(run_one(json.loads(args.config))))
+    else:
+        run_sweep(args)
+
+
+if __name__ == '__main__':
+    main()
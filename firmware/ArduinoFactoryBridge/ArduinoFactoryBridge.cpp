@@ -30,9 +30,18 @@ const unsigned long DEFAULT_TIME = 1357041600; // Jan 1 2013
 ArduinoFactoryBridge::ArduinoFactoryBridge(String whoiam)
 {
     _command = "";
+    _callId = "";
     _whoiam = whoiam;
     _initPacket = "\n";
     _paused = true;
+    _binary = false;
+    _baud = BAUD_RATE;
+    _previousBaud = BAUD_RATE;
+    _baudChangeTime = 0;
+    _baudWatchdog = false;
+    _negotiating = false;
+    _frameLength = 0;
+    _frameOverflow = false;
     _arduinoPrevTime = 0;
     _overflowCount = 0;
     _sequence_num = 0;
@@ -47,19 +56,31 @@ void ArduinoFactoryBridge::setInitData(const char *formats, ...)
 
 void ArduinoFactoryBridge::begin() {
     ASYNCIO_ARDUINO_BRIDGE_SERIAL.begin(BAUD_RATE);
+    _baud = BAUD_RATE;
 }
 
 bool ArduinoFactoryBridge::available() {
+    checkBaudWatchdog();
     return ASYNCIO_ARDUINO_BRIDGE_SERIAL.available() > 0;
 }
 
+void ArduinoFactoryBridge::checkBaudWatchdog()
+{
+    // the host couldn't hear us at the new baud. Go back so it can try the next one
+    if (_baudWatchdog && millis() - _baudChangeTime > BAUD_WATCHDOG_TIME) {
+        _baudWatchdog = false;
+        changeBaud(_previousBaud);
+    }
+}
+
 int ArduinoFactoryBridge::read()
 {
-    if (_paused) {
+    if (_paused && !_negotiating) {
         delay(100);  // minimize activity while paused
     }
 
     _command = ASYNCIO_ARDUINO_BRIDGE_SERIAL.readStringUntil('\n');
+    _callId = "";
     #ifdef DEBUG
     ASYNCIO_ARDUINO_BRIDGE_SERIAL.println(_command);
     #endif
@@ -70,7 +91,40 @@ int ArduinoFactoryBridge::read()
         ASYNCIO_ARDUINO_BRIDGE_SERIAL.println("Non-user command found");
         #endif
         unsigned long new_time;
+        unsigned long new_baud;
+        unsigned int time_start;
+        int separator;
         switch (_command.charAt(1)) {
+            case '#':  // user command that wants an acknowledgement: "~#<id>:<command>"
+                separator = _command.indexOf(':');
+                if (separator < 0) return -1;
+                _callId = _command.substring(2, separator);
+                _command = _command.substring(separator + 1);
+                if (_paused) return -1;  // user commands are ignored while paused, so don't acknowledge it
+                writeAck();
+                return 0;
+            case '=':  // link probe: "~=<payload>" is echoed back as is
+                _negotiating = true;
+                ASYNCIO_ARDUINO_BRIDGE_SERIAL.print(_command);
+                ASYNCIO_ARDUINO_BRIDGE_SERIAL.print(PACKET_END);
+                return 7;
+            case '%':  // baud change: "~%<baud>" switches until "~%!" commits it
+                _negotiating = true;
+                if (_command.charAt(2) == '!') {
+                    _baudWatchdog = false;
+                    return 8;
+                }
+                new_baud = _command.substring(2).toInt();
+                if (new_baud == 0) return -1;
+                ASYNCIO_ARDUINO_BRIDGE_SERIAL.print("~baud:");
+                ASYNCIO_ARDUINO_BRIDGE_SERIAL.print(new_baud);
+                ASYNCIO_ARDUINO_BRIDGE_SERIAL.print(PACKET_END);
+                ASYNCIO_ARDUINO_BRIDGE_SERIAL.flush();
+                _previousBaud = _baud;
+                changeBaud(new_baud);
+                _baudChangeTime = millis();
+                _baudWatchdog = true;
+                return 8;
             case '>':  // start command
                 #ifdef DEBUG
                 ASYNCIO_ARDUINO_BRIDGE_SERIAL.println("start command received");
@@ -78,8 +132,15 @@ int ArduinoFactoryBridge::read()
                 ASYNCIO_ARDUINO_BRIDGE_SERIAL.println(!_paused);
                 #endif
 
-                if (_command.length() > 2) {
-                    new_time = _command.substring(2).toInt();
+                // "~>b<time>" asks for binary frames. Plain "~><time>" is text
+                _binary = _command.charAt(2) == BINARY_START_FLAG;
+                time_start = _binary ? 3 : 2;
+                if (_binary) {
+                    ASYNCIO_ARDUINO_BRIDGE_SERIAL.write((uint8_t)0);  // end any partial text so the first frame isn't lost
+                }
+
+                if (_command.length() > time_start) {
+                    new_time = _command.substring(time_start).toInt();
                     if (new_time >= DEFAULT_TIME) { // check the integer is a valid time (greater than Jan 1 2013)
                         setTime(new_time); // Sync Arduino clock to the time received on the serial port
                     #ifdef DEBUG
@@ -90,6 +151,7 @@ int ArduinoFactoryBridge::read()
                     #endif
                     }
                 }
+                _negotiating = false;
                 if (unpause()) return 1;
                 else return -1;
             case '<':  // stop command
@@ -128,7 +190,7 @@ int ArduinoFactoryBridge::read()
     return -1;
 }
 
-void ArduinoFactoryBridge::changeBaud(int newBaud)
+void ArduinoFactoryBridge::changeBaud(unsigned long newBaud)
 {
     #ifdef DEBUG
     ASYNCIO_ARDUINO_BRIDGE_SERIAL.println("changing baud");
@@ -137,6 +199,7 @@ void ArduinoFactoryBridge::changeBaud(int newBaud)
     ASYNCIO_ARDUINO_BRIDGE_SERIAL.end();
     delay(50);
     ASYNCIO_ARDUINO_BRIDGE_SERIAL.begin(newBaud);
+    _baud = newBaud;
 }
 
 
@@ -157,6 +220,7 @@ void ArduinoFactoryBridge::writeInit()
 void ArduinoFactoryBridge::writeHello()
 {
     ASYNCIO_ARDUINO_BRIDGE_SERIAL.print("~hello!");
+    ASYNCIO_ARDUINO_BRIDGE_SERIAL.print(BRIDGE_CAPABILITIES);
     ASYNCIO_ARDUINO_BRIDGE_SERIAL.print(PACKET_END);
 }
 
@@ -184,12 +248,26 @@ void ArduinoFactoryBridge::printUInt64(uint64_t value)
     ASYNCIO_ARDUINO_BRIDGE_SERIAL.print(part2);
 }
 
-void ArduinoFactoryBridge::writeTime()
+uint32_t ArduinoFactoryBridge::updateTime()
 {
     uint32_t current_time = micros();
     if (current_time < _arduinoPrevTime) {
         _overflowCount++;
     }
+    _arduinoPrevTime = current_time;
+    return current_time;
+}
+
+void ArduinoFactoryBridge::writeTime()
+{
+    if (_binary) {
+        beginFrame(BINARY_FRAME_TIME);
+        appendTime();
+        endFrame();
+        return;
+    }
+
+    uint32_t current_time = updateTime();
     ASYNCIO_ARDUINO_BRIDGE_SERIAL.print("~ct:");
 
     ASYNCIO_ARDUINO_BRIDGE_SERIAL.print(_overflowCount);
@@ -199,12 +277,19 @@ void ArduinoFactoryBridge::writeTime()
     printUInt64(_sequence_num);
     ASYNCIO_ARDUINO_BRIDGE_SERIAL.print(PACKET_END);
 
-    _arduinoPrevTime = current_time;
     _sequence_num++;
 }
 
 void ArduinoFactoryBridge::write(String name, const char *formats, ...)
 {
+    if (_binary) {
+        va_list binary_args;
+        va_start(binary_args, formats);
+        writeBinary(name, formats, binary_args);
+        va_end(binary_args);
+        return;
+    }
+
     writeTime();
 
     EXTRACT_DATA_FROM_ARGS();
@@ -216,6 +301,31 @@ String ArduinoFactoryBridge::getCommand() {
     return _command;
 }
 
+void ArduinoFactoryBridge::writeAck()
+{
+    writeProtocolPacket("~ack:" + _callId);
+}
+
+void ArduinoFactoryBridge::reply(String value)
+{
+    // only commands sent with Arduino.call have someone waiting for a reply
+    if (_callId.length() == 0) {
+        return;
+    }
+    writeProtocolPacket("~re:" + _callId + ":" + value);
+}
+
+void ArduinoFactoryBridge::writeProtocolPacket(String packet)
+{
+    if (_binary) {
+        writeTextFrame(packet.c_str());
+    }
+    else {
+        ASYNCIO_ARDUINO_BRIDGE_SERIAL.print(packet);
+        ASYNCIO_ARDUINO_BRIDGE_SERIAL.print(PACKET_END);
+    }
+}
+
 bool ArduinoFactoryBridge::isPaused() {
     return _paused;
 }
@@ -231,14 +341,161 @@ bool ArduinoFactoryBridge::unpause()
     }
 }
 
+bool ArduinoFactoryBridge::isBinary() {
+    return _binary;
+}
+
 bool ArduinoFactoryBridge::pause()
 {
+    bool wasRunning = !_paused;
     if (!_paused) {
-        ASYNCIO_ARDUINO_BRIDGE_SERIAL.print("\n~stopping\n");
+        if (_binary) {
+            writeTextFrame("~stopping");
+            _binary = false;  // back to text until the next start command
+        }
+        else {
+            ASYNCIO_ARDUINO_BRIDGE_SERIAL.print("\n~stopping\n");
+        }
         _paused = true;
-        return true;
     }
-    else {
-        return false;
+
+    // the next run finds the board at the default baud, even if it stopped before starting
+    _negotiating = false;
+    _baudWatchdog = false;
+    if (_baud != BAUD_RATE) {
+        ASYNCIO_ARDUINO_BRIDGE_SERIAL.flush();
+        changeBaud(BAUD_RATE);
+    }
+    return wasRunning;
+}
+
+// ----- binary protocol -----
+// Frames are: frame type, body, CRC-16/CCITT-FALSE of type and body.
+// They're COBS encoded so the only zero byte is the one ending the frame.
+// Values are copied in native byte order. AVR and ARM boards are little endian.
+
+void ArduinoFactoryBridge::writeBinary(String name, const char *formats, va_list args)
+{
+    beginFrame(BINARY_FRAME_DATA);
+    appendTime();
+
+    appendByte(name.length());
+    appendBytes(name.c_str(), name.length());
+    size_t formats_length = strlen(formats);
+    appendByte(formats_length);
+    appendBytes(formats, formats_length);
+
+    while (*formats != '\0') {
+        if (*formats == 'd') {
+            int32_t i = va_arg(args, int);
+            appendBytes(&i, sizeof(i));
+        }
+        else if (*formats == 's') {
+            char *s = va_arg(args, char*);
+            size_t length = strlen(s);
+            if (length > 255) length = 255;
+            appendByte(length);
+            appendBytes(s, length);
+        }
+        else if (*formats == 'f') {
+            float f = va_arg(args, double);
+            appendBytes(&f, sizeof(f));
+        }
+        ++formats;
+    }
+    endFrame();
+}
+
+void ArduinoFactoryBridge::writeTextFrame(const char *text)
+{
+    beginFrame(BINARY_FRAME_TEXT);
+    appendBytes(text, strlen(text));
+    endFrame();
+}
+
+void ArduinoFactoryBridge::beginFrame(uint8_t frameType)
+{
+    _frameLength = 0;
+    _frameOverflow = false;
+    appendByte(frameType);
+}
+
+void ArduinoFactoryBridge::appendTime()
+{
+    uint32_t current_time = updateTime();
+    appendBytes(&_overflowCount, sizeof(_overflowCount));
+    appendBytes(&current_time, sizeof(current_time));
+    appendBytes(&_sequence_num, sizeof(_sequence_num));
+    _sequence_num++;
+}
+
+void ArduinoFactoryBridge::appendByte(uint8_t value)
+{
+    appendBytes(&value, 1);
+}
+
+void ArduinoFactoryBridge::appendBytes(const void *data, size_t length)
+{
+    // leave room for the CRC
+    if (_frameLength + length + 2 > BINARY_FRAME_SIZE) {
+        _frameOverflow = true;
+        return;
+    }
+    memcpy(_frameBuffer + _frameLength, data, length);
+    _frameLength += length;
+}
+
+void ArduinoFactoryBridge::endFrame()
+{
+    if (_frameOverflow) {
+        return;  // drop packets that are too big rather than send a truncated frame
+    }
+    uint16_t crc = crc16(_frameBuffer, _frameLength);
+    _frameBuffer[_frameLength++] = crc & 0xff;
+    _frameBuffer[_frameLength++] = crc >> 8;
+
+    size_t encoded_length = cobsEncode(_frameBuffer, _frameLength, _encodeBuffer);
+    _encodeBuffer[encoded_length++] = 0;
+    ASYNCIO_ARDUINO_BRIDGE_SERIAL.write(_encodeBuffer, encoded_length);
+}
+
+uint16_t ArduinoFactoryBridge::crc16(const uint8_t *data, size_t length)
+{
+    uint16_t crc = 0xffff;
+    for (size_t i = 0; i < length; i++) {
+        crc ^= (uint16_t)data[i] << 8;
+        for (uint8_t bit = 0; bit < 8; bit++) {
+            if (crc & 0x8000) crc = (crc << 1) ^ 0x1021;
+            else crc <<= 1;
+        }
+    }
+    return crc;
+}
+
+size_t ArduinoFactoryBridge::cobsEncode(const uint8_t *input, size_t length, uint8_t *output)
+{
+    size_t read_index = 0;
+    size_t write_index = 1;
+    size_t code_index = 0;
+    uint8_t code = 1;
+
+    while (read_index < length) {
+        if (input[read_index] == 0) {
+            output[code_index] = code;
+            code = 1;
+            code_index = write_index++;
+            read_index++;
+        }
+        else {
+            output[write_index++] = input[read_index++];
+            code++;
+            if (code == 0xff) {
+                output[code_index] = code;
+                code = 1;
+                code_index = write_index++;
+            }
+        }
     }
+    output[code_index] = code;
+    return write_index;
 }
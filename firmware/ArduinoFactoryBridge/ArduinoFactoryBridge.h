@@ -2,6 +2,7 @@
 #define _ARDUINO_FACTORY_BRIDGE_H_
 
 
+#include <stdarg.h>
 #include <Arduino.h>
 #include <TimeLib.h>
 
@@ -15,9 +16,10 @@ public:
     bool available();
     int read();
     String getCommand();
+    void reply(String value);
     bool isPaused();
 
-    void changeBaud(int newBaud);
+    void changeBaud(unsigned long newBaud);
 
     bool unpause();
     bool pause();
@@ -28,18 +30,47 @@ public:
 
     void writeTime();
     void write(String name, const char *formats, ...);
+
+    bool isBinary();
 private:
     String _command;
+    String _callId;  // id of the current command if the host called it with Arduino.call. Empty otherwise
     String _whoiam;
     String _initPacket;
     bool _paused;
+    bool _binary;
+
+    unsigned long _baud;
+    unsigned long _previousBaud;  // baud to go back to if a baud change isn't committed
+    unsigned long _baudChangeTime;
+    bool _baudWatchdog;  // true while a baud change is waiting to be committed
+    bool _negotiating;  // true while the host is probing the link. Skips the paused delay
 
     void writeWhoiam();
     void writeInit();
+    void writeAck();
+    void checkBaudWatchdog();
+    void writeProtocolPacket(String packet);
 
     void printInt64(int64_t value);
     void printUInt64(uint64_t value);
 
+    uint32_t updateTime();
+    void writeBinary(String name, const char *formats, va_list args);
+    void writeTextFrame(const char *text);
+    void beginFrame(uint8_t frameType);
+    void appendTime();
+    void appendByte(uint8_t value);
+    void appendBytes(const void *data, size_t length);
+    void endFrame();
+    uint16_t crc16(const uint8_t *data, size_t length);
+    size_t cobsEncode(const uint8_t *input, size_t length, uint8_t *output);
+
+    uint8_t _frameBuffer[BINARY_FRAME_SIZE];
+    uint8_t _encodeBuffer[BINARY_FRAME_SIZE + BINARY_FRAME_SIZE / 254 + 2];
+    size_t _frameLength;
+    bool _frameOverflow;
+
     uint32_t _arduinoPrevTime;
     uint32_t _overflowCount;
     uint64_t _sequence_num;
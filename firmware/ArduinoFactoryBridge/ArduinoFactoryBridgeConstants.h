@@ -9,4 +9,16 @@
 #define ASYNCIO_ARDUINO_BRIDGE_SERIAL SerialUSB
 // #define ARDUINO_RESETS_ON_CONNECT
 
+// binary protocol
+// appended to the hello packet. 'b' means binary frames are supported, 'a' means baud negotiation is
+#define BRIDGE_CAPABILITIES "ba"
+#define BINARY_START_FLAG 'b'  // start command flag asking for binary frames ("~>b<time>")
+#define BINARY_FRAME_SIZE 128  // largest decoded frame. Packets that don't fit aren't sent
+#define BINARY_FRAME_TIME 1
+#define BINARY_FRAME_DATA 2
+#define BINARY_FRAME_TEXT 3
+
+// baud negotiation
+#define BAUD_WATCHDOG_TIME 1000  // ms. Go back to the previous baud if the host doesn't commit a new one in time
+
 #endif  // _ARDUINO_FACTORY_BRIDGE_CONSTANTS_H_
@@ -43,6 +43,9 @@ void loop()
             else if (command.equals("s2")) {
                 test_string2 = "";
             }
+            else if (command.equals("counter?")) {
+                bridge.reply(String(counter));  // answers arduino.call("counter?", wait_for_reply=True)
+            }
         }
     }
 }
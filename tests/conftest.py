@@ -0,0 +1,59 @@
+import logging
+
+import pytest
+
+from arduino_factory import DeviceFactory
+from arduino_factory.emulator import VirtualArduino
+
+
+@pytest.fixture(autouse=True)
+def fresh_device_factory(monkeypatch):
+    """DeviceFactory only allows one init per process. Each test gets its own"""
+    monkeypatch.setattr(DeviceFactory, "is_initialized", False)
+
+
+class Bench:
+    def __init__(self):
+        """VirtualArduinos and a DeviceFactory that only looks at their ports"""
+        self.boards = []
+        self.factory = None
+        self.restart()
+
+    def restart(self, **kwargs):
+        """Stop the DeviceFactory and make a new one, like the program restarting. kwargs are passed to it"""
+        if self.factory is not None:
+            self._stop_factory()
+        DeviceFactory.is_initialized = False
+        self.factory = DeviceFactory(list_devices_fn=self.addresses, log_level=logging.WARNING, **kwargs)
+
+    def addresses(self):
+        return [board.address for board in self.boards]
+
+    def plug(self, whoiam, **kwargs):
+        """Start a VirtualArduino. kwargs are passed to it"""
+        board = VirtualArduino(whoiam, **kwargs)
+        self.boards.append(board)
+        return board
+
+    def unplug(self, board):
+        self.boards.remove(board)
+        board.stop()
+
+    def _stop_factory(self):
+        for arduino in self.factory.arduinos:
+            if not arduino.is_async:
+                arduino.stop()
+        self.factory.stop_all()
+
+    def close(self):
+        self._stop_factory()
+        for board in self.boards:
+            board.stop()
+
+
+@pytest.fixture
+def bench():
+    """A Bench that stops its Arduinos, factory and boards after the test"""
+    bench = Bench()
+    yield bench
+    bench.close()
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+
+from arduino_factory.async_arduino import AsyncArduino
+from arduino_factory.emulator import EmulatedPacket
+
+
+def reply(command):
+    if command.startswith("echo "):
+        return command[len("echo "):]
+    return None
+
+
+async def wait_until(condition, timeout=1.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition() and asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(0.01)
+    return condition()
+
+
+def run_with_board(bench, test):
+    board = bench.plug("async", packets=[EmulatedPacket("counter", "df", 200.0)], reply_fn=reply)
+    arduino = AsyncArduino("async", bench.factory)
+    bench.factory.init()
+    asyncio.run(test(arduino, bench.factory, board))
+
+
+def test_read_write_and_call(bench):
+    async def test(arduino, factory, board):
+        first_packet = await arduino.start()
+        assert first_packet.data == ["hi!"]
+        assert arduino.is_started()
+
+        packets = await arduino.read_batch(timeout=1)
+        assert len(packets) > 0 and all(packet.name == "counter" for packet in packets)
+        counts = [packet.data[0] for packet in packets]
+        assert counts == list(range(counts[0], counts[0] + len(counts)))
+
+        await arduino.write("hello")
+        assert board.commands.get(timeout=1) == "hello"
+        assert await arduino.call("echo back", timeout=1, wait_for_reply=True) == "back"
+
+        await arduino.stop()
+        # iteration ends once what was read before stopping is used up
+        async for packet in arduino:
+            assert packet.name == "counter"
+        assert arduino.empty()
+        # the stop command goes out on the writer thread
+        assert await wait_until(lambda: not board.is_running())
+
+    run_with_board(bench, test)
+
+
+def test_stop_all_stops_async_arduinos(bench):
+    async def test(arduino, factory, board):
+        await arduino.start()
+        assert len(await arduino.read_batch(timeout=1)) > 0
+
+        # from another thread, like a signal handler or a supervisor would
+        stopper = threading.Thread(target=factory.stop_all)
+        stopper.start()
+        stopper.join()
+        await asyncio.sleep(0.2)
+
+        await arduino.read_batch(timeout=0)
+        assert arduino.empty()
+        assert await arduino.read_batch(timeout=0.2) == []
+        assert await wait_until(lambda: not board.is_running())
+
+    run_with_board(bench, test)
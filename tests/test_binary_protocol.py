@@ -0,0 +1,142 @@
+import struct
+
+import pytest
+
+from arduino_factory import Arduino, DeviceFactory
+from arduino_factory.binary_protocol import BinaryDecoder, FRAME_DATA, FRAME_TIME, FRAME_TEXT, FRAME_END, TIME_STRUCT, \
+    CRC_STRUCT, crc16, cobs_encode, cobs_decode, encode_data_frame, encode_time_frame, encode_text_frame
+
+# (name, formats, data) sent by the board. Floats are exact in float32 so both protocols agree on them
+PACKETS = [
+    ("encoders", "dd", [1024, -2048]),
+    ("imu", "fff", [0.5, -9.75, 0.0]),
+    ("status", "sdf", ["ok", 5, 0.25]),
+    ("limits", "dd", [-2 ** 31, 2 ** 31 - 1]),
+    ("empty_string", "sd", ["", 0]),
+]
+
+
+@pytest.fixture(scope="module")
+def arduino():
+    return Arduino("binary_test", DeviceFactory(), use_multiprocessing=False)
+
+
+def text_line(name, formats, data):
+    """The line the firmware sends for a packet in text mode, without the packet end"""
+    return "%s\t%s\t%s\t" % (name, formats, "\t".join(str(datum) for datum in data))
+
+
+def binary_stream():
+    stream = b""
+    for index, (name, formats, data) in enumerate(PACKETS):
+        stream += encode_data_frame(0, 1000 * index, index, name, formats, data)
+    return stream
+
+
+def decoded_packets(frames):
+    return [(frame[3], frame[4]) for frame in frames if frame[0] == FRAME_DATA]
+
+
+def text_packets(arduino):
+    return [arduino._parse_data(text_line(*packet)) for packet in PACKETS]
+
+
+def test_crc_matches_ccitt_false():
+    assert crc16(b"123456789") == 0x29b1
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"\x00",
+    b"\x00\x00\x00",
+    b"\x11\x00\x22",
+    bytes(range(1, 255)),
+    bytes(range(1, 256)) * 3,
+    bytes(600),
+])
+def test_cobs_round_trip(data):
+    encoded = cobs_encode(data)
+    assert FRAME_END not in encoded
+    assert cobs_decode(encoded) == data
+
+
+def test_decoded_stream_matches_text_parser(arduino):
+    decoder = BinaryDecoder()
+    frames = decoder.feed(binary_stream())
+    assert decoded_packets(frames) == text_packets(arduino)
+    assert [frame[1] for frame in frames] == list(range(len(PACKETS)))
+    assert [frame[2] for frame in frames] == [index / 1000 for index in range(len(PACKETS))]
+    assert decoder.dropped_frames == 0
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 64])
+def test_split_stream(arduino, chunk_size):
+    stream = binary_stream()
+    decoder = BinaryDecoder()
+    frames = []
+    for index in range(0, len(stream), chunk_size):
+        frames.extend(decoder.feed(stream[index: index + chunk_size]))
+    assert decoded_packets(frames) == text_packets(arduino)
+    assert len(decoder.buffer) == 0
+
+
+def test_corrupt_frame_is_dropped(arduino):
+    frames = [encode_data_frame(0, 0, index, *packet) for index, packet in enumerate(PACKETS)]
+    corrupted = bytearray(frames[1])
+    corrupted[len(corrupted) // 2] ^= 0x40
+    decoder = BinaryDecoder()
+    decoded = decoder.feed(frames[0] + bytes(corrupted) + b"".join(frames[2:]))
+    assert decoded_packets(decoded) == [text_packets(arduino)[0]] + text_packets(arduino)[2:]
+    assert decoder.dropped_frames == 1
+    assert decoder.dropped_bytes == len(corrupted) - 1
+
+
+def test_truncated_frame_resyncs(arduino):
+    frames = [encode_data_frame(0, 0, index, *packet) for index, packet in enumerate(PACKETS)]
+    # connected partway through a frame, then a frame cut short by a reset
+    stream = frames[0][5:] + frames[1][:-4] + FRAME_END + b"".join(frames[2:])
+    decoder = BinaryDecoder()
+    assert decoded_packets(decoder.feed(stream)) == text_packets(arduino)[2:]
+    assert decoder.dropped_frames == 2
+
+
+def test_zero_filled_gaps_are_ignored(arduino):
+    frames = [encode_data_frame(0, 0, index, *packet) for index, packet in enumerate(PACKETS)]
+    stream = bytes(16) + bytes(16).join(frames) + bytes(16)
+    decoder = BinaryDecoder()
+    assert decoded_packets(decoder.feed(stream)) == text_packets(arduino)
+    assert decoder.dropped_frames == 0
+
+
+def test_runaway_frame_is_discarded(arduino):
+    decoder = BinaryDecoder(max_frame_size=64)
+    assert decoder.feed(b"\x01" * 100) == []
+    assert decoder.dropped_frames == 1
+    assert decoder.dropped_bytes == 100
+    assert decoded_packets(decoder.feed(FRAME_END + binary_stream())) == text_packets(arduino)
+
+
+def test_time_and_text_frames():
+    decoder = BinaryDecoder()
+    frames = decoder.feed(encode_time_frame(1, 500000, 42) + encode_text_frame("~stopping"))
+    assert frames == [(FRAME_TIME, 42, ((1 << 32) | 500000) / 1E6), (FRAME_TEXT, "~stopping")]
+
+
+def test_int32_and_float32_packing():
+    decoder = BinaryDecoder()
+    frames = decoder.feed(encode_data_frame(0, 0, 0, "values", "df", [-123456, 1 / 3]))
+    assert frames[0][4][0] == -123456
+    assert frames[0][4][1] == struct.unpack("<f", struct.pack("<f", 1 / 3))[0]
+
+    with pytest.raises(struct.error):
+        encode_data_frame(0, 0, 0, "too_big", "d", [2 ** 31])
+
+
+def test_frame_with_wrong_length_is_dropped():
+    # says it has three ints but only carries two. The CRC is valid, so only the length check catches it
+    body = bytes([FRAME_DATA]) + TIME_STRUCT.pack(0, 0, 0) + b"\x08encoders\x03ddd" + struct.pack("<ii", 1, 2)
+    forged = cobs_encode(body + CRC_STRUCT.pack(crc16(body))) + FRAME_END
+
+    decoder = BinaryDecoder()
+    assert decoder.feed(forged) == []
+    assert decoder.dropped_frames == 1
@@ -0,0 +1,114 @@
+import time
+import concurrent.futures
+
+import pytest
+import serial
+
+import arduino_factory.arduino
+from arduino_factory import Arduino, DeviceFactory
+from arduino_factory.default_params import ACK_RESPONSE_HEADER, REPLY_RESPONSE_HEADER, CALL_PACKET_ASK, \
+    START_PACKET_ASK, DEFAULT_RATE
+
+
+def reply(command):
+    if command.startswith("echo "):
+        return command[len("echo "):]
+    return None
+
+
+@pytest.fixture(params=[True, False], ids=["process", "thread"])
+def arduino(request, bench):
+    board = bench.plug("caller", reply_fn=reply)
+    arduino = Arduino("caller", bench.factory, use_multiprocessing=request.param)
+    bench.factory.init()
+    arduino.start()
+    arduino.board = board
+    return arduino
+
+
+def test_ack(arduino):
+    assert arduino.call("set 100").result(timeout=2) is None
+    assert arduino.board.commands.get(timeout=1) == "set 100"
+
+    stats = arduino.stats()
+    assert stats["calls_acked"] == 1
+    assert 0 < stats["call_latency_mean"] < 1
+    assert sum(stats["call_latency_histogram"]) == 1
+
+
+def test_reply(arduino):
+    future = arduino.call("echo hello", wait_for_reply=True)
+    assert future.result(timeout=2) == "hello"
+
+    # answers come back for the right calls when several are in flight
+    futures = [arduino.call("echo %d" % index, wait_for_reply=True) for index in range(20)]
+    assert [future.result(timeout=2) for future in futures] == [str(index) for index in range(20)]
+
+
+def test_timeout_and_late_ack(arduino):
+    # the pause holds the call back past its timeout, so the ack comes after the future gave up
+    arduino.write_pause(0.5)
+    future = arduino.call("slow", timeout=0.1)
+    with pytest.raises(TimeoutError):
+        future.result(timeout=2)
+    assert arduino.stats()["calls_timed_out"] == 1
+
+    deadline = time.time() + 2
+    while arduino.stats()["calls_acked"] == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert arduino.stats()["calls_acked"] == 1
+
+    # the late ack didn't disturb anything
+    assert arduino.call("fast").result(timeout=2) is None
+    assert arduino.stats()["calls_timed_out"] == 1
+
+
+def test_stop_fails_pending_calls(arduino):
+    arduino.write_pause(5)
+    future = arduino.call("never sent", timeout=10)
+    arduino.stop()
+    with pytest.raises(RuntimeError):
+        future.result(timeout=2)
+
+
+def test_pending_table_overflow(monkeypatch):
+    monkeypatch.setattr(arduino_factory.arduino, "CALL_MAX_PENDING", 4)
+    arduino = Arduino("overflow", DeviceFactory(), use_multiprocessing=False)
+
+    # play the device loop: send 6 calls without acks, then the board acks them all
+    futures = [arduino.call("command %d" % index) for index in range(6)]
+    for call_id in range(6):
+        arduino._track_call(call_id)
+    assert list(arduino._call_send_times) == [2, 3, 4, 5]
+
+    for call_id in range(6):
+        assert arduino._check_for_call_answer(time.time(), "%s%d" % (ACK_RESPONSE_HEADER, call_id))
+
+    # the calls dropped from the table still resolve. Only the tracked ones have latencies
+    done, not_done = concurrent.futures.wait(futures, timeout=2)
+    assert len(not_done) == 0
+    assert all(future.result() is None for future in futures)
+    assert arduino.stats()["calls_acked"] == 4
+    arduino.stop()
+
+
+def test_calls_ignored_while_stopped(bench):
+    board = bench.plug("stopped", reply_fn=reply)
+    device = serial.Serial(board.address, DEFAULT_RATE, timeout=0.3)
+    try:
+        # the firmware doesn't acknowledge or run user commands until it's started
+        device.write(("%s1:echo early\n" % CALL_PACKET_ASK).encode())
+        assert device.read(64) == b""
+        assert board.commands.empty()
+
+        device.write(("%s%d\n" % (START_PACKET_ASK, time.time())).encode())
+        device.write(("%s2:echo late\n" % CALL_PACKET_ASK).encode())
+        lines = []
+        deadline = time.time() + 2
+        while "%s2:late" % REPLY_RESPONSE_HEADER not in lines and time.time() < deadline:
+            lines.append(device.readline().decode().strip())
+        assert "%s2" % ACK_RESPONSE_HEADER in lines
+        assert "%s2:late" % REPLY_RESPONSE_HEADER in lines
+        assert board.commands.get(timeout=1) == "echo late"
+    finally:
+        device.close()
@@ -0,0 +1,67 @@
+import time
+import random
+
+from arduino_factory import Arduino
+from arduino_factory.clock_sync import ClockSync
+
+HOST_START = 1.7e9
+DRIFT = 50e-6  # the board's crystal runs 50 ppm slow
+
+
+def true_host_time(arduino_time):
+    return HOST_START + (1 + DRIFT) * arduino_time
+
+
+def feed(clock_sync, start, duration, rng, stalls=()):
+    """Board times every 10 ms arriving after a 1 ms minimum USB delay with jitter on top"""
+    for step in range(int(duration * 100)):
+        arduino_time = start + step / 100
+        delay = 0.001 + rng.expovariate(2000.0)
+        if any(stall <= arduino_time < stall + 0.25 for stall in stalls):
+            delay += 0.03
+        clock_sync.update(arduino_time, true_host_time(arduino_time) + delay)
+
+
+def test_drift_is_estimated():
+    clock_sync = ClockSync()
+    rng = random.Random(1)
+    feed(clock_sync, 0.0, 3.0, rng)
+    # too short to tell drift from jitter yet
+    assert clock_sync.is_ready()
+    assert clock_sync.drift == 0.0
+
+    feed(clock_sync, 3.0, 57.0, rng, stalls=(20.0, 40.0))
+    assert abs(clock_sync.drift - DRIFT) < 1e-6
+    # the fastest packets are 1 ms late, so that's where the line ends up
+    for arduino_time in (30.0, 60.0, 120.0):
+        assert abs(clock_sync.host_time(arduino_time) - true_host_time(arduino_time) - 0.001) < 0.001
+    # stalled intervals don't pull the line up
+    assert clock_sync.rejected >= 2
+    assert clock_sync.jitter < 0.01
+
+
+def test_board_reset_starts_over():
+    clock_sync = ClockSync()
+    rng = random.Random(2)
+    feed(clock_sync, 100.0, 10.0, rng)
+    assert clock_sync.resets == 0
+
+    # the board rebooted, so its clock starts from zero 110 seconds later
+    clock_sync.update(0.0, true_host_time(110.0) + 0.001)
+    assert clock_sync.resets == 1
+    assert clock_sync.drift == 0.0
+    assert abs(clock_sync.offset - true_host_time(110.0)) < 0.01
+
+
+def test_packets_get_host_times(bench):
+    bench.plug("clock")
+    arduino = Arduino("clock", bench.factory, use_multiprocessing=False)
+    bench.factory.init()
+    arduino.start()
+    time.sleep(0.5)
+
+    packets = arduino.read_batch(timeout=1)
+    assert arduino.stats()["clock_samples"] > 0
+    for packet in packets[-10:]:
+        assert abs(packet.host_time - packet.receive_time) < 0.05
+        assert abs(arduino.host_time(packet.timestamp) - packet.host_time) < 0.05
@@ -0,0 +1,42 @@
+import time
+
+import pytest
+
+from arduino_factory import Arduino
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.mark.parametrize("use_multiprocessing", [True, False], ids=["process", "thread"])
+def test_hub_serves_every_board(bench, use_multiprocessing):
+    bench.restart(hub_pool_size=2)
+    boards = [bench.plug("hub%d" % index) for index in range(3)]
+    arduinos = [Arduino(board.whoiam, bench.factory, use_multiprocessing=use_multiprocessing, use_hub=True)
+                for board in boards]
+    bench.factory.init()
+    for arduino in arduinos:
+        assert len(bench.factory.hubs) == 0
+        arduino.start()
+    # started once the last hub Arduino started
+    assert len(bench.factory.hubs) == 2
+
+    for arduino, board in zip(arduinos, boards):
+        packets = arduino.read_batch(timeout=2)
+        assert len(packets) > 0 and all(packet.name == "counter" for packet in packets)
+        arduino.write("hello %s" % arduino.whoiam)
+        assert board.commands.get(timeout=1) == "hello %s" % arduino.whoiam
+
+    # stopping one board leaves the others in its hub running
+    arduinos[0].stop()
+    assert wait_until(lambda: not boards[0].is_running())
+    for arduino in arduinos[1:]:
+        arduino.read_batch(timeout=0)
+        counts = [packet.data[0] for packet in arduino.read_batch(timeout=1)]
+        assert len(counts) > 0
+        assert counts == list(range(counts[0], counts[0] + len(counts)))
+    assert all(board.is_running() for board in boards[1:])
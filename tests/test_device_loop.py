@@ -0,0 +1,40 @@
+import time
+
+import pytest
+
+from arduino_factory import Arduino
+from arduino_factory.emulator import EmulatedPacket
+
+
+@pytest.fixture(params=[True, False], ids=["selector", "polling"])
+def arduino(request, bench):
+    board = bench.plug("idle", packets=[EmulatedPacket("slow", "d", 20.0)])
+    arduino = Arduino("idle", bench.factory, use_multiprocessing=False, use_selector=request.param)
+    bench.factory.init()
+    arduino.start()
+    arduino.board = board
+    return arduino
+
+
+def test_idle_loop_wakeups(arduino):
+    arduino.stats()
+    time.sleep(1.0)
+    iterations = arduino.stats()["loop_iterations"]
+    if arduino._write_notifier is not None:
+        # woken up by packets and the selector timeout, not a 1 kHz timer
+        assert iterations < 200
+    else:
+        assert iterations > 300
+    assert len(arduino.read_batch(timeout=1)) > 0
+
+
+def test_commands_wake_the_device_loop(arduino):
+    latencies = []
+    for index in range(5):
+        time.sleep(0.05)
+        start = time.time()
+        arduino.write("command %d" % index)
+        assert arduino.board.commands.get(timeout=1) == "command %d" % index
+        latencies.append(time.time() - start)
+    # well under SELECTOR_TIMEOUT, so the write queue woke the loop up
+    assert min(latencies) < 0.05
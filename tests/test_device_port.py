@@ -0,0 +1,45 @@
+import logging
+
+import pytest
+
+from arduino_factory.device_port import DevicePort
+
+
+@pytest.fixture
+def port():
+    return DevicePort("canned", logging.WARNING, max_packet_length=16)
+
+
+def feed(port, chunks):
+    packets = []
+    for chunk in chunks:
+        packets.extend(port.split_packets(chunk))
+    return packets
+
+
+def test_packets_split_across_chunks(port):
+    stream = b"a\t1\nbb\t2\n\nccc\t3\n\xc2\xb5s\t4\n"
+    for chunk_size in (1, 2, 3, 7, len(stream)):
+        chunks = [stream[index:index + chunk_size] for index in range(0, len(stream), chunk_size)]
+        assert feed(port, chunks) == ["a\t1", "bb\t2", "ccc\t3", "µs\t4"]
+        assert len(port.buffer) == 0
+    assert port.dropped_bytes == 0
+
+
+def test_partial_packet_waits_for_its_end(port):
+    assert port.split_packets(b"a\t1\nhalf") == ["a\t1"]
+    assert port.buffer == bytearray(b"half")
+    assert port.split_packets(b"\t2\n") == ["half\t2"]
+
+
+def test_runaway_packet_resyncs(port):
+    # no packet end past max_packet_length. Everything up to the next end is thrown away
+    noise = b"x" * 20
+    assert feed(port, [b"a\t1\n", noise, b"yy", b"y\nb\t2\n"]) == ["a\t1", "b\t2"]
+    assert port.dropped_bytes == len(noise) + len(b"yyy\n")
+
+
+def test_long_packet_in_one_chunk_is_dropped(port):
+    long_packet = b"z" * 17
+    assert port.split_packets(b"a\t1\n" + long_packet + b"\nb\t2\n") == ["a\t1", "b\t2"]
+    assert port.dropped_bytes == len(long_packet) + 1
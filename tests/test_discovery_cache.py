@@ -0,0 +1,44 @@
+import json
+
+from arduino_factory import Arduino
+from arduino_factory.device_port import DevicePort
+
+
+def start(bench):
+    arduino = Arduino("cached", bench.factory, use_multiprocessing=False)
+    bench.factory.init()
+    first_packet = arduino.start()
+    assert first_packet.data == ["hi!"]
+    assert arduino.read(timeout=2).name == "counter"
+    return arduino
+
+
+def test_restart_skips_the_handshake(bench, tmp_path, monkeypatch):
+    path = str(tmp_path / "cache" / "discovery_cache.json")
+    board = bench.plug("cached")
+    bench.restart(discovery_cache_path=path)
+    start(bench)
+
+    # pseudo-terminals aren't USB, so they're known by their address
+    with open(path) as file:
+        entry = json.load(file)["ports"][board.address]
+    assert entry["whoiam"] == "cached"
+    assert entry["binary_supported"]
+
+    def full_handshake(*args, **kwargs):
+        raise AssertionError("The cached board should only need the quick whoiam check")
+    monkeypatch.setattr(DevicePort, "init_configure", full_handshake)
+    bench.restart(discovery_cache_path=path)
+    start(bench)
+
+
+def test_stale_entry_is_replaced(bench, tmp_path):
+    path = str(tmp_path / "discovery_cache.json")
+    board = bench.plug("cached")
+    with open(path, "w") as file:
+        json.dump(dict(ports={board.address: dict(whoiam="other", first_packet="", binary_supported=True)}), file)
+
+    bench.restart(discovery_cache_path=path)
+    start(bench)
+    with open(path) as file:
+        assert json.load(file)["ports"][board.address]["whoiam"] == "cached"
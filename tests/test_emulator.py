@@ -0,0 +1,21 @@
+import os
+import sys
+import subprocess
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code):
+    return subprocess.check_output([sys.executable, "-c", code], cwd=ROOT_DIRECTORY).decode().strip()
+
+
+def test_fork_hook_is_registered_by_the_first_emulator():
+    # importing the package alone doesn't load the emulator or touch other processes' forks
+    assert run_python("import sys, arduino_factory; print('arduino_factory.emulator' in sys.modules)") == "False"
+    assert run_python(
+        "from arduino_factory import emulator\n"
+        "print(emulator._fork_hook_registered)\n"
+        "board = emulator.VirtualArduino('fork')\n"
+        "print(emulator._fork_hook_registered)\n"
+        "board.stop()"
+    ).split() == ["False", "True"]
@@ -0,0 +1,65 @@
+import time
+import threading
+
+import pytest
+
+from arduino_factory import Arduino
+from arduino_factory.emulator import EmulatedPacket
+
+
+@pytest.fixture(params=[True, False], ids=["process", "thread"])
+def arduino(request, bench):
+    bench.plug("latest", packets=[EmulatedPacket("fast", "d", 200.0), EmulatedPacket("estop", "d", 20.0)])
+    arduino = Arduino("latest", bench.factory, use_multiprocessing=request.param)
+    bench.factory.init()
+    arduino.start()
+    return arduino
+
+
+def test_latest(arduino):
+    assert arduino.latest("fast") is None
+    assert arduino.latest_age("fast") is None
+
+    time.sleep(0.3)
+    packets = arduino.read_batch(timeout=1)
+    fast = [packet for packet in packets if packet.name == "fast"]
+    assert arduino.latest("fast") is fast[-1]
+    assert arduino.latest("estop").name == "estop"
+    assert arduino.latest("missing") is None
+
+    # packets only count once they're read
+    time.sleep(0.2)
+    assert arduino.latest("fast") is fast[-1]
+    assert arduino.latest_age("fast") > 0.2
+    assert arduino.latest("fast", max_age=0.1) is None
+    assert arduino.latest("fast", max_age=10) is fast[-1]
+
+
+def test_on_dispatches_by_name(arduino):
+    lock = threading.Lock()
+    estops = []
+    def on_estop(packets):
+        with lock:
+            estops.extend(packets)
+    def broken(packets):
+        raise ValueError("bad callback")
+
+    arduino.on("estop", broken)
+    arduino.on("estop", on_estop)
+    time.sleep(0.5)
+
+    # a failing callback doesn't stop the others
+    with lock:
+        counts = [packet.data[0] for packet in estops]
+    assert all(packet.name == "estop" for packet in estops)
+    assert len(counts) >= 5
+    assert counts == list(range(counts[0], counts[0] + len(counts)))
+    # the dispatcher keeps latest current
+    assert time.time() - arduino.latest("fast").receive_time < 0.1
+
+    arduino.off("estop", on_estop)
+    time.sleep(0.1)
+    with lock:
+        count = len(estops)
+    time.sleep(0.3)
+    assert len(estops) == count
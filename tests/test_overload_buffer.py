@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from arduino_factory import Arduino
+from arduino_factory.packet import Packet
+from arduino_factory.emulator import EmulatedPacket
+from arduino_factory.overload_buffer import OverloadBuffer
+from arduino_factory.default_params import OVERLOAD_DROP_OLDEST, OVERLOAD_DROP_NEWEST, OVERLOAD_KEEP_LATEST
+
+
+def make_packets(start, count, names=("a",)):
+    packets = []
+    for index in range(start, start + count):
+        packet = Packet()
+        packet.global_sequence_num = index
+        packet.name = names[index % len(names)]
+        packets.append(packet)
+    return packets
+
+
+def sequence_nums(packets):
+    return [packet.global_sequence_num for packet in packets]
+
+
+def test_drop_oldest_keeps_newest():
+    buffer = OverloadBuffer(OVERLOAD_DROP_OLDEST, 5)
+    assert buffer.add(make_packets(0, 8)) == 3
+    assert buffer.add_older(make_packets(-4, 4)) == 4
+    assert sequence_nums(buffer.take(10)) == [3, 4, 5, 6, 7]
+
+
+def test_drop_newest_counts_queued_packets():
+    buffer = OverloadBuffer(OVERLOAD_DROP_NEWEST, 5)
+    assert buffer.add(make_packets(0, 8), queued=3) == 6
+    assert sequence_nums(buffer.take(10)) == [0, 1]
+    assert not buffer.reclaims
+
+
+def test_keep_latest_merges_older_packets():
+    buffer = OverloadBuffer(OVERLOAD_KEEP_LATEST, 5)
+    assert buffer.add(make_packets(10, 4, names=("a", "b"))) == 2
+    # "c" is only in the older packets, so it's kept in front of the held ones
+    older = make_packets(0, 6, names=("a", "b", "c"))
+    assert buffer.add_older(older) == 5
+    assert [(packet.name, packet.global_sequence_num) for packet in buffer.take(10)] == [
+        ("c", 5), ("a", 12), ("b", 13)
+    ]
+
+
+def test_keep_latest_bounds_names():
+    buffer = OverloadBuffer(OVERLOAD_KEEP_LATEST, 3)
+    assert buffer.add(make_packets(0, 5, names=("a", "b", "c", "d", "e"))) == 2
+    # "c" was updated last, so "d" goes next
+    assert buffer.add(make_packets(2, 1, names=("a", "b", "c"))) == 1
+    assert buffer.add(make_packets(5, 1, names=("f",))) == 1
+    assert [packet.name for packet in buffer.take(10)] == ["e", "c", "f"]
+
+
+
+def test_held_packets_count_as_dropped_on_stop(bench):
+    arduino = Arduino("held", bench.factory, use_multiprocessing=False, read_queue_capacity=4,
+                      overload_policy=OVERLOAD_DROP_OLDEST)
+    # stopped while packets were waiting for room in the read queue
+    arduino._overload_buffer.add(make_packets(0, 3))
+    arduino._release_read_queue()
+    assert arduino.stats()["packets_dropped"] == 3
+
+@pytest.mark.parametrize("use_multiprocessing", [True, False], ids=["process", "thread"])
+def test_keep_latest_stalled_consumer(bench, use_multiprocessing):
+    bench.plug("latest", packets=[EmulatedPacket("a", "d", 500.0), EmulatedPacket("b", "d", 300.0)])
+    arduino = Arduino("latest", bench.factory, use_multiprocessing=use_multiprocessing, read_queue_capacity=20,
+                      overload_policy=OVERLOAD_KEEP_LATEST)
+    bench.factory.init()
+    arduino.start()
+    for _ in range(2):
+        time.sleep(1.0)
+        now = time.time()
+        packets = arduino.read_batch(timeout=1)
+
+        # one fresh packet of each name instead of what piled up during the stall
+        assert sorted(packet.name for packet in packets) == ["a", "b"]
+        assert all(now - packet.receive_time < 0.1 for packet in packets)
+    assert arduino.stats()["packets_dropped"] > 1000
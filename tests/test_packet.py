@@ -0,0 +1,47 @@
+import pickle
+import multiprocessing
+
+from arduino_factory.packet import Packet
+
+
+def make_packet():
+    packet = Packet()
+    packet.name = "imu"
+    packet.data = [1, -2.5, "ok"]
+    packet.receive_time = 1000.25
+    packet.timestamp = 12.5
+    packet.global_sequence_num = 42
+    packet.sequence_num = 7
+    packet.host_time = 1000.2
+    return packet
+
+
+def assert_same(packet, other):
+    assert type(other) is Packet
+    for name in Packet.__slots__:
+        assert getattr(other, name) == getattr(packet, name)
+
+
+def test_pickle_round_trip():
+    packet = make_packet()
+    assert not hasattr(packet, "__dict__")
+    for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+        pickled = pickle.dumps(packet, protocol)
+        assert_same(packet, pickle.loads(pickled))
+        # values only, not attribute names
+        assert b"receive_time" not in pickled
+
+    null_packet = Packet()
+    null_packet.set_null_params()
+    assert_same(null_packet, pickle.loads(pickle.dumps(null_packet)))
+
+
+def test_batch_through_a_multiprocessing_queue():
+    batch = [make_packet() for _ in range(3)]
+    batch[1].data = None
+    read_queue = multiprocessing.SimpleQueue()
+    read_queue.put(batch)
+    received = read_queue.get()
+    assert len(received) == 3
+    for packet, other in zip(batch, received):
+        assert_same(packet, other)
@@ -0,0 +1,58 @@
+import pytest
+
+from arduino_factory.packet import Packet, parse, parse_file
+
+
+def make_log_lines():
+    lines = []
+    for index in range(200):
+        packet = Packet()
+        if index % 17 == 0:
+            packet.set_null_params()
+        else:
+            packet.name = "sensor%d" % (index % 3)
+            packet.data = [index, index / 4, "ok"]
+            packet.receive_time = 1000.0 + index / 100
+            packet.timestamp = index / 100
+            packet.global_sequence_num = index
+            packet.host_time = packet.receive_time
+        lines.append("local: 0.1, data: %s" % packet)
+        if index % 23 == 0:
+            lines.append("some other log message")
+            lines.append("Packet(name=cut off, data=[1, 2")
+            lines.append("Packet(garbage)")
+        if index % 31 == 0:
+            lines.append("")
+    return lines
+
+
+def parse_each_line(lines):
+    packets = []
+    for line in lines:
+        try:
+            packet = parse(line)
+        except ValueError:
+            continue
+        if packet is not None:
+            packets.append(packet)
+    return packets
+
+
+def test_null_packet_round_trip():
+    packet = Packet()
+    packet.set_null_params()
+    parsed = parse(str(packet))
+    assert parsed.data is None
+    assert parsed.global_sequence_num == -1
+
+
+@pytest.mark.parametrize("processes, chunk_size", [(1, 1 << 20), (2, 1 << 20), (3, 512)])
+def test_parse_file_matches_parse(tmp_path, processes, chunk_size):
+    lines = make_log_lines()
+    path = tmp_path / "run.log"
+    path.write_text("\n".join(lines) + "\n")
+
+    expected = [str(packet) for packet in parse_each_line(lines)]
+    parsed = [str(packet) for packet in parse_file(str(path), processes, chunk_size)]
+    assert len(expected) == 200
+    assert parsed == expected
@@ -0,0 +1,33 @@
+import time
+
+import pytest
+
+from arduino_factory import Arduino
+from arduino_factory.emulator import EmulatedPacket
+
+
+@pytest.mark.parametrize("use_multiprocessing", [True, False], ids=["process", "thread"])
+def test_read_batch_keeps_order_with_read(bench, use_multiprocessing):
+    bench.plug("batch", packets=[EmulatedPacket("counter", "d", 500.0)])
+    arduino = Arduino("batch", bench.factory, use_multiprocessing=use_multiprocessing)
+    bench.factory.init()
+    arduino.start()
+    time.sleep(0.3)
+
+    # several batches piled up. max_items splits them without losing any
+    first = arduino.read_batch(max_items=10)
+    assert len(first) == 10
+    single = arduino.read()
+    rest = arduino.read_batch()
+    assert len(rest) > 10
+    counts = [packet.data[0] for packet in first + [single] + rest]
+    assert counts == list(range(counts[0], counts[0] + len(counts)))
+
+    arduino.stop()
+    time.sleep(0.2)
+    arduino.read_batch(timeout=0)
+    # nothing left, so it gives up after the timeout
+    start = time.time()
+    assert arduino.read_batch(timeout=0.1) == []
+    assert time.time() - start < 0.5
+    assert arduino.read_batch(timeout=0) == []
@@ -0,0 +1,40 @@
+from arduino_factory.packet import Packet
+from arduino_factory.recorder import PacketRecorder, Recording
+
+PACKETS = [
+    ("tab\tname", [1, 2.5]),
+    ("null", None),
+    ("empty", []),
+    ("new\nline", ["string\twith tab", "z"]),
+    ("tab\tname", [3, 4.5]),
+    ("big", [2 ** 70]),
+    (None, None),
+]
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "run.rec")
+    packets = []
+    for index, (name, data) in enumerate(PACKETS):
+        packet = Packet()
+        packet.global_sequence_num = index
+        packet.receive_time = 1000.0 + index
+        packet.name = name
+        packet.data = data
+        packets.append(packet)
+
+    recorder = PacketRecorder(path, index_interval=2)
+    recorder.start()
+    recorder.record(packets)
+    recorder.close()
+    assert recorder.error is None
+
+    with Recording(path) as recording:
+        recorded = [(packet.name, packet.data) for packet in recording]
+        assert [packet.global_sequence_num for packet in recording.by_sequence_num(3, 5)] == [3, 4]
+        assert [packet.global_sequence_num for packet in recording.by_time(1005.0)] == [5, 6]
+
+    # ints past 64 bits are kept as strings
+    expected = [(name, data) for name, data in PACKETS]
+    expected[5] = ("big", [str(2 ** 70)])
+    assert recorded == expected
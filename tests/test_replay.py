@@ -0,0 +1,65 @@
+import time
+
+from arduino_factory import Arduino, DeviceFactory, ReplayArduino
+from arduino_factory.packet import Packet
+
+
+def make_packets(count, interval):
+    packets = []
+    for index in range(count):
+        packet = Packet()
+        packet.name = "num"
+        packet.data = [index, index / 2]
+        packet.receive_time = 1000.0 + index * interval
+        packet.timestamp = index * interval
+        packet.global_sequence_num = index
+        packets.append(packet)
+    return packets
+
+
+def summary(packets):
+    return [(packet.name, packet.data, packet.global_sequence_num) for packet in packets]
+
+
+def test_replay_of_a_live_recording(bench, tmp_path):
+    path = str(tmp_path / "live.rec")
+    bench.plug("recorded")
+    arduino = Arduino("recorded", bench.factory, use_multiprocessing=False, record_path=path)
+    bench.factory.init()
+    first_packet = arduino.start()
+    live = []
+    while len(live) < 30:
+        live.extend(arduino.read_batch(timeout=2))
+    arduino.stop()
+    time.sleep(0.2)
+    live.extend(arduino.read_batch(timeout=0.2))
+
+    replay = ReplayArduino(path, speed=None)
+    assert replay.start().data == first_packet.data
+    assert replay.start_time == arduino.start_time
+    replayed = replay.read_batch()
+    assert summary(replayed) == summary(live)
+    assert replay.finished()
+    assert replay.read_batch(timeout=0) == []
+
+
+def test_replay_is_paced(tmp_path):
+    # a text log of printed packets, 0.1 seconds apart
+    path = str(tmp_path / "log.txt")
+    packets = make_packets(5, 0.1)
+    with open(path, "w") as file:
+        file.write("".join("%s\n" % packet for packet in packets))
+
+    factory = DeviceFactory()
+    replay = ReplayArduino(path, factory, speed=2.0)
+    replay.start()
+    start = time.time()
+    assert summary(replay.read_batch(timeout=0)) == summary(packets[:1])
+    assert replay.read_batch(timeout=0) == []
+    replayed = packets[:1]
+    while not replay.finished():
+        replayed.extend(replay.read_batch(timeout=1))
+    # 0.4 seconds of packets at double speed
+    assert 0.15 < time.time() - start < 0.5
+    assert summary(replayed) == summary(packets)
+    assert not factory.ok()
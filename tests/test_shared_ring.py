@@ -0,0 +1,108 @@
+import time
+
+import pytest
+
+from arduino_factory import Arduino
+from arduino_factory.packet import Packet
+from arduino_factory.shared_ring import SharedRingBuffer
+from arduino_factory.emulator import EmulatedPacket
+from arduino_factory.default_params import OVERLOAD_BLOCK, OVERLOAD_DROP_OLDEST
+
+
+def make_packet(sequence_num, name, data):
+    packet = Packet()
+    packet.global_sequence_num = sequence_num
+    packet.timestamp = sequence_num / 1000
+    packet.receive_time = time.time()
+    packet.host_time = packet.receive_time
+    packet.name = name
+    packet.data = data
+    return packet
+
+
+@pytest.fixture
+def ring():
+    ring = SharedRingBuffer(capacity=8)
+    yield ring
+    ring.close()
+    ring.unlink()
+
+
+def test_round_trip_keeps_int64_precision(ring):
+    big = 2 ** 53 + 1
+    assert ring.write([make_packet(0, "big", [big, -big, 1.5]), make_packet(1, "small", [1, 2.0])]) == 2
+    packets = ring.read()
+    assert [packet.data for packet in packets] == [[big, -big, 1.5], [1, 2.0]]
+    assert type(packets[1].data[0]) is int and type(packets[1].data[1]) is float
+
+
+def test_batch_that_doesnt_fit_isnt_written(ring):
+    batches = [
+        [make_packet(0, "num", [1]), make_packet(1, "str", ["hello"])],
+        [make_packet(2, "num", [1]), make_packet(3, "huge", [2 ** 64])],
+        [make_packet(4, "num", [1]), make_packet(5, "null", None)],
+        [make_packet(6, "wide", list(range(ring.max_fields + 1)))],
+    ]
+    for batch in batches:
+        assert ring.write(batch) is None
+    assert ring.available() == 0
+    assert ring.written() == 0
+
+
+def test_full_ring_stops_writing(ring):
+    packets = [make_packet(index, "num", [index]) for index in range(10)]
+    assert ring.write(packets) == 8
+    assert ring.write(packets[8:]) == 0
+    assert [packet.data[0] for packet in ring.read()] == list(range(8))
+    assert ring.consumed() == 8
+    assert ring.write(packets[8:]) == 2
+
+
+def test_mixed_packets_arrive_in_order(bench):
+    bench.plug("ring", packets=[
+        EmulatedPacket("num", "df", 800.0),
+        EmulatedPacket("str", "s", 300.0),
+        EmulatedPacket("big", "d", 200.0, data_fn=lambda index: [2 ** 60 + index]),
+    ])
+    arduino = Arduino("ring", bench.factory, use_shared_memory=True)
+    bench.factory.init()
+    arduino.start()
+    packets = []
+    deadline = time.time() + 1.0
+    while time.time() < deadline:
+        packets.extend(arduino.read_batch(timeout=0.2))
+
+    sequence_nums = [packet.global_sequence_num for packet in packets]
+    assert len(set(packet.name for packet in packets)) == 3
+    assert sequence_nums == sorted(sequence_nums)
+    bigs = [packet.data[0] for packet in packets if packet.name == "big"]
+    assert bigs == [2 ** 60 + index for index in range(len(bigs))]
+
+
+@pytest.mark.parametrize("overload_policy", [OVERLOAD_BLOCK, OVERLOAD_DROP_OLDEST])
+def test_stalled_consumer(bench, overload_policy):
+    bench.plug("ring", packets=[EmulatedPacket("num", "df", 2000.0)], use_multiprocessing=True)
+    arduino = Arduino("ring", bench.factory, use_shared_memory=True, shared_memory_capacity=64,
+                      read_queue_capacity=64, overload_policy=overload_policy)
+    bench.factory.init()
+    arduino.start()
+    time.sleep(1.0)
+
+    # every packet the device loop read is either waiting to be read or counted as dropped
+    packets = arduino.read_batch(timeout=1)
+    arduino.stop()
+    time.sleep(0.2)
+    packets.extend(arduino.read_batch(timeout=0.2))
+    stats = arduino.stats()
+
+    assert len(packets) + stats["packets_dropped"] == stats["packets_read"]
+    assert stats["read_queue_depth"] == 0
+    if overload_policy == OVERLOAD_BLOCK:
+        # the device loop stopped reading until there was room in the ring
+        assert stats["packets_dropped"] == 0
+        assert stats["packets_read"] >= 64
+    else:
+        assert stats["packets_read"] > 1000
+        assert stats["packets_dropped"] > 0
+    sequence_nums = [packet.global_sequence_num for packet in packets]
+    assert sequence_nums == sorted(sequence_nums)
@@ -0,0 +1,58 @@
+import pytest
+
+from arduino_factory import Arduino
+
+
+@pytest.fixture
+def boards(bench):
+    return [bench.plug("board%d" % index) for index in range(3)]
+
+
+def test_start_all(bench, boards):
+    factory = bench.factory
+    arduinos = [Arduino(board.whoiam, factory, use_multiprocessing=False) for board in boards]
+    factory.init()
+    arduinos[0].start()
+
+    # the started one is skipped even when it's passed explicitly
+    report = factory.start_all(arduinos, timeout=5)
+    assert sorted(report) == ["board1", "board2"]
+    for timing in report.values():
+        assert timing["opened"] <= timing["started"] <= timing["streaming"]
+    assert all(arduino.is_started() for arduino in arduinos)
+
+
+def test_start_all_failure_starts_nothing(bench, boards):
+    factory = bench.factory
+    arduinos = [Arduino(board.whoiam, factory, use_multiprocessing=False) for board in boards]
+    missing = Arduino("missing", factory, use_multiprocessing=False)
+    factory.init()
+
+    with pytest.raises(RuntimeError):
+        factory.start_all(arduinos + [missing], timeout=5)
+    assert not any(arduino.is_started() for arduino in arduinos)
+
+    # the ports that did open were handed back, so the boards can still be started
+    report = factory.start_all(arduinos, timeout=5)
+    assert sorted(report) == ["board0", "board1", "board2"]
+
+
+def test_start_all_gives_back_a_port_claimed_before_failing(bench, boards):
+    factory = bench.factory
+    arduinos = [Arduino(board.whoiam, factory, use_multiprocessing=False) for board in boards]
+    factory.init()
+
+    # the port is claimed before the baud rate is negotiated
+    failures = [RuntimeError("Lost the link")]
+    def negotiate_baud():
+        if len(failures) > 0:
+            raise failures.pop()
+    arduinos[1]._auto_baud = True
+    arduinos[1]._negotiate_baud = negotiate_baud
+
+    with pytest.raises(RuntimeError):
+        factory.start_all(arduinos, timeout=5)
+    assert all(len(factory.ports[board.whoiam]) == 1 for board in boards)
+
+    report = factory.start_all(arduinos, timeout=5)
+    assert sorted(report) == ["board0", "board1", "board2"]
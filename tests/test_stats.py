@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+from arduino_factory import Arduino
+from arduino_factory.emulator import EmulatedPacket
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.mark.parametrize("use_multiprocessing", [True, False], ids=["process", "thread"])
+def test_read_stats(bench, use_multiprocessing):
+    bench.plug("stats", packets=[EmulatedPacket("counter", "d", 200.0)])
+    arduino = Arduino("stats", bench.factory, use_multiprocessing=use_multiprocessing)
+    bench.factory.init()
+    arduino.start()
+    arduino.stats()
+    time.sleep(0.5)
+
+    # nothing has been read, so everything parsed is still queued
+    stats = arduino.stats()
+    assert stats["packets_read"] > 50
+    assert stats["read_queue_depth"] == stats["packets_read"]
+    assert 100 < stats["packet_rate"] < 300
+    assert stats["bytes_read"] > stats["packets_read"]
+    assert sum(stats["in_waiting_histogram"]) == stats["serial_reads"] > 0
+    assert stats["parse_errors"] == 0
+    assert stats["connected"]
+
+    packets = arduino.read_batch(timeout=1)
+    stats = arduino.stats()
+    assert stats["read_queue_depth"] == stats["packets_read"] - len(packets)
+
+
+def test_write_stats(bench):
+    board = bench.plug("stats")
+    arduino = Arduino("stats", bench.factory, use_multiprocessing=False)
+    bench.factory.init()
+    arduino.start()
+
+    arduino.write_pause(0.3)
+    for index in range(3):
+        arduino.write("command %d" % index)
+    assert wait_until(lambda: arduino.stats()["paused"])
+    stats = arduino.stats()
+    assert stats["write_backlog"] == 3
+    assert stats["commands_sent"] == 1
+
+    for index in range(3):
+        assert board.commands.get(timeout=1) == "command %d" % index
+    assert wait_until(lambda: arduino.stats()["write_backlog"] == 0)
+    stats = arduino.stats()
+    assert not stats["paused"]
+    assert 0.25 < stats["paused_time"] < 0.6
+    assert stats["commands_sent"] == 4
+    assert stats["bytes_written"] >= len("command 0\n") * 3
+    assert 0 < stats["write_calls"] <= 4
+
+
+def test_factory_totals(bench):
+    for index in range(2):
+        bench.plug("board%d" % index)
+    arduinos = [Arduino("board%d" % index, bench.factory, use_multiprocessing=False) for index in range(2)]
+    bench.factory.init()
+    for arduino in arduinos:
+        arduino.start()
+    time.sleep(0.3)
+    for arduino in arduinos:
+        arduino.stop()
+    time.sleep(0.2)
+
+    stats = bench.factory.stats()
+    assert sorted(stats["devices"]) == ["board0", "board1"]
+    for name in ("packets_read", "bytes_read", "read_queue_depth"):
+        assert stats["totals"][name] == sum(device[name] for device in stats["devices"].values()) > 0
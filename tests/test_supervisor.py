@@ -0,0 +1,47 @@
+import time
+
+import pytest
+
+from arduino_factory import Arduino
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def read_counter(arduino):
+    packet = arduino.read(timeout=2)
+    assert packet.name == "counter"
+    return packet
+
+
+@pytest.mark.parametrize("use_multiprocessing", [True, False], ids=["process", "thread"])
+def test_board_is_found_again_after_unplugging(bench, use_multiprocessing):
+    board = bench.plug("hotplug")
+    arduino = Arduino("hotplug", bench.factory, use_multiprocessing=use_multiprocessing, reconnect=True)
+    bench.factory.init()
+    arduino.start()
+    bench.factory.supervise(interval=0.05)
+    read_counter(arduino)
+
+    bench.unplug(board)
+    assert wait_until(lambda: not arduino.is_connected())
+    assert arduino.is_started()
+
+    # plugged back in on another port
+    bench.plug("hotplug")
+    assert wait_until(arduino.is_connected)
+    while not arduino.empty():
+        arduino.read(timeout=0)
+    # the new board counts from zero again
+    assert read_counter(arduino).data[0] < 50
+
+    stats = arduino.stats()
+    assert stats["disconnects"] == 1
+    assert stats["reconnects"] == 1
+    assert stats["last_outage"] > 0
@@ -0,0 +1,87 @@
+import time
+import queue
+
+import pytest
+
+from arduino_factory import Arduino
+
+
+@pytest.fixture(params=[True, False], ids=["process", "thread"])
+def arduino(request, bench):
+    board = bench.plug("writer")
+    arduino = Arduino("writer", bench.factory, use_multiprocessing=request.param)
+    bench.factory.init()
+    arduino.start()
+    arduino.board = board
+    return arduino
+
+
+def received(board, timeout=0.5):
+    commands = []
+    while True:
+        try:
+            commands.append(board.commands.get(timeout=timeout))
+        except queue.Empty:
+            return commands
+
+
+def test_clear_write_queue_waits_for_the_device_loop(arduino):
+    arduino.write_pause(0.3)
+    # the pause is counted as sent once it starts
+    deadline = time.time() + 1
+    while arduino.stats()["commands_sent"] == 0 and time.time() < deadline:
+        time.sleep(0.005)
+    for index in range(5):
+        arduino.write("held %d" % index)
+    arduino.write_after("scheduled", 0.2)
+
+    # nothing written before the clear goes out after it returns
+    assert arduino.clear_write_queue()
+    assert arduino.stats()["commands_dropped"] == 6
+    arduino.write("after")
+    assert received(arduino.board) == ["after"]
+
+
+def arrivals(board, count, timeout=2):
+    """(command, seconds since now) for the next count commands the board reads"""
+    start = time.time()
+    return [(board.commands.get(timeout=timeout), time.time() - start) for _ in range(count)]
+
+
+def test_scheduled_writes_go_out_in_time_order(arduino):
+    arduino.write_after("second", 0.3)
+    arduino.write_after("first", 0.15)
+    arduino.write_at("overdue", time.time() - 1)
+    arduino.write("now")
+
+    received_at = arrivals(arduino.board, 4)
+    assert sorted(command for command, _ in received_at[:2]) == ["now", "overdue"]
+    assert [command for command, _ in received_at[2:]] == ["first", "second"]
+    assert received_at[1][1] < 0.1
+    assert 0.14 < received_at[2][1] < 0.25
+    assert 0.29 < received_at[3][1] < 0.4
+
+
+def test_scheduled_writes_ignore_pauses(arduino):
+    arduino.write_pause(0.5)
+    arduino.write("held")
+    arduino.write_after("scheduled", 0.1)
+
+    received_at = arrivals(arduino.board, 2)
+    assert received_at[0][0] == "scheduled" and received_at[0][1] < 0.3
+    assert received_at[1][0] == "held" and received_at[1][1] > 0.45
+
+
+def test_cancel(arduino):
+    cancelled = arduino.write_after("cancelled", 0.2)
+    kept = arduino.write_after("kept", 0.3)
+    cancelled.cancel()
+    assert received(arduino.board) == ["kept"]
+    assert arduino.stats()["commands_dropped"] == 1
+
+    # cancelling after it was sent does nothing
+    kept.cancel()
+    arduino.write("after")
+    assert received(arduino.board) == ["after"]
+    assert arduino.stats()["commands_dropped"] == 1
+    assert arduino.stats()["write_backlog"] == 0